@@ -10,7 +10,10 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from sass import logger, utilities
-from sass.sass_runner import load_configs, SassCalibrationRunner
+from sass.sass_runner import (load_configs, SassCalibrationRunner, cache, store, aggregates,
+                              file_index, coverage)
+from sass.archive import calibrate_archive, SCHEDULERS
+from sass.pipeline import calibrate_pipelined
 
 here = Path(__file__).parent
 instrument_set_filename = 'sass/config/instrument_sets.json'
@@ -31,6 +34,57 @@ def main():
                         help='Id of the set of instruments to process. '
                              'Must be defined in instrument_sets.json or be '
                              '"all" to do all active instrument sets.')
+    parser.add_argument('--cache', dest='cache', action='store_true',
+                        help='Keep cleaned copies of the raw data in data/cache, so they '
+                             'are not cleaned again when only coefficients change.')
+    parser.add_argument('--engine', dest='engine', default='pandas', choices=['pandas', 'pyarrow'],
+                        help='How to read and clean raw data. pyarrow must be installed to use '
+                             'it. Both give the same results.')
+    parser.add_argument('--compression', dest='compression', choices=['gzip', 'zstd'],
+                        help='Compress the calibrated files. The extension .gz or .zst is '
+                             'added to their names. zstd needs zstandard to be installed.')
+    parser.add_argument('--compression-level', dest='compression_level', type=int,
+                        help='Level of compression. If omitted, the default of each kind.')
+    parser.add_argument('--ph-engine', dest='ph_engine', default='exact',
+                        choices=['exact', 'table'],
+                        help='How to calculate external pH. "table" looks up the salinity and '
+                             'temperature corrections, which is faster and within 1e-4 pH.')
+    parser.add_argument('--store', dest='store', choices=['zarr', 'netcdf'],
+                        help='Also write calibrated days to monthly Zarr stores or NetCDF files '
+                             'of each set in data/store. Needs xarray, and zarr or netCDF4.')
+    parser.add_argument('--merge-station', dest='merge_tolerance', nargs='?', const='2min',
+                        help='For pH sets, also write the calibrated CTD of the station with the '
+                             'pH of the nearest time within this tolerance (default 2min) in '
+                             'data/calibrated/stations.')
+    parser.add_argument('--aggregates', dest='aggregates', action='store_true',
+                        help='Also keep hourly and daily statistics of the calibrated data in '
+                             'data/aggregates.')
+    parser.add_argument('--workers', dest='workers', default=1, type=int,
+                        help='Calibrate up to this many parameters of a set (like chlor and o2) '
+                             'at the same time.')
+    parser.add_argument('--file-index', dest='file_index', action='store_true',
+                        help='Keep the raw files found in each month in data/file_index.json, '
+                             'and only list the directories that changed since. For long '
+                             'ranges on slow file systems.')
+    parser.add_argument('--coverage', dest='coverage', action='store_true',
+                        help='Record the rows, times and missing values of each calibrated day '
+                             'in data/coverage.sqlite, to find gaps with sass-coverage.')
+    parser.add_argument('--chunk-rows', dest='chunk_rows', type=int,
+                        help='Clean raw files this many lines at a time, so huge files (like a '
+                             'day of garbage) fit in memory. Gives the same results.')
+    parser.add_argument('--archive', dest='archive', action='store_true',
+                        help='Calibrate the days with dask, several at a time, keeping only the '
+                             'days being worked on in memory. For years of data. Needs dask.')
+    parser.add_argument('--archive-workers', dest='archive_workers', type=int,
+                        help='Days calibrated at a time with --archive. If omitted, one per core.')
+    parser.add_argument('--archive-scheduler', dest='archive_scheduler', default='threads',
+                        choices=SCHEDULERS,
+                        help='dask scheduler for --archive. processes is faster, but can not be '
+                             'used with --store or --aggregates.')
+    parser.add_argument('--pipeline', dest='pipeline', nargs='?', const=2, type=int,
+                        help='Read the next days and write the last ones in the background while '
+                             'calibrating, with up to this many days (default 2) waiting '
+                             'between the steps.')
 
     args = parser.parse_args()
 
@@ -52,14 +106,41 @@ def main():
         exit(1)
 
     # then do something!
-    runner = SassCalibrationRunner()
+    cache_dir = here.joinpath('sass', cache) if args.cache else None
+    runner = SassCalibrationRunner(cache_dir=cache_dir, engine=args.engine,
+                                   compression=args.compression,
+                                   compression_level=args.compression_level,
+                                   ph_engine=args.ph_engine,
+                                   store_dir=here.joinpath('sass', store) if args.store else None,
+                                   store_format=args.store or 'zarr',
+                                   merge_tolerance=args.merge_tolerance,
+                                   aggregates_dir=(here.joinpath('sass', aggregates)
+                                                   if args.aggregates else None),
+                                   workers=args.workers,
+                                   file_index=(here.joinpath('sass', file_index)
+                                               if args.file_index else None),
+                                   chunk_rows=args.chunk_rows,
+                                   coverage_path=(here.joinpath('sass', coverage)
+                                                  if args.coverage else None))
+    if args.archive:
+        def run(set_id):
+            return calibrate_archive(runner, set_id, start, end,
+                                     scheduler=args.archive_scheduler,
+                                     workers=args.archive_workers)
+    elif args.pipeline:
+        def run(set_id):
+            return calibrate_pipelined(runner, set_id, start, end, depth=args.pipeline)
+    else:
+        def run(set_id):
+            return runner.run(start=start, end=end, set_id=set_id)
+
     if set_id != 'all':
-        runner.run(start=start, end=end, set_id=set_id)
+        run(set_id)
     else:
         path = here.joinpath(instrument_set_filename)
         instrument_sets = load_configs(path)
         for s in instrument_sets:
-            runner.run(start=start, end=end, set_id=s.set_id)
+            run(s.set_id)
 
 
 if __name__ == '__main__':
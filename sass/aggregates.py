@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Hourly and daily statistics of calibrated data, for plots of long time ranges.
+
+While the runner has a calibrated day in memory, it can also work out the count, mean, min, max
+and standard deviation of the calibrated columns and the main CTD columns, for each hour and
+each day. These are kept in small files for each set, like
+data/aggregates/sio-ctd-2016/hourly/2021-08.parquet (a month per file)
+data/aggregates/sio-ctd-2016/daily/2021.parquet (a year per file)
+(or .csv if pyarrow isn't installed), so a plot of a year never reads the calibrated files.
+
+A day file can have a few rows from the hour before midnight or after, so the statistics are
+stored separately for each raw data file (file_date) and combined when they are read. When a
+day is calibrated again, only that day's statistics are replaced. Runs in different threads
+that share an Aggregates update one day at a time.
+"""
+
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from sass import logger
+
+# columns that get statistics, if they are in the calibrated data
+AGGREGATE_COLUMNS = ['temperature', 'salinity', 'pressure', 'conductivity', 'sigmat',
+                     'chlor', 'o2', 'O2_uM', 'corrected_ph']
+STATISTICS = ['count', 'mean', 'min', 'max', 'std']
+# time of each bucket, and how they are split into files
+LEVELS = {
+    'hourly': {'freq': 'H', 'partition': '%Y-%m'},
+    'daily': {'freq': 'D', 'partition': '%Y'},
+}
+
+
+def summarize(data, freq, file_date):
+    """Statistics of calibrated data in time buckets.
+
+    :param data: DataFrame of calibrated data with a time column (UTC)
+    :param freq: pandas frequency of the buckets, like 'H'
+    :param file_date: int like 20210826 of the raw data file
+    :return: DataFrame with time (start of each bucket), file_date and <column>_<statistic>
+    """
+    columns = [c for c in AGGREGATE_COLUMNS if c in data.columns]
+    buckets = data['time'].dt.floor(freq)
+    summary = data[columns].groupby(buckets).agg(STATISTICS)
+    summary.columns = [f'{column}_{statistic}' for column, statistic in summary.columns]
+    summary = summary.reset_index()
+    summary.insert(1, 'file_date', file_date)
+    return summary
+
+
+def combine(partials):
+    """Combine the statistics of the same bucket from different files.
+
+    :param partials: DataFrame from summarize, maybe with more than one row for a time
+    :return: DataFrame with one row for each time
+    """
+    columns = [c[:-len('_count')] for c in partials.columns if c.endswith('_count')]
+    groups = partials.groupby('time')
+    combined = pd.DataFrame(index=groups.size().index)
+    for column in columns:
+        n = partials[f'{column}_count']
+        mean = partials[f'{column}_mean']
+        count = n.groupby(partials['time']).sum()
+        total = (n * mean).fillna(0).groupby(partials['time']).sum()
+        combined_mean = (total / count.where(count > 0)).rename(None)
+        # sum of squared differences from the mean, within and between the files
+        within = (partials[f'{column}_std'] ** 2 * (n - 1)).fillna(0)
+        between = n * (mean - partials['time'].map(combined_mean)) ** 2
+        m2 = (within + between.fillna(0)).groupby(partials['time']).sum()
+
+        combined[f'{column}_count'] = count
+        combined[f'{column}_mean'] = combined_mean
+        combined[f'{column}_min'] = groups[f'{column}_min'].min()
+        combined[f'{column}_max'] = groups[f'{column}_max'].max()
+        combined[f'{column}_std'] = np.sqrt(m2 / (count - 1).where(count > 1))
+
+    return combined.reset_index()
+
+
+def utc(time):
+    """A time in UTC, like the buckets.
+
+    :param time: datetime or string, in UTC if it has no time zone
+    :return: pandas Timestamp
+    """
+    time = pd.Timestamp(time)
+    return time.tz_convert('UTC') if time.tzinfo else time.tz_localize('UTC')
+
+
+class Aggregates:
+    """Files of hourly and daily statistics of each set."""
+
+    def __init__(self, root):
+        """Where the files are.
+
+        :param root: Posix path of the directory with a subdirectory for each set
+        """
+        self.root = Path(root)
+        self.suffix = '.parquet' if pyarrow else '.csv'
+        self.lock = threading.Lock()
+
+    def path(self, set_id, level, time):
+        """The file with a time of a set.
+
+        :param set_id: unique identifier for set of instruments
+        :param level: 'hourly' or 'daily'
+        :param time: datetime
+        :return: Posix path
+        """
+        name = time.strftime(LEVELS[level]['partition']) + self.suffix
+        return self.root.joinpath(set_id, level, name)
+
+    def load(self, path):
+        """Read a file of statistics.
+
+        :param path: Posix path
+        :return: DataFrame
+        """
+        if self.suffix == '.parquet':
+            return pd.read_parquet(path)
+        return pd.read_csv(path, parse_dates=['time'])
+
+    def save(self, partials, path):
+        """Write a file of statistics, replacing it all at once.
+
+        :param partials: DataFrame
+        :param path: Posix path
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        if self.suffix == '.parquet':
+            partials.to_parquet(tmp, index=False)
+        else:
+            partials.to_csv(tmp, index=False)
+        tmp.replace(path)
+
+    def update_day(self, this_set, day, data):
+        """Replace the statistics of a day.
+
+        :param this_set: InstrumentSet
+        :param day: datetime of the raw data file
+        :param data: DataFrame of calibrated data with a time column (UTC)
+        """
+        with self.lock:
+            self._update_day(this_set, day, data)
+
+    def _update_day(self, this_set, day, data):
+        """Same as update_day, without the lock."""
+        file_date = int(day.strftime('%Y%m%d'))
+        for level, info in LEVELS.items():
+            summary = summarize(data, info['freq'], file_date)
+            # files that might have old statistics of the day, and ones that get new ones
+            times = [pd.Timestamp(day, tz='UTC') + pd.Timedelta(days=d) for d in (-1, 0, 1)]
+            paths = {self.path(this_set.set_id, level, t) for t in times}
+            paths.update(self.path(this_set.set_id, level, t) for t in summary['time'])
+            for path in sorted(paths):
+                partials = self.load(path) if path.exists() else summary.iloc[:0]
+                partials = partials.loc[partials['file_date'] != file_date]
+                new = summary.loc[[self.path(this_set.set_id, level, t) == path
+                                   for t in summary['time']]]
+                if len(partials) == 0 and len(new) == 0:
+                    if path.exists():
+                        path.unlink()
+                    continue
+                partials = pd.concat([partials, new], ignore_index=True)
+                partials = partials.sort_values(by=['time', 'file_date'], kind='stable')
+                self.save(partials.reset_index(drop=True), path)
+        logger.debug(f'Updated hourly and daily statistics of {this_set.set_id} for {file_date}')
+
+    def read(self, set_id, level, start=None, end=None):
+        """Statistics of a set.
+
+        :param set_id: unique identifier for set of instruments
+        :param level: 'hourly' or 'daily'
+        :param start: optional datetime (UTC) of the earliest bucket
+        :param end: optional datetime (UTC) of the latest bucket
+        :return: DataFrame with time (start of each bucket) and <column>_<statistic>
+        """
+        start = utc(start) if start is not None else None
+        end = utc(end) if end is not None else None
+        directory = self.root.joinpath(set_id, level)
+        paths = sorted(directory.glob('*' + self.suffix)) if directory.exists() else []
+        if start is not None or end is not None:
+            first = self.path(set_id, level, start).name if start is not None else ''
+            last = self.path(set_id, level, end).name if end is not None else '~'
+            paths = [p for p in paths if first <= p.name <= last]
+        if not paths:
+            return pd.DataFrame({'time': pd.Series([], dtype='datetime64[ns, UTC]')})
+
+        data = combine(pd.concat([self.load(p) for p in paths], ignore_index=True))
+        if start is not None:
+            data = data.loc[data['time'] >= start]
+        if end is not None:
+            data = data.loc[data['time'] <= end]
+        return data.reset_index(drop=True)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Calibrate raw SASS data that are already in memory.
+
+For other programs that have raw lines (or a DataFrame of them) and want calibrated values,
+without writing files for SassCalibrationRunner to read. The same cleaning and calibrations are
+used, and calibration coefficients are downloaded from the Google Sheet only the first time a
+set needs them. For example:
+
+from sass.api import calibrate
+calibrated = calibrate('sio-ctd-2016', lines)
+"""
+
+import time
+import threading
+
+import pandas as pd
+
+from sass import logger
+
+from . import sass_runner
+from .calibrations import calibrate_data
+
+
+class Calibrator:
+    """Calibrates raw data for any instrument set, keeping coefficient tables between calls."""
+
+    def __init__(self, config_path=None, ph_engine='exact', max_age=None, cal_paths=None):
+        """Read the instrument sets.
+
+        :param config_path: Posix path to JSON configuration file. If omitted, the usual one.
+        :param ph_engine: 'exact' or 'table' (see calibrations.get_ph)
+        :param max_age: optional number of seconds before coefficients are downloaded again.
+            If omitted, they are kept until forget_coefficients is called.
+        :param cal_paths: optional dictionary of (set_id, parameter) to Posix path of a CSV
+            copy of the coefficients to read instead of the Google Sheet
+        """
+        config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+        self.sets = {s.set_id: s for s in sass_runner.load_configs(config_path)}
+        self.ph_engine = ph_engine
+        self.max_age = max_age
+        self.cal_paths = dict(cal_paths or {})
+        self.cals = {}  # (set_id, parameter) to (time retrieved, DataFrame)
+        self.lock = threading.Lock()  # so threads that need the same coefficients get them once
+
+    def instrument_set(self, set_id):
+        """The InstrumentSet with an id.
+
+        :param set_id: unique identifier for set of instruments
+        :return: InstrumentSet
+        """
+        try:
+            return self.sets[set_id]
+        except KeyError:
+            raise ValueError(f'{set_id} is not defined in instrument_set.json') from None
+
+    def coefficients(self, set_id, parameter):
+        """Calibration coefficients of a set, downloaded if they haven't been yet (or are old).
+
+        :param set_id: unique identifier for set of instruments
+        :param parameter: 'chlor', 'o2' or 'ph'
+        :return: DataFrame of coefficients
+        """
+        key = (set_id, parameter)
+        with self.lock:
+            if key in self.cals:
+                retrieved, cals = self.cals[key]
+                if self.max_age is None or time.monotonic() - retrieved < self.max_age:
+                    return cals
+            logger.info(f'Getting calibration coefficients for {parameter} of {set_id}')
+            cals = self.instrument_set(set_id).get_cals(parameter, path=self.cal_paths.get(key))
+            self.cals[key] = (time.monotonic(), cals)
+            return cals
+
+    def forget_coefficients(self, set_id=None):
+        """Download coefficients again next time they are needed.
+
+        :param set_id: optional set to forget. If omitted, all of them.
+        """
+        with self.lock:
+            for key in list(self.cals):
+                if set_id is None or key[0] == set_id:
+                    del self.cals[key]
+
+    def parse(self, this_set, raw):
+        """Clean raw data.
+
+        :param this_set: InstrumentSet
+        :param raw: a string of lines, a list of lines (with or without line endings), or a
+            DataFrame with the set's columns (like raw files read with their names)
+        :return: DataFrame of raw data, like InstrumentSet.retrieve_and_parse_raw_data
+        """
+        if isinstance(raw, pd.DataFrame):
+            # as text so it is cleaned exactly like a file. Missing columns are empty.
+            raw = raw.reindex(columns=this_set.data_columns)
+            text = raw.to_csv(header=False, index=False)
+        elif isinstance(raw, bytes):
+            text = raw.decode('ISO-8859-1')
+        elif isinstance(raw, str):
+            text = raw
+        else:
+            text = ''.join(line if line.endswith('\n') else line + '\n' for line in raw)
+
+        return this_set.parse_raw_text(text)
+
+    def calibrate(self, set_id, raw, coefficients=None, ctd=None):
+        """Clean raw data and calibrate all the parameters of a set.
+
+        :param set_id: unique identifier for set of instruments
+        :param raw: raw data of the set (see parse)
+        :param coefficients: optional dictionary of calibration coefficients by parameter. Any
+            that are missing come from the Google Sheet.
+        :param ctd: raw data of the set with salinity (ph_salinity_set), needed for pH. If
+            omitted, pH is not calibrated.
+        :return: DataFrame with the same columns as calibrated files, plus time
+        """
+        this_set = self.instrument_set(set_id)
+        data = self.parse(this_set, raw)
+        if len(data) == 0:
+            return data
+
+        coefficients = coefficients or {}
+        cals = {parameter: coefficients[parameter] if parameter in coefficients
+                else self.coefficients(set_id, parameter)
+                for parameter in this_set.parameters}
+
+        ctd_data = None
+        if 'ph' in this_set.parameters and ctd is not None:
+            ctd_data = self.parse(self.instrument_set(this_set.ph_salinity_set), ctd)
+
+        return calibrate_data(data, this_set.calibrations, cals, ctd_data,
+                              ph_engine=self.ph_engine)
+
+
+_calibrator = None
+
+
+def calibrate(set_id, raw, coefficients=None, ctd=None):
+    """Clean raw data and calibrate all the parameters of a set.
+
+    Coefficients downloaded from the Google Sheet are kept for the next call.
+
+    :param set_id: unique identifier for set of instruments
+    :param raw: a string of lines, a list of lines, or a DataFrame with the set's columns
+    :param coefficients: optional dictionary of calibration coefficients by parameter
+    :param ctd: raw data of the set with salinity, needed for pH
+    :return: DataFrame with the same columns as calibrated files, plus time
+    """
+    global _calibrator
+    if _calibrator is None:
+        _calibrator = Calibrator()
+    return _calibrator.calibrate(set_id, raw, coefficients=coefficients, ctd=ctd)
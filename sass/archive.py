@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Calibrate years of a set in one job, a few days at a time.
+
+Reading all of a set's history before calibrating it doesn't fit in memory (1 Hz for ten years
+is over 300 million rows). In archive mode, each day file of a set is a dask task that reads,
+cleans, calibrates and writes that file, so this is a loop over the files run in parallel, not
+one lazy collection of the whole archive: a file's data never leave its task, and only the files
+being worked on (about one per worker) are in memory, however long the range is. dask's local
+scheduler spreads the tasks over the cores of the machine:
+
+./call_sass.py --set np-ctd-2016b --start 2016-01-01 --end 2021-12-31 --archive
+
+With the 'threads' scheduler, the tasks share the runner's array store and aggregates. The
+'processes' scheduler uses every core for the calibrations, which hold the GIL, but can't be
+used with them, since processes can't take turns updating a month file.
+
+This is optional: it needs dask.
+"""
+
+try:
+    import dask
+except ImportError:
+    dask = None
+
+from sass import logger
+
+SCHEDULERS = ['threads', 'processes', 'synchronous']
+
+
+def check_dask():
+    """Raise ImportError if dask isn't installed."""
+    if dask is None:
+        raise ImportError('Archive mode needs dask to be installed')
+
+
+def calibrate_day(runner, job, file):
+    """Read, calibrate and write a day file of a run.
+
+    The file is done in one task, so its data never leave the worker.
+
+    :param runner: SassCalibrationRunner
+    :param job: Job from runner.prepare
+    :param file: name of the raw file
+    :return: number of calibrated rows written, None if there were no data, or the exception
+        if it failed
+    """
+    try:
+        raw = runner.read_file(job, file)
+        if raw is None:
+            return None
+        data = runner.calibrate_file(job, file, *raw)
+        runner.write_file(job, file, data)
+        return len(data)
+    except Exception as e:
+        logger.exception(f'Calibrating {file} failed')
+        return e
+
+
+def calibrate_archive(runner, set_id, start, end, days=None, cals=None, scheduler='threads',
+                      workers=None):
+    """Calibrate the days of a set with dask, several at a time.
+
+    :param runner: SassCalibrationRunner that reads, calibrates and writes each day
+    :param set_id: unique identifier for set of instruments to be processed
+    :param start: datetime for first data to be processed
+    :param end: datetime for last data to be processed
+    :param days: optional list of datetimes (see SassCalibrationRunner.run)
+    :param cals: optional dictionary of calibration coefficients by parameter
+    :param scheduler: 'threads', 'processes' or 'synchronous'
+    :param workers: number of days calibrated at a time. If omitted, one per core.
+    :return: None if successful, 1 if not (same as SassCalibrationRunner.run)
+    """
+    check_dask()
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f'Unknown scheduler {scheduler}. Must be one of {SCHEDULERS}')
+    if scheduler == 'processes' and (runner.store or runner.aggregates):
+        raise ValueError('The processes scheduler can not write to an array store or '
+                         'aggregates. Use threads.')
+
+    job = runner.prepare(start=start, end=end, set_id=set_id, days=days, cals=cals)
+    if job is None:
+        return 1
+
+    tasks = [dask.delayed(calibrate_day)(runner, job, file, dask_key_name=f'calibrate-{file}')
+             for file in job.files]
+    results = dask.compute(*tasks, scheduler=scheduler, num_workers=workers)
+
+    failed = [file for file, result in zip(job.files, results) if isinstance(result, Exception)]
+    rows = sum(result for result in results if isinstance(result, int))
+    done = sum(isinstance(result, int) for result in results)
+    logger.info(f'Calibrated {rows} rows in {done} files of {set_id}')
+    if failed:
+        logger.error(f'{len(failed)} files of {set_id} failed: {failed}')
+        return 1
+    runner.stash_cals(job)
+    logger.info("All done!")
+    return None
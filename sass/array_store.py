@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keep the calibrated data of each set in chunked array files, as well as the daily CSVs.
+
+Reading a month or a year of a station from the daily CSV files means parsing every one of them.
+With a store, the calibrated days of a set are also written to one Zarr store (or NetCDF file)
+per month, like data/store/sio-ctd-2016/2021-08.zarr, with time as the dimension and CF
+metadata, so a long range is read from a few files of arrays.
+
+Each row remembers which raw data file (file_date, like 20210826) it came from. A new day is
+appended to the end of its month, along time, so writing a day doesn't depend on how much of the
+month is already there, and the rows of a month are in the order the days were written (reads
+sort them). When a day is calibrated again, that day's rows are replaced, so running a day twice
+gives the same store as running it once. That rewrites the month to a temporary name, which is
+then swapped in. Runs in different threads that share a store write one day at a time.
+
+This is optional: it needs xarray, and zarr for Zarr stores or netCDF4 for NetCDF files.
+"""
+
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from sass import logger
+
+# file name extension of each format
+extensions = {'zarr': '.zarr', 'netcdf': '.nc'}
+
+# CF attributes of the columns that might be in calibrated data
+attributes = {
+    'temperature': {'standard_name': 'sea_water_temperature', 'units': 'degree_Celsius',
+                    'long_name': 'Water temperature'},
+    'conductivity': {'standard_name': 'sea_water_electrical_conductivity', 'units': 'S m-1',
+                     'long_name': 'Conductivity'},
+    'pressure': {'standard_name': 'sea_water_pressure', 'units': 'dbar',
+                 'long_name': 'Pressure'},
+    'salinity': {'standard_name': 'sea_water_practical_salinity', 'units': '1',
+                 'long_name': 'Salinity'},
+    'sigmat': {'standard_name': 'sea_water_sigma_t', 'units': 'kg m-3',
+               'long_name': 'Sigma-t'},
+    'fluorometer_v': {'units': 'V', 'long_name': 'Fluorometer voltage'},
+    'chlor': {'standard_name': 'mass_concentration_of_chlorophyll_in_sea_water',
+              'units': 'ug L-1', 'long_name': 'Chlorophyll'},
+    'O2_raw_voltage': {'units': 'V', 'long_name': 'SBE63 thermistor voltage'},
+    'O2_phase_delay': {'units': 'us', 'long_name': 'SBE63 phase delay'},
+    'o2': {'standard_name': 'volume_fraction_of_oxygen_in_sea_water', 'units': 'ml L-1',
+           'long_name': 'Dissolved oxygen'},
+    'O2con': {'units': 'umol L-1', 'long_name': 'Aanderaa oxygen, not corrected'},
+    'O2sat': {'units': 'percent', 'long_name': 'Aanderaa oxygen saturation'},
+    'O2temp': {'units': 'degree_Celsius', 'long_name': 'Aanderaa temperature'},
+    'O2_uM': {'standard_name': 'mole_concentration_of_dissolved_molecular_oxygen_in_sea_water',
+              'units': 'umol L-1', 'long_name': 'Dissolved oxygen'},
+    'ph_ext': {'units': '1', 'long_name': 'External pH reported by the SeaFET'},
+    'ph_int': {'units': '1', 'long_name': 'Internal pH reported by the SeaFET'},
+    'v_ext': {'units': 'V', 'long_name': 'External pH electrode voltage'},
+    'v_int': {'units': 'V', 'long_name': 'Internal pH electrode voltage'},
+    'corrected_ph': {'standard_name': 'sea_water_ph_reported_on_total_scale', 'units': '1',
+                     'long_name': 'External pH'},
+    'file_date': {'long_name': 'Date of the raw data file the row came from (YYYYMMDD)'},
+}
+
+
+def file_day(file):
+    """Date of a raw (or calibrated) data file from its name.
+
+    :param file: name like 'sio-ctd/2021-08/data-20210826.dat'
+    :return: datetime (midnight)
+    """
+    found = re.search(r'(\d{8})\.dat', str(file))
+    if not found:
+        raise ValueError(f'No date in the name of {file}')
+    return pd.Timestamp(found.group(1)).to_pydatetime()
+
+
+class ArrayStore:
+    """Monthly Zarr stores or NetCDF files of the calibrated data of each set."""
+
+    def __init__(self, root, format='zarr', chunk_size=8192):
+        """Where the store is.
+
+        :param root: Posix path of the directory with a subdirectory for each set
+        :param format: 'zarr' or 'netcdf'
+        :param chunk_size: number of times in each chunk
+        """
+        if xr is None:
+            raise ImportError('Writing to an array store needs xarray to be installed')
+        if format not in extensions:
+            raise ValueError(f'Unknown format {format}. Must be one of {list(extensions)}')
+        self.root = Path(root)
+        self.format = format
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+
+    def path(self, set_id, day):
+        """The file with a day of a set.
+
+        :param set_id: unique identifier for set of instruments
+        :param day: datetime
+        :return: Posix path
+        """
+        return self.root.joinpath(set_id, day.strftime('%Y-%m') + extensions[self.format])
+
+    def paths(self, set_id, start, end):
+        """The files that might have data of a set between two times.
+
+        A day file can have a few rows from the day before or after, so the months around
+        the range are included.
+
+        :param set_id: unique identifier for set of instruments
+        :param start: datetime
+        :param end: datetime
+        :return: list of Posix paths that exist, in order
+        """
+        months = pd.period_range(naive(start) - pd.DateOffset(days=1),
+                                 naive(end) + pd.DateOffset(days=1), freq='M')
+        paths = [self.path(set_id, month.to_timestamp()) for month in months]
+        return [path for path in paths if path.exists()]
+
+    def load(self, path):
+        """Read a whole month file.
+
+        :param path: Posix path
+        :return: DataFrame with a time column (UTC)
+        """
+        with self.open(path) as ds:
+            data = ds.to_dataframe()
+        data = data.reset_index()
+        data['time'] = data['time'].dt.tz_localize('UTC')
+        data = data.sort_values(by=['time', 'file_date'], kind='stable')
+        return data.reset_index(drop=True)
+
+    def days(self, path):
+        """The raw data files a month file has rows of.
+
+        :param path: Posix path of the month file
+        :return: set of file_dates, like 20210826
+        """
+        with self.open(path) as ds:
+            return {int(day) for day in np.unique(ds['file_date'].values)}
+
+    def open(self, path):
+        """Open a month file lazily.
+
+        :param path: Posix path
+        :return: xarray Dataset
+        """
+        if self.format == 'zarr':
+            return xr.open_zarr(path)
+        return xr.open_dataset(path)
+
+    def to_dataset(self, this_set, data):
+        """Convert calibrated data to arrays with CF metadata.
+
+        :param this_set: InstrumentSet
+        :param data: DataFrame with a time column (UTC) and a file_date column
+        :return: xarray Dataset
+        """
+        data = data.copy()
+        data['time'] = data['time'].dt.tz_convert(None)
+        for column in data.columns:
+            if column != 'time' and not pd.api.types.is_numeric_dtype(data[column]):
+                data[column] = data[column].astype(str)
+        ds = xr.Dataset.from_dataframe(data.set_index('time'))
+
+        for name, variable in ds.data_vars.items():
+            variable.attrs.update(attributes.get(name, {}))
+        ds['time'].attrs.update({'standard_name': 'time', 'long_name': 'Time', 'axis': 'T'})
+        ds.attrs.update({
+            'Conventions': 'CF-1.8',
+            'featureType': 'timeSeries',
+            'title': f'SASS calibrated data for {this_set.set_id}',
+            'id': this_set.set_id,
+            'station_name': this_set.station_name or '',
+            'ip': this_set.ip or '',
+        })
+
+        # time is unlimited in NetCDF files, so chunks can be longer than the first day
+        chunks = (self.chunk_size,)
+        encoding = {'time': {'units': 'seconds since 1970-01-01 00:00:00', 'dtype': 'float64',
+                             'calendar': 'standard', '_FillValue': None}}
+        for name in ds.data_vars:
+            if self.format == 'zarr':
+                encoding[name] = {'chunks': chunks}
+            elif ds[name].dtype.kind == 'f':
+                encoding[name] = {'zlib': True, 'chunksizes': chunks}
+        for name in list(ds.variables):
+            ds[name].encoding = encoding.get(name, {})
+
+        return ds
+
+    def write_day(self, this_set, day, data):
+        """Add (or replace) the calibrated data of a day.
+
+        :param this_set: InstrumentSet
+        :param day: datetime of the raw data file
+        :param data: DataFrame of calibrated data with a time column (UTC)
+        :return: Posix path of the month file
+        """
+        with self.lock:
+            return self._write_day(this_set, day, data)
+
+    def _write_day(self, this_set, day, data):
+        """Same as write_day, without the lock."""
+        path = self.path(this_set.set_id, day)
+        file_date = int(day.strftime('%Y%m%d'))
+        data = data.assign(file_date=file_date)
+        data = data.sort_values(by=['time'], kind='stable').reset_index(drop=True)
+        ds = self.to_dataset(this_set, data)
+
+        if not path.exists():
+            self.create(path, ds)
+            logger.debug(f'Wrote {len(data)} rows to {path}')
+            return path
+
+        with self.open(path) as old:
+            same = set(old.data_vars) == set(ds.data_vars)
+        if file_date not in self.days(path) and same:
+            self.append(path, ds)
+            logger.debug(f'Appended {len(data)} rows to {path}')
+            return path
+
+        # the day was calibrated before (or the columns changed), so rewrite the month
+        old = self.load(path)
+        old = old.loc[old['file_date'] != file_date]
+        data = pd.concat([old, data], ignore_index=True)
+        data = data.sort_values(by=['time', 'file_date'], kind='stable')
+        data.reset_index(drop=True, inplace=True)
+        self.create(path, self.to_dataset(this_set, data))
+        logger.debug(f'Rewrote {path} with {len(data)} rows')
+
+        return path
+
+    def create(self, path, ds):
+        """Write a whole month file, replacing it if there is one.
+
+        :param path: Posix path of the month file
+        :param ds: xarray Dataset from to_dataset
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        remove(tmp)
+        if self.format == 'zarr':
+            ds.to_zarr(tmp, mode='w')
+        else:
+            ds.to_netcdf(tmp, unlimited_dims=['time'])
+        # swap the new file in
+        old = path.with_name(path.name + '.old')
+        remove(old)
+        if path.exists():
+            path.rename(old)
+        tmp.rename(path)
+        remove(old)
+
+    def append(self, path, ds):
+        """Add times to the end of a month file, with the same variables.
+
+        :param path: Posix path of the month file
+        :param ds: xarray Dataset from to_dataset
+        """
+        if self.format == 'zarr':
+            for variable in ds.variables.values():
+                variable.encoding = {}  # the store already has them
+            ds.to_zarr(path, append_dim='time')
+            return
+
+        if netCDF4 is None:
+            raise ImportError('Writing NetCDF files needs netCDF4 to be installed')
+        with netCDF4.Dataset(path, 'a') as nc:
+            start = len(nc.dimensions['time'])
+            stop = start + ds.sizes['time']
+            for name, variable in ds.variables.items():
+                values = variable.values
+                if name == 'time':  # in the units of the file
+                    values = (values - np.datetime64('1970-01-01')) / np.timedelta64(1, 's')
+                nc.variables[name][start:stop] = values
+
+    def read_path(self, path, start, end, columns=None):
+        """Read part of a month file.
+
+        :param path: Posix path of the month file
+        :param start: datetime (UTC) of earliest time
+        :param end: datetime (UTC) of latest time
+        :param columns: optional list of columns. If omitted, all of them.
+        :return: DataFrame with a time column (UTC)
+        """
+        start = np.datetime64(naive(start))
+        end = np.datetime64(naive(end))
+        with self.open(path) as ds:
+            if columns is not None:
+                ds = ds[[c for c in columns if c in ds.data_vars]]
+            times = ds['time'].values
+            keep = (times >= start) & (times <= end)
+            data = ds.isel(time=np.flatnonzero(keep)).to_dataframe()
+        data = data.reset_index()
+        data['time'] = data['time'].dt.tz_localize('UTC')
+        return data
+
+    def read(self, set_id, start, end, columns=None):
+        """Read the calibrated data of a set between two times.
+
+        :param set_id: unique identifier for set of instruments
+        :param start: datetime (UTC) of earliest time
+        :param end: datetime (UTC) of latest time
+        :param columns: optional list of columns. If omitted, all of them.
+        :return: DataFrame with a time column (UTC), sorted by time
+        """
+        frames = [self.read_path(path, start, end, columns)
+                  for path in self.paths(set_id, start, end)]
+        if not frames:
+            return pd.DataFrame({'time': pd.Series([], dtype='datetime64[ns, UTC]')})
+
+        data = pd.concat(frames, ignore_index=True)
+        return data.sort_values(by=['time'], kind='stable').reset_index(drop=True)
+
+
+def naive(time):
+    """A time in UTC without a time zone, like xarray keeps them.
+
+    :param time: datetime or string, in UTC if it has no time zone
+    :return: pandas Timestamp
+    """
+    time = pd.Timestamp(time)
+    return time.tz_convert(None) if time.tzinfo else time
+
+
+def remove(path):
+    """Remove a file or directory if it exists.
+
+    :param path: Posix path
+    """
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
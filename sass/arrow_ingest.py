@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read and clean raw data files with pyarrow.
+
+This does the same thing as InstrumentSet.retrieve_and_parse_raw_data up to the point where only
+good lines are left, but with pyarrow's multithreaded CSV reader and its string functions
+instead of Python string objects. It is optional: pyarrow must be installed, and it is only used
+when asked for with engine='pyarrow'.
+
+To give the same results, it has to copy some things pandas does on its own:
+* Every column is read as text and then a column is converted to numbers only if every value in
+  the whole file looks like a number, because that is when pandas would have done it.
+* Lines with gibberish or a missing value in any text column are dropped.
+
+pyarrow's CSV reader can't read lines with the wrong number of fields without calling back into
+Python for each one, which is slow on days that are mostly garbage. So it is only used when every
+line is right. Otherwise the lines are split into fields with pyarrow's string functions instead,
+and short lines are filled with missing values the way pandas does. Only lines with the right
+number of fields are kept, because the others are almost always garbled, but the fields of short
+lines still count when deciding which columns are numbers. Long lines are dropped (pandas can't
+read files with them at all).
+
+This isn't faster than pandas on one core: it takes about as long on a typical day file and about
+1.4 times as long on a day that is mostly garbage (see the benchmarks in
+tests/test_arrow_ingest.py). The CSV reader uses more threads when there are more cores.
+
+Whitespace delimited files (SIO SCS) can't be read by pyarrow, so read_and_clean returns None
+for them and the pandas version is used instead.
+"""
+
+import string
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+from sass import logger
+
+# anything that is not one of these is gibberish. Same as the characters in
+# InstrumentSet.retrieve_and_parse_raw_data: digits, letters, punctuation and whitespace.
+gibberish = '[^' + ''.join('\\x%02x' % ord(c) for c in string.printable) + ']'
+
+# what pandas reads as numbers
+integer = r'^[+-]?[0-9]+$'
+number = r'^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$'
+
+# values that pandas reads as missing by default
+na_values = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+             '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+def numeric_type(column):
+    """Find what pandas would have converted a column of text to.
+
+    :param column: pyarrow string array
+    :return: pa.int64(), pa.float64() or None if it stays text
+    """
+    trimmed = pc.drop_null(pc.utf8_trim_whitespace(column))
+    if pc.all(pc.match_substring_regex(trimmed, integer)).as_py() is not False:
+        if column.null_count == 0:
+            return pa.int64()
+        return pa.float64()
+    if pc.all(pc.match_substring_regex(trimmed, number)).as_py() is not False:
+        return pa.float64()
+    return None
+
+
+def read_lines(path):
+    """Read the lines of a file, without the blank ones (pandas skips those too).
+
+    :param path: Posix path to the raw file
+    :return: pyarrow string array
+    """
+    with open(path, 'rb') as f:
+        text = pa.array([f.read().decode('ISO-8859-1')], type=pa.large_string())
+    lines = pc.list_flatten(pc.split_pattern_regex(text, r'\r\n|\n|\r'))
+    return pc.cast(lines.filter(pc.not_equal(lines, '')), pa.string())
+
+
+def split_fields(lines, names, columns):
+    """Split comma delimited lines into columns, as pandas would read them.
+
+    :param lines: pyarrow string array of lines with at most as many fields as names
+    :param names: column names
+    :param columns: names of the columns to return
+    :return: pyarrow Table of the columns as text. Missing fields and values that pandas reads
+        as missing are null.
+    """
+    # pad short lines with empty fields so every line splits into the same number of fields
+    padding = pc.binary_repeat(',', pc.subtract(len(names) - 1, pc.count_substring(lines, ',')))
+    fields = pc.split_pattern(pc.binary_join_element_wise(lines, padding, ''), ',')
+    missing = pa.array(na_values)
+    table = {}
+    for name in columns:
+        column = pc.list_element(fields, names.index(name))
+        table[name] = pc.if_else(pc.is_in(column, value_set=missing), None, column)
+    return pa.table(table)
+
+
+def read_and_clean(this_set, path):
+    """Read a raw data file and remove the bad lines.
+
+    :param this_set: InstrumentSet that describes the file
+    :param path: Posix path to the raw file
+    :return: DataFrame of only the good lines (not yet sorted or converted to time), or None
+        if pyarrow can't read the file
+    """
+    if pa is None:
+        raise ImportError('engine="pyarrow" needs pyarrow to be installed')
+
+    with open(path, encoding="ISO-8859-1") as f:
+        if ',' not in f.readline():
+            logger.debug(f'{path} is whitespace delimited. Reading with pandas instead.')
+            return None
+
+    names = this_set.data_columns
+    usecols = this_set.usecols
+    start_column = names[2]  # skipping fields server time and ip
+
+    try:
+        # quickest, but only if every line has the right number of fields
+        table = pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(column_names=names, encoding="ISO-8859-1"),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=usecols, column_types={name: pa.string() for name in usecols},
+                null_values=na_values, strings_can_be_null=True))
+        readable = table
+    except pa.ArrowInvalid:
+        lines = read_lines(path)
+        commas = pc.count_substring(lines, ',')
+        # pandas wouldn't read the file at all with a line that has too many fields
+        readable = pc.less(commas, len(names))
+        commas = commas.filter(readable)
+        readable = split_fields(lines.filter(readable), names, usecols)
+        table = readable.filter(pc.equal(commas, len(names) - 1))
+
+    # decide which columns are numbers based on the whole file, like pandas does. Short lines
+    # count too, even though only the lines with the right number of fields are kept.
+    types = {name: numeric_type(readable[name]) for name in usecols}
+
+    # some incoming files have data from multiple instruments, so filter to just one
+    table = table.filter(pc.fill_null(pc.equal(table['ip'], this_set.ip), False))
+    if table.num_rows == 0:
+        return table.to_pandas()
+
+    # drop lines with gibberish or nothing at all in any text column
+    good = None
+    for name in usecols:
+        if types[name] is None:
+            ok = pc.invert(pc.fill_null(pc.match_substring_regex(table[name], gibberish), True))
+            good = ok if good is None else pc.and_(good, ok)
+    if good is not None:
+        table = table.filter(good)
+
+    if start_column == 'temperature' and types['temperature'] is None:
+        # all remaining lines should have a hash mark, then only take the numbers
+        table = table.filter(pc.match_substring(table['temperature'], '#'))
+        temperature = pc.replace_substring_regex(table['temperature'],
+                                                 pattern=r'[^0-9.\-]', replacement='')
+        # some lines are empty after the ip (and hash mark)
+        temperature = pc.if_else(pc.equal(temperature, ''), None, temperature)
+        table = table.set_column(table.column_names.index('temperature'), 'temperature',
+                                 temperature)
+    table = table.filter(pc.is_valid(table['temperature']))
+    if table.num_rows == 0:
+        return table.to_pandas()
+
+    # a variation might be to have date and time in separate columns
+    if 'sensor_date' in usecols and 'sensor_time' in usecols:
+        # but if it is, it had better not have times in the date column
+        table = table.filter(pc.invert(pc.match_substring(table['sensor_date'], ':')))
+        sensor_date = table['sensor_date']
+        if this_set.date_format:
+            dates = pc.strptime(sensor_date, format=this_set.date_format, unit='s',
+                                error_is_null=True)
+            table = table.filter(pc.is_valid(dates))
+            sensor_date = pc.strftime(dates.filter(pc.is_valid(dates)), format='%d %b %Y ')
+        sensor_time = pc.binary_join_element_wise(sensor_date, table['sensor_time'], '')
+        table = table.set_column(table.column_names.index('sensor_time'), 'sensor_time',
+                                 sensor_time)
+        table = table.drop(['sensor_date'])
+
+    # It's important there is a value for time and that it look like time
+    table = table.filter(pc.match_substring(table['sensor_time'], ':'))
+
+    for name, numeric in types.items():
+        if numeric is not None and name in table.column_names:
+            column = pc.cast(pc.utf8_trim_whitespace(table[name]), numeric)
+            table = table.set_column(table.column_names.index(name), name, column)
+
+    return table.to_pandas()
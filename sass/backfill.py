@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Plan and execute the reprocessing of times past.
+
+Reprocessing years of data for all the instrument sets is broken into work units of one set
+for one month. The plan estimates the cost of each unit from the size of its raw files and puts
+the most expensive first, so the slow ones don't hold up the end of the job.
+
+Completed units are written to a journal as they finish. If the job is interrupted, running
+it again with the same journal picks up where it stopped.
+
+The calibration coefficients are downloaded once when planning and kept in a directory next to
+the plan, so the units don't each download them again.
+"""
+
+import os
+import json
+import argparse
+import datetime
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dateutil.relativedelta import relativedelta
+
+from sass import logger, utilities
+
+from . import sass_runner
+from .discovery import find_files
+
+
+class WorkUnit:
+    """One instrument set for one month (or less at the ends of the requested range)."""
+    def __init__(self, set_id, start, end, size=0, files=0):
+        """Describe a piece of the reprocessing.
+
+        :param set_id: unique identifier of the instrument set (string)
+        :param start: datetime of the first day to process
+        :param end: datetime of the last day to process
+        :param size: bytes of raw data found for these days (int)
+        :param files: number of raw data files found for these days (int)
+        """
+        self.set_id = set_id
+        self.start = start
+        self.end = end
+        self.size = size
+        self.files = files
+
+    def __repr__(self):
+        """Returns a printable string."""
+        return str(self)
+
+    def __str__(self):
+        """Returns a summary of the WorkUnit."""
+        return f'WorkUnit{{{self.key},files={self.files},size={self.size}}}'
+
+    @property
+    def key(self):
+        """Identifier used in the journal."""
+        return f'{self.set_id}/{self.start.date()}/{self.end.date()}'
+
+    def to_dict(self):
+        """Convert to something JSON can write."""
+        return {'set_id': self.set_id, 'start': self.start.isoformat(),
+                'end': self.end.isoformat(), 'size': self.size, 'files': self.files}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Convert back from what JSON read."""
+        return cls(d['set_id'], utilities.parse_datetime(d['start']),
+                   utilities.parse_datetime(d['end']), d['size'], d['files'])
+
+
+def plan(start, end, set_ids=None, config_path=None, incoming_dir=None):
+    """Split the reprocessing into units of one set for one month and order them by cost.
+
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :param set_ids: list of set_ids to include. If omitted, all active sets
+    :param config_path: Posix path to JSON configuration file
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: list of WorkUnits, most expensive first. Months without any raw data are left out.
+    """
+    config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+    incoming_dir = Path(incoming_dir or sass_runner.here.joinpath(sass_runner.incoming))
+
+    units = []
+    for this_set in sass_runner.load_configs(config_path):
+        if set_ids and this_set.set_id not in set_ids:
+            continue
+        if not this_set.start_date:
+            continue  # not active yet
+        set_start = max(start, this_set.start_date)
+        set_end = min(end, this_set.end_date)
+
+        month = set_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while month <= set_end:
+            next_month = month + relativedelta(months=1)
+            unit_start = max(month, set_start)
+            unit_end = min(next_month - relativedelta(days=1), set_end)
+            month = next_month
+            if unit_start.date() > unit_end.date():
+                continue
+
+            files = find_files(this_set, unit_start, unit_end, incoming_dir)
+            if files:
+                units.append(WorkUnit(this_set.set_id, unit_start, unit_end,
+                                      sum(f.size for f in files), len(files)))
+
+    units.sort(key=lambda u: u.size, reverse=True)
+    return units
+
+
+def fetch_cals(units, cals_dir, config_path=None):
+    """Download the calibration coefficients of the sets of a plan, once.
+
+    :param units: list of WorkUnits
+    :param cals_dir: Posix path of a directory to keep them in, as <set_id>_<parameter>.csv
+    :param config_path: Posix path to JSON configuration file
+    """
+    config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+    cals_dir = Path(cals_dir)
+    cals_dir.mkdir(parents=True, exist_ok=True)
+    set_ids = {unit.set_id for unit in units}
+    for this_set in sass_runner.load_configs(config_path):
+        if this_set.set_id not in set_ids:
+            continue
+        for parameter in this_set.parameters:
+            if this_set.cal_gids[parameter] == 1:
+                continue  # builtin, nothing to download
+            logger.info(f'Getting calibration coefficients for {parameter} of '
+                        f'{this_set.set_id}')
+            cals = this_set.get_cals(parameter)
+            cals.to_csv(cals_dir.joinpath(f'{this_set.set_id}_{parameter}.csv'), index=False)
+
+
+def read_cals(this_set, cals_dir):
+    """The calibration coefficients of a set that fetch_cals kept.
+
+    :param this_set: InstrumentSet
+    :param cals_dir: Posix path of the directory given to fetch_cals
+    :return: dictionary of calibration coefficients by parameter
+    """
+    cals = {}
+    for parameter in this_set.parameters:
+        path = Path(cals_dir).joinpath(f'{this_set.set_id}_{parameter}.csv')
+        if this_set.cal_gids[parameter] == 1 or path.exists():
+            cals[parameter] = this_set.get_cals(parameter, path=path)
+    return cals
+
+
+def write_plan(plan_path, units, config_path=None, incoming_dir=None, outgoing_dir=None,
+               cals_dir=None):
+    """Write a plan, with where to find the data, for execute.
+
+    :param plan_path: Posix path of the JSON file
+    :param units: list of WorkUnits
+    :param config_path: optional Posix path to JSON configuration file
+    :param incoming_dir: optional Posix path to the directory where raw data are found
+    :param outgoing_dir: optional Posix path to the directory where calibrated data are written
+    :param cals_dir: optional Posix path of the coefficients from fetch_cals
+    """
+    paths = {'config_path': config_path, 'incoming_dir': incoming_dir,
+             'outgoing_dir': outgoing_dir, 'cals_dir': cals_dir}
+    with open(plan_path, 'w') as f:
+        json.dump({**{key: str(Path(value).absolute()) if value else None
+                      for key, value in paths.items()},
+                   'units': [unit.to_dict() for unit in units]}, f, indent=2)
+
+
+def read_plan(plan_path):
+    """Read a plan written by write_plan.
+
+    :param plan_path: Posix path of the JSON file
+    :return: (list of WorkUnits, dictionary of config_path, incoming_dir, outgoing_dir and
+        cals_dir, which are None if they weren't given)
+    """
+    with open(plan_path, 'r') as f:
+        plan = json.load(f)
+    if isinstance(plan, list):  # plans used to be only the units
+        plan = {'units': plan}
+    units = [WorkUnit.from_dict(d) for d in plan.pop('units')]
+    return units, {key: plan.get(key)
+                   for key in ['config_path', 'incoming_dir', 'outgoing_dir', 'cals_dir']}
+
+
+def read_journal(journal_path):
+    """Find the units that are already done.
+
+    :param journal_path: Posix path to the journal
+    :return: set of keys of completed WorkUnits
+    """
+    done = set()
+    if not Path(journal_path).exists():
+        return done
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # half written line from a crash
+            if entry['status'] == 'done':
+                done.add(entry['key'])
+    return done
+
+
+def write_journal(journal_path, unit, status):
+    """Record how a unit finished. Flushed to disk so it survives a crash.
+
+    :param journal_path: Posix path to the journal
+    :param unit: the WorkUnit that finished
+    :param status: 'done' or 'failed'
+    """
+    entry = {'key': unit.key, 'status': status,
+             'finished': datetime.datetime.utcnow().isoformat()}
+    with open(journal_path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_unit(unit, config_path=None, incoming_dir=None, outgoing_dir=None, cals_dir=None):
+    """Process one WorkUnit with the normal runner.
+
+    :param unit: the WorkUnit to process
+    :param config_path: optional Posix path to JSON configuration file
+    :param incoming_dir: optional Posix path to the directory where raw data are found
+    :param outgoing_dir: optional Posix path to the directory where calibrated data are written
+    :param cals_dir: optional Posix path of the coefficients from fetch_cals. If omitted, they
+        are downloaded.
+    :return: None if successful, 1 if not (same as SassCalibrationRunner.run)
+    """
+    runner = sass_runner.SassCalibrationRunner(config_path=config_path,
+                                               incoming_dir=incoming_dir,
+                                               outgoing_dir=outgoing_dir)
+    cals = None
+    if cals_dir:
+        configs = sass_runner.load_configs(runner.config_path, set=unit.set_id)
+        if configs:
+            cals = read_cals(configs[0], cals_dir)
+    return runner.run(start=unit.start, end=unit.end, set_id=unit.set_id, cals=cals)
+
+
+def execute(units, journal_path, workers=1, run=None, config_path=None, incoming_dir=None,
+            outgoing_dir=None, cals_dir=None):
+    """Run the WorkUnits that haven't been done yet with a pool of workers.
+
+    :param units: list of WorkUnits
+    :param journal_path: Posix path to the journal
+    :param workers: number of processes (int)
+    :param run: function that processes a WorkUnit. If omitted, run_unit with the paths.
+    :param config_path: optional Posix path to JSON configuration file
+    :param incoming_dir: optional Posix path to the directory where raw data are found
+    :param outgoing_dir: optional Posix path to the directory where calibrated data are written
+    :param cals_dir: optional Posix path of the coefficients from fetch_cals
+    :return: number of units that failed
+    """
+    if run is None:
+        run = partial(run_unit, config_path=config_path, incoming_dir=incoming_dir,
+                      outgoing_dir=outgoing_dir, cals_dir=cals_dir)
+    done = read_journal(journal_path)
+    if Path(journal_path).exists():
+        # a crash might have left half a line. Start the next entry on its own line.
+        with open(journal_path, 'rb+') as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    todo = [unit for unit in units if unit.key not in done]
+    logger.info(f'{len(units) - len(todo)} of {len(units)} units already done. '
+                f'{len(todo)} to go.')
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, unit): unit for unit in todo}
+        for future in as_completed(futures):
+            unit = futures[future]
+            try:
+                code = future.result()
+            except Exception as e:
+                logger.error(f'{unit} raised {e!r}')
+                code = 1
+            if code:
+                failed += 1
+                write_journal(journal_path, unit, 'failed')
+            else:
+                write_journal(journal_path, unit, 'done')
+                logger.info(f'Finished {unit}')
+
+    return failed
+
+
+def main():
+    """Organizes the input arguments for planning or executing a backfill."""
+    parser = argparse.ArgumentParser(description='Reprocess past SASS data in resumable units.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan', help='Write the list of work units.')
+    plan_parser.add_argument('-t1', '--start', dest='start', required=True, type=str,
+                             help='Start date as yyyy-mm-dd.')
+    plan_parser.add_argument('-t2', '--end', dest='end', required=True, type=str,
+                             help='End date as yyyy-mm-dd.')
+    plan_parser.add_argument('-s', '--set', dest='set_ids', action='append',
+                             help='Id of a set of instruments to include. Can be repeated. '
+                                  'If omitted, all active instrument sets.')
+    plan_parser.add_argument('-p', '--plan', dest='plan', required=True, type=str,
+                             help='JSON file to write the plan to. The calibration coefficients '
+                                  'are downloaded to a directory next to it, like '
+                                  'backfill.cals/.')
+
+    execute_parser = subparsers.add_parser('execute', help='Run the work units in a plan.')
+    execute_parser.add_argument('-p', '--plan', dest='plan', required=True, type=str,
+                                help='JSON file written by plan.')
+    execute_parser.add_argument('-j', '--journal', dest='journal', required=True, type=str,
+                                help='File that records finished units. Reuse it to resume.')
+    execute_parser.add_argument('-w', '--workers', dest='workers', default=1, type=int,
+                                help='Number of processes.')
+
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        start = utilities.parse_datetime(args.start + "T00:00:00Z")
+        end = utilities.parse_datetime(args.end + "T00:00:00Z")
+        units = plan(start, end, set_ids=args.set_ids)
+        cals_dir = Path(args.plan).with_suffix('.cals')
+        fetch_cals(units, cals_dir)
+        write_plan(args.plan, units, cals_dir=cals_dir)
+        logger.info(f'Planned {len(units)} units')
+    else:
+        units, paths = read_plan(args.plan)
+        failed = execute(units, args.journal, workers=args.workers, **paths)
+        if failed:
+            logger.error(f'{failed} units failed. Run again to retry them.')
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
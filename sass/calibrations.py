@@ -3,6 +3,8 @@
 
 """Functions call the calibration routines with actual data."""
 
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
 from sass import logger
@@ -10,6 +12,7 @@ from sass import logger
 from .sbe63_o2 import calibrate_oxygen, calibrate_temperature
 from .aanderaa_o2 import correct_oxygen
 from .seafet_ph import calibrate_ph
+from .ph_lookup import calibrate_external_ph
 from .ctd_chlorophyll import calibrate_chlorophyll
 
 
@@ -37,10 +40,8 @@ def get_o2(data, cals):
                      C0=None, C1=None, C2=None, E=None, **kwargs)
     """
     # merge the important cali columns with the data to get right calis for dates
-    try:
-        cals.drop(columns=['START TIME', 'SERIAL NUMBER', 'CALIBRATION DATE'], inplace=True)
-    except KeyError:
-        pass
+    # (a copy, so the coefficients can be used again)
+    cals = cals.drop(columns=['START TIME', 'SERIAL NUMBER', 'CALIBRATION DATE'], errors='ignore')
     data_all = pd.merge_asof(data, cals, on=['time'], direction='backward')
 
     # Calculate the O2 sensor temperature (overwrites the CTD temperature)
@@ -54,13 +55,16 @@ def get_o2(data, cals):
     return data_all['oxygen_calc'].round(2)
 
 
-def get_ph(data, cals, ctd_data):
+def get_ph(data, cals, ctd_data, engine='exact'):
     """Call the pH calibration with data and coefficients.
     
     Have to get the data for salinity too
     And calibrations organized by instrument serial number instead of date
     Sensor,Kext0,Kext2,Kint0,Kint2
     TODO: Have them reorganize pH coeffs by date
+
+    engine can be 'exact' to use the equations for each row, or 'table' to look up the
+    salinity and temperature corrections for all the rows at once (see ph_lookup.py)
     """
     # Which instrument?
     instrument = data['serial_number'].unique()  # i.e. SEAFET02145
@@ -68,15 +72,31 @@ def get_ph(data, cals, ctd_data):
         logger.error('More than one instrument in file.  Fix code.')
     instrument = int(instrument[0].replace('SEAFET', ''))
 
-    # Prep data
-    data_all = data[['time', 'v_ext', 'temperature']].copy()
-    data_all.rename(columns={'v_ext': 'voltage'}, inplace=True)
+    data_all = ph_inputs(data, ctd_data)
 
     # transfer those calibration coefficients into data
     cal = cals.loc[cals['SERIAL NUMBER'].astype(int) == instrument]
     data_all['k0'] = cal['Kext0'].values[0]
     data_all['k2'] = cal['Kext2'].values[0]
 
+    if engine == 'table':
+        data_all['calc_ph'] = calibrate_external_ph(**data_all)
+    else:
+        data_all['calc_ph'] = data_all.apply(lambda x: calibrate_ph(**x, external=True), axis=1)
+    return data_all['calc_ph'].round(2)
+
+
+def ph_inputs(data, ctd_data):
+    """Voltage and temperature of the SeaFET, with salinity of the CTD at the same times.
+
+    :param data: DataFrame of cleaned raw SeaFET data
+    :param ctd_data: DataFrame of cleaned raw data from the set with salinity
+    :return: DataFrame with time, voltage, temperature and salinity for each row with voltage,
+        sorted by time
+    """
+    data_all = data[['time', 'v_ext', 'temperature']].copy()
+    data_all.rename(columns={'v_ext': 'voltage'}, inplace=True)
+
     # interpolate salinity to times with voltage
     ctd_data = ctd_data[['time', 'salinity']]
     data_all = data_all.merge(ctd_data, on=['time'], how='outer')
@@ -87,9 +107,7 @@ def get_ph(data, cals, ctd_data):
     data_all['salinity'] = data_all['salinity'].fillna(method="bfill")
     data_all.dropna(subset=['voltage'], inplace=True)
     data_all.reset_index(drop=False, inplace=True)
-
-    data_all['calc_ph'] = data_all.apply(lambda x: calibrate_ph(**x, external=True), axis=1)
-    return data_all['calc_ph'].round(2)
+    return data_all
 
 
 def get_scs_o2(data):
@@ -109,3 +127,147 @@ def get_scs_o2(data):
     data_all['oxygen_calc'] = data_all.apply(lambda x: correct_oxygen(**x), axis=1)
 
     return data_all['oxygen_calc'].round(4)
+
+
+class Calibration:
+    """A way of calibrating a parameter: what it reads, what it writes and what it needs."""
+
+    def __init__(self, name, parameter, function, inputs, outputs, coefficients,
+                 required=(), ctd_inputs=()):
+        """Describe a calibration.
+
+        :param name: unique name, like 'sbe63'
+        :param parameter: 'chlor', 'o2' or 'ph'
+        :param function: called with (data, cals, ctd_data, ph_engine). Returns a Series of
+            calibrated values with the index of data, or a DataFrame with the outputs.
+        :param inputs: raw columns it reads
+        :param outputs: columns it adds
+        :param coefficients: where the coefficients come from. 'time' for rows of the Google
+            Sheet tab that start at a time, 'serial_number' for rows of each instrument, or
+            'builtin' if they are in the code (the tab id is 1 in instrument_sets.json)
+        :param required: inputs that must be there. Rows without them are dropped.
+        :param ctd_inputs: columns it reads from the set with salinity. If it needs some and
+            there's no CTD data, it's skipped.
+        """
+        self.name = name
+        self.parameter = parameter
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.coefficients = coefficients
+        self.required = list(required)
+        self.ctd_inputs = list(ctd_inputs)
+
+    def __repr__(self):
+        """Returns a printable string."""
+        return f'Calibration{{name={self.name},parameter={self.parameter}}}'
+
+
+# calibrations by name
+CALIBRATIONS = {}
+
+
+def register(calibration):
+    """Add a way of calibrating a parameter.
+
+    :param calibration: Calibration
+    """
+    CALIBRATIONS[calibration.name] = calibration
+
+
+def find_calibration(parameter, builtin=False):
+    """The calibration of a parameter.
+
+    :param parameter: 'chlor', 'o2' or 'ph'
+    :param builtin: True if the set's coefficients are in the code, not a Google Sheet
+    :return: Calibration
+    """
+    for calibration in CALIBRATIONS.values():
+        if calibration.parameter == parameter \
+                and (calibration.coefficients == 'builtin') == builtin:
+            return calibration
+    raise ValueError(f'No calibration of {parameter}' + (' with builtin coefficients'
+                                                         if builtin else ''))
+
+
+def stages(calibrations):
+    """Group calibrations so each group only reads columns written by earlier groups.
+
+    :param calibrations: list of Calibrations
+    :return: list of lists of Calibrations. Those in a group can run at the same time.
+    """
+    pending = list(calibrations)
+    groups = []
+    while pending:
+        waiting = {column for calibration in pending for column in calibration.outputs}
+        group = [c for c in pending if not set(c.inputs) & (waiting - set(c.outputs))]
+        if not group:
+            raise ValueError(f'Calibrations {pending} read each others outputs')
+        groups.append(group)
+        pending = [c for c in pending if c not in group]
+    return groups
+
+
+register(Calibration('chlorophyll', 'chlor',
+                     lambda data, cals, ctd_data, ph_engine: get_chlor(data, cals),
+                     inputs=['fluorometer_v'], outputs=['chlor'], coefficients='time'))
+register(Calibration('sbe63', 'o2',
+                     lambda data, cals, ctd_data, ph_engine: get_o2(data, cals),
+                     inputs=['O2_phase_delay', 'O2_raw_voltage', 'salinity', 'pressure'],
+                     outputs=['o2'], coefficients='time'))
+register(Calibration('aanderaa', 'o2',
+                     lambda data, cals, ctd_data, ph_engine: get_scs_o2(data),
+                     inputs=['O2con', 'O2temp', 'salinity', 'pressure'],
+                     outputs=['O2_uM'], coefficients='builtin'))
+register(Calibration('seafet', 'ph',
+                     lambda data, cals, ctd_data, ph_engine:
+                         get_ph(data, cals, ctd_data, engine=ph_engine),
+                     inputs=['serial_number', 'v_ext', 'temperature'],
+                     outputs=['corrected_ph'], coefficients='serial_number',
+                     required=['v_ext'], ctd_inputs=['salinity']))
+
+
+def calibrate_data(data, calibrations, cals, ctd_data=None, ph_engine='exact', workers=1):
+    """Add the calibrated values of all the parameters of a set to its cleaned raw data.
+
+    :param data: DataFrame from InstrumentSet.retrieve_and_parse_raw_data (changed in place)
+    :param calibrations: list of Calibrations, like InstrumentSet.calibrations (which says if
+        a set's coefficients are builtin)
+    :param cals: dictionary of calibration coefficients by parameter. Builtin ones are empty
+        tables (see InstrumentSet.get_cals).
+    :param ctd_data: DataFrame of cleaned raw data from the set with salinity for pH. If
+        omitted, pH is not calibrated.
+    :param ph_engine: 'exact' or 'table' (see get_ph)
+    :param workers: number of calibrations that can run at the same time. They still run one
+        at a time if one reads what another writes.
+    :return: DataFrame with calibrated columns added
+    """
+    ready = []
+    for calibration in calibrations:
+        if calibration.ctd_inputs and (ctd_data is None or len(ctd_data) == 0):
+            logger.debug(f'No salinity. Cannot calibrate {calibration.parameter} ...')
+            continue
+        ready.append(calibration)
+    calibrations = ready
+
+    for calibration in calibrations:
+        if calibration.required:
+            data.dropna(subset=calibration.required, inplace=True)
+
+    def run(calibration):
+        return calibration.function(data, cals[calibration.parameter], ctd_data, ph_engine)
+
+    for group in stages(calibrations):
+        if workers > 1 and len(group) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(group))) as pool:
+                results = list(pool.map(run, group))
+        else:
+            results = [run(calibration) for calibration in group]
+        for calibration, result in zip(group, results):
+            if isinstance(result, pd.DataFrame):
+                for column in calibration.outputs:
+                    data[column] = result[column]
+            else:
+                data[calibration.outputs[0]] = result
+
+    return data
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""An index of the calibrated days of each set, to find missing and short days.
+
+With `--coverage`, the runner records a row in a SQLite file for every day it writes: the
+number of rows, the first and last time, how many lines of the raw file were dropped, and how
+many values of each calibrated column are missing. Questions like "which days are missing or
+short at Stearns Wharf this year?" are then answered from the index, without opening any data
+files:
+
+sass-coverage --index data/coverage.sqlite gaps -s sw-ctd-2018 -t1 2021-01-01 -t2 2021-12-31
+sass-coverage --index data/coverage.sqlite days -s sw-ctd-2018 -t1 2021-01-01 -t2 2021-12-31
+
+A day that is calibrated again replaces its row. Only days written since the index was started
+are in it, so run the range once with --coverage to fill it.
+"""
+
+import sys
+import argparse
+import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from sass import logger, utilities
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS days (
+    set_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    first_time TEXT,
+    last_time TEXT,
+    raw_lines INTEGER,
+    drop_ratio REAL,
+    recorded TEXT,
+    PRIMARY KEY (set_id, day)
+);
+CREATE TABLE IF NOT EXISTS nans (
+    set_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    column TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (set_id, day, column)
+);
+"""
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def count_lines(path):
+    """Number of lines in a raw file, without parsing it.
+
+    :param path: Posix path
+    :return: int
+    """
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n')  # the last line might not end with a newline
+
+
+class CoverageIndex:
+    """Rows, times and missing values of each calibrated day, in a SQLite file."""
+
+    def __init__(self, path):
+        """Open (or create) the index.
+
+        :param path: Posix path of the SQLite file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    def connect(self):
+        """A new connection, so the index can be shared by threads and processes.
+
+        :return: utilities.Transaction that gives a sqlite3 Connection in a with statement
+        """
+        return utilities.connect_sqlite(self.path)
+
+    def record(self, set_id, day, data, columns, raw_lines=None):
+        """Add (or replace) the entry of a calibrated day.
+
+        :param set_id: unique identifier of the instrument set
+        :param day: datetime of the day
+        :param data: DataFrame of calibrated data with a time column
+        :param columns: calibrated columns to count missing values of. Ones that aren't in
+            data are all missing.
+        :param raw_lines: optional number of lines in the raw file
+        """
+        day = day.strftime('%Y-%m-%d')
+        rows = len(data)
+        first = data['time'].min() if rows else None
+        last = data['time'].max() if rows else None
+        drop_ratio = (1 - rows / raw_lines) if raw_lines else None
+        nans = [(set_id, day, column,
+                 int(data[column].isna().sum()) if column in data.columns else rows)
+                for column in columns]
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (set_id, day, rows,
+                        first.strftime(TIME_FORMAT) if first is not None else None,
+                        last.strftime(TIME_FORMAT) if last is not None else None,
+                        raw_lines, drop_ratio,
+                        datetime.datetime.utcnow().strftime(TIME_FORMAT)))
+            db.execute('DELETE FROM nans WHERE set_id = ? AND day = ?', (set_id, day))
+            db.executemany('INSERT INTO nans VALUES (?, ?, ?, ?)', nans)
+
+    def days(self, start, end, set_ids=None):
+        """Entries of the days between two dates.
+
+        :param start: datetime of earliest date
+        :param end: datetime of latest date
+        :param set_ids: optional list of set_ids. If omitted, all of them.
+        :return: DataFrame with set_id, day, rows, first_time, last_time, raw_lines,
+            drop_ratio and a <column>_nans column for each calibrated column, sorted by set_id
+            and day
+        """
+        where, params = self._where(start, end, set_ids)
+        with self.connect() as db:
+            days = pd.read_sql_query(f'SELECT set_id, day, rows, first_time, last_time, '
+                                     f'raw_lines, drop_ratio FROM days {where} '
+                                     f'ORDER BY set_id, day', db, params=params)
+            nans = pd.read_sql_query(f'SELECT * FROM nans {where}', db, params=params)
+        if len(nans):
+            nans = nans.pivot(index=['set_id', 'day'], columns='column', values='count')
+            nans.columns = [f'{column}_nans' for column in nans.columns]
+            days = days.join(nans, on=['set_id', 'day'])
+        return days
+
+    @staticmethod
+    def _where(start, end, set_ids):
+        """SQL condition and parameters for days between two dates of some sets."""
+        where = 'WHERE day BETWEEN ? AND ?'
+        params = [start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')]
+        if set_ids:
+            where += f' AND set_id IN ({", ".join("?" * len(set_ids))})'
+            params.extend(set_ids)
+        return where, params
+
+
+def gaps(index, sets, start, end, short=None):
+    """Days without calibrated data, and days with few rows.
+
+    :param index: CoverageIndex
+    :param sets: list of InstrumentSets. Only the days each was active are expected.
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :param short: optional fraction. Days with fewer rows than this fraction of the set's
+        median day are short.
+    :return: DataFrame with set_id, first and last day of each gap (or short day), days in
+        it, and kind ('missing' or 'short')
+    """
+    covered = index.days(start, end, [s.set_id for s in sets])
+    found = []
+    for this_set in sets:
+        if not this_set.start_date:
+            continue  # not active yet
+        first = max(start, this_set.start_date).date()
+        last = min(end, this_set.end_date).date()
+        if first > last:
+            continue
+        entries = covered.loc[covered['set_id'] == this_set.set_id]
+        expected = pd.Series(pd.date_range(first, last, freq='D').strftime('%Y-%m-%d'))
+        missing = expected[~expected.isin(entries['day'])]
+        # consecutive missing days become one gap
+        runs = (pd.to_datetime(missing).diff() != pd.Timedelta(days=1)).cumsum()
+        for _, run in missing.groupby(runs):
+            found.append((this_set.set_id, run.iloc[0], run.iloc[-1], len(run), 'missing'))
+        if short and len(entries):
+            limit = entries['rows'].median() * short
+            for day in entries.loc[entries['rows'] < limit, 'day']:
+                found.append((this_set.set_id, day, day, 1, 'short'))
+    found = pd.DataFrame(found, columns=['set_id', 'first', 'last', 'days', 'kind'])
+    return found.sort_values(['set_id', 'first'], kind='stable').reset_index(drop=True)
+
+
+def main():
+    """Organizes the input arguments and writes the results to stdout as CSV."""
+    from . import sass_runner
+
+    parser = argparse.ArgumentParser(description='Find missing and short days of calibrated '
+                                                 'SASS data from the coverage index.')
+    parser.add_argument('-i', '--index', dest='index', type=str,
+                        default=str(sass_runner.here.joinpath(sass_runner.coverage)),
+                        help='SQLite file of the index. If omitted, data/coverage.sqlite.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, description in [('days', 'Rows, times and missing values of each day.'),
+                                 ('gaps', 'Missing days (and short ones, with --short).')]:
+        command_parser = subparsers.add_parser(command, help=description)
+        command_parser.add_argument('-t1', '--start', dest='start', required=True, type=str,
+                                    help='Start date as yyyy-mm-dd.')
+        command_parser.add_argument('-t2', '--end', dest='end', required=True, type=str,
+                                    help='End date as yyyy-mm-dd.')
+        command_parser.add_argument('-s', '--set', dest='set_ids', action='append',
+                                    help='Id of a set of instruments to include. Can be '
+                                         'repeated. If omitted, all of them.')
+        if command == 'gaps':
+            command_parser.add_argument('--short', dest='short', type=float,
+                                        help='Also list days with fewer rows than this '
+                                             'fraction of the median day, like 0.5.')
+    args = parser.parse_args()
+
+    utilities.log_to_stderr(logger)  # stdout is for the results
+    if not Path(args.index).exists():
+        logger.error(f'No index at {args.index}. Calibrate with --coverage first.')
+        exit(1)
+    index = CoverageIndex(args.index)
+    start = utilities.parse_datetime(args.start + "T00:00:00Z")
+    end = utilities.parse_datetime(args.end + "T00:00:00Z")
+    if args.command == 'days':
+        result = index.days(start, end, args.set_ids)
+    else:
+        sets = sass_runner.load_configs(sass_runner.here.joinpath(
+            sass_runner.instrument_set_filename))
+        if args.set_ids:
+            sets = [s for s in sets if s.set_id in args.set_ids]
+        result = gaps(index, sets, start, end, short=args.short)
+    result.to_csv(sys.stdout, index=False, na_rep='NaN')
+
+
+if __name__ == '__main__':
+    main()
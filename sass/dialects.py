@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The layouts of raw data files, and how to clean each of them.
+
+InstrumentSet.retrieve_and_parse_raw_data can clean any raw file, but to do that it checks
+every file for everything: which delimiter it has, whether the first column has hash marks,
+whether there's a separate date column. Each set only ever has one layout, though, so a set is
+bound to a dialect when it's loaded and each file only gets the cleaning its layout needs:
+
+* ctd_hash: CTD lines with a '#' before the temperature, comma delimited. Lines without the
+  hash mark are dropped before anything else looks at them, which matters on garbled days.
+  Files of these sets that have no hash marks at all are cleaned as ctd_no_hash.
+* ctd_no_hash: CTD lines without hash marks, where the temperature is already a number.
+* seafet: SeaFET pH lines, comma delimited.
+* scs: SIO SCS lines, whitespace delimited, with dates like 2022/04/30 in their own column.
+  Every date of a file is read that way, whatever the other lines look like.
+
+Every dialect gives the same results as the generic cleaning (see README.md for how bad data
+are filtered out). A set can name its dialect with "dialect" in instrument_sets.json, or
+"generic" to always use the generic cleaning. Otherwise it is found from the set's columns. A
+dialect's clean function can also return None if a file isn't what it expects, and the generic
+cleaning is used for that file.
+"""
+
+import re
+import string
+
+import numpy as np
+import pandas as pd
+
+# bad data is non-ascii characters. These are what might reasonably be in a line
+NORMAL = string.digits + string.ascii_letters + string.punctuation + string.whitespace
+GIBBERISH = re.compile('[^' + re.escape(NORMAL) + ']')
+# what isn't part of a number, except the line breaks that join values
+NOT_NUMBER = re.compile(r'[^0-9.\-\n]')
+
+
+class Dialect:
+    """The layout of a set's raw files and how they are cleaned."""
+
+    def __init__(self, name, whitespace, clean, matches, date_format=None):
+        """Describe a dialect.
+
+        :param name: unique name, like 'ctd_hash'
+        :param whitespace: True if the fields are separated by whitespace, False for commas
+        :param clean: called with (InstrumentSet, DataFrame of lines with the usecols columns).
+            Returns a DataFrame of the good lines, still as text (like
+            InstrumentSet._drop_bad_lines), or None to use the generic cleaning.
+        :param matches: called with an InstrumentSet. True if its files have this layout.
+        :param date_format: optional strptime format of the dates in a sensor_date column, if
+            they aren't like '26 Feb 2021'
+        """
+        self.name = name
+        self.whitespace = whitespace
+        self.clean = clean
+        self.matches = matches
+        self.date_format = date_format
+
+    def __repr__(self):
+        """Returns a printable string."""
+        return f'Dialect{{name={self.name}}}'
+
+
+# dialects by name, in the order they are tried
+DIALECTS = {}
+
+
+def register(dialect):
+    """Add a layout of raw files.
+
+    :param dialect: Dialect
+    """
+    DIALECTS[dialect.name] = dialect
+
+
+def find_dialect(this_set, name=None):
+    """The dialect of a set's raw files.
+
+    :param this_set: InstrumentSet
+    :param name: optional name of the dialect, or 'generic' for none
+    :return: Dialect, or None for the generic cleaning
+    """
+    if name == 'generic':
+        return None
+    if name:
+        if name not in DIALECTS:
+            raise ValueError(f'Unknown dialect {name} of {this_set.set_id}. Must be one of '
+                             f'{list(DIALECTS) + ["generic"]}')
+        return DIALECTS[name]
+    for dialect in DIALECTS.values():
+        if dialect.matches(this_set):
+            return dialect
+    return None
+
+
+def keep_instrument(this_set, data):
+    """Lines of the set's instrument (files can have lines from several)."""
+    return data.loc[data['ip'] == this_set.ip]
+
+
+def normal_text(column):
+    """Where a text column has a value of only normal characters.
+
+    Same as checking that nothing is left after stripping the normal characters, but with one
+    regular expression search over all the values at once instead of a strip of each value.
+
+    :param column: Series of strings (and NaN)
+    :return: numpy array of bools. False for gibberish and missing values.
+    """
+    values = column.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    values = np.where(missing, '', values)
+    try:
+        text = '\n'.join(values)
+    except TypeError:  # not all strings
+        return ~column.str.strip(NORMAL).astype(bool).to_numpy()
+    # where each value ends in the joined text
+    ends = np.cumsum(np.fromiter(map(len, values), dtype=np.int64, count=len(values)) + 1) - 1
+    bad = missing.copy()
+    positions = [found.start() for found in GIBBERISH.finditer(text)]
+    if positions:
+        bad[np.searchsorted(ends, positions)] = True
+    return ~bad
+
+
+def only_numbers(column):
+    """Remove everything but digits, points and minus signs from the values of a text column.
+
+    Done with one substitution over all the values joined together, instead of one for each.
+
+    :param column: Series of strings
+    :return: Series of strings
+    """
+    values = column.to_numpy(dtype=object)
+    numbers = NOT_NUMBER.sub('', '\n'.join(values)).split('\n')
+    if len(numbers) != len(values):  # a value had a line break in it
+        return column.str.replace(r'[^0-9.\-]', '', regex=True)
+    return pd.Series(numbers, index=column.index, dtype=object)
+
+
+def drop_gibberish(data):
+    """Lines without gibberish or missing values in any text column."""
+    keep = np.ones(len(data), dtype=bool)
+    for column in data.select_dtypes(object).columns:
+        keep &= normal_text(data[column])
+    return data[keep]
+
+
+def keep_timed(this_set, data):
+    """Lines that have a sensor time that looks like a time (joining a separate date)."""
+    if 'sensor_date' in data.columns and 'sensor_time' in data.columns:
+        # but if it is, it had better not have times in the date column
+        # like SIO "19 Oct 2015 21:50:40"
+        data = data.loc[~data['sensor_date'].str.contains(':')]
+        # and SIO SCS has its dates like "2022/04/30" so convert that first
+        if this_set.date_format:
+            dates = pd.to_datetime(data['sensor_date'], format=this_set.date_format,
+                                   errors='coerce')
+            data = data.loc[dates.notna()].assign(
+                sensor_date=dates[dates.notna()].dt.strftime("%d %b %Y "))
+        data = data.assign(sensor_time=data['sensor_date'] + data['sensor_time'])
+        data = data.drop(columns=['sensor_date'])
+    data = data.loc[data['sensor_time'].str.contains(':')]
+    if len(data) == 0:
+        return pd.DataFrame({})
+    return data
+
+
+def clean_ctd_hash(this_set, data):
+    """Clean CTD lines that have a hash mark before the temperature."""
+    if data['temperature'].dtype != object:
+        # a file without any hash marks, so pandas read the temperatures as numbers
+        return clean_ctd_no_hash(this_set, data)
+    data = keep_instrument(this_set, data)
+    data = data.loc[data['temperature'].str.contains('#', na=False).to_numpy()]
+    data = drop_gibberish(data)
+    if len(data) == 0:
+        return pd.DataFrame({})
+    # only take the numbers in that column - no hash, no gibberish. Some lines are empty.
+    temperature = only_numbers(data['temperature'])
+    data = data.assign(temperature=temperature.replace('', np.nan))
+    data = data.dropna(subset=['temperature'])
+    return keep_timed(this_set, data)
+
+
+def clean_lines(this_set, data):
+    """Clean lines that have nothing special about them (CTD without hash marks, SeaFET)."""
+    data = drop_gibberish(keep_instrument(this_set, data))
+    data = data.dropna(subset=['temperature'])
+    if len(data) == 0:
+        return pd.DataFrame({})
+    return keep_timed(this_set, data)
+
+
+def clean_ctd_no_hash(this_set, data):
+    """Clean CTD lines without hash marks."""
+    if data['temperature'].dtype == object:
+        return None  # some lines have more than a number, so do everything
+    return clean_lines(this_set, data)
+
+
+def clean_scs(this_set, data):
+    """Clean SIO SCS lines."""
+    if 'sensor_date' not in data.columns:
+        return None
+    return clean_lines(this_set, data)
+
+
+register(Dialect('ctd_hash', whitespace=False, clean=clean_ctd_hash,
+                 matches=lambda this_set: this_set.data_columns[2] == 'temperature'))
+register(Dialect('ctd_no_hash', whitespace=False, clean=clean_ctd_no_hash,
+                 matches=lambda this_set: False))  # only if named in instrument_sets.json
+register(Dialect('seafet', whitespace=False, clean=clean_lines,
+                 matches=lambda this_set: this_set.data_columns[2] == 'serial_number'))
+register(Dialect('scs', whitespace=True, clean=clean_scs,
+                 matches=lambda this_set: this_set.data_columns[2] == 'sensor_name',
+                 date_format='%Y/%m/%d'))
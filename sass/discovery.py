@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Find the raw data files of a set by listing its directories.
+
+Raw files are kept in a directory for each month, like newport_pier/2021-02/data-20210226.dat.
+Instead of making up a name for every day and checking whether it exists, each month's
+directory is listed once and the files named like data-YYYYMMDD.dat (or data_YYYYMMDD.dat, like
+sio-scs-2022) are kept, with their size and modification time. A set with long outages or a
+range of many years then takes one listing a month rather than a stat a day, which matters on
+a network file system.
+
+For very large trees, a DirectoryIndex keeps what was found in a JSON file. A month is only
+listed again if its directory changed since (which takes one stat), or if it is this month or
+last month, where files may still be growing.
+"""
+
+import os
+import re
+import json
+import datetime
+import threading
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+
+from sass import logger
+
+DATA_NAME = re.compile(r'^data[-_](\d{8})\.dat$')
+
+
+class RawFile:
+    """A raw data file that was found."""
+    def __init__(self, name, day, size, mtime):
+        """Describe the file.
+
+        :param name: name under the incoming directory, like
+            'newport_pier/2021-02/data-20210226.dat'
+        :param day: datetime (midnight) of the data in the file
+        :param size: bytes (int)
+        :param mtime: time of the last change, in seconds since the epoch (float)
+        """
+        self.name = name
+        self.day = day
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        """Returns a printable string."""
+        return str(self)
+
+    def __str__(self):
+        """Returns a summary of the RawFile."""
+        return f'RawFile{{{self.name},size={self.size}}}'
+
+
+def scan_month(directory, pattern=DATA_NAME):
+    """List the raw data files in a month's directory.
+
+    :param directory: Posix path like incoming/newport_pier/2021-02
+    :param pattern: compiled regular expression the file names must match
+    :return: dictionary of file name to [size, mtime]. Empty if there is no directory.
+    """
+    files = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if pattern.match(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = [stat.st_size, stat.st_mtime]
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return files
+
+
+class DirectoryIndex:
+    """What scan_month found in each directory, kept in a JSON file between runs.
+
+    It can be shared by the threads of a run. Runs in other processes can use the same file;
+    it is replaced all at once when saved, and the last one saved wins.
+    """
+    def __init__(self, path):
+        """Read the index, if there is one.
+
+        :param path: Posix path of the JSON file. Created when saved.
+        """
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.changed = False
+        self.directories = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as f:
+                    self.directories = json.load(f)
+            except json.JSONDecodeError:
+                logger.warning(f'Can not read {self.path}. Listing all directories again.')
+
+    def __getstate__(self):
+        """Everything but the lock, so a runner with an index can be sent to processes."""
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        """Same as what was sent, with a new lock."""
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def scan_month(self, directory, recent=False):
+        """Same as scan_month, but use the index if the directory hasn't changed.
+
+        :param directory: Posix path of a month's directory
+        :param recent: if True, always list it, because the files might still be growing
+        :return: dictionary of file name to [size, mtime]
+        """
+        key = str(directory)
+        try:
+            mtime = os.stat(directory).st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            mtime = None
+        with self.lock:
+            known = self.directories.get(key)
+        if known and known['mtime'] == mtime and not recent:
+            return known['files']
+
+        files = scan_month(directory) if mtime is not None else {}
+        with self.lock:
+            self.directories[key] = {'mtime': mtime, 'files': files}
+            self.changed = True
+        return files
+
+    def save(self):
+        """Write the index if anything changed."""
+        with self.lock:
+            if not self.changed:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            name = f'{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+            tmp = self.path.with_name(name)
+            with open(tmp, 'w') as f:
+                json.dump(self.directories, f)
+            tmp.replace(self.path)
+            self.changed = False
+
+
+def months(start, end):
+    """First day of each month between two dates.
+
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :return: list of datetimes
+    """
+    month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    found = []
+    while month.date() <= end.date():
+        found.append(month)
+        month += relativedelta(months=1)
+    return found
+
+
+def find_files(this_set, start, end, incoming_dir, index=None, days=None):
+    """Raw data files of a set between two dates that exist.
+
+    If there are both data-YYYYMMDD.dat and data_YYYYMMDD.dat for a day, the one named like
+    the set's file_base is used.
+
+    :param this_set: InstrumentSet
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :param index: optional DirectoryIndex to avoid listing directories that haven't changed
+    :param days: optional list of datetimes. If given, only these days between start and end
+        are found, and only their months are listed.
+    :return: list of RawFiles in order of day
+    """
+    root = Path(incoming_dir).joinpath(this_set.raw_data_tag)
+    recent = datetime.date.today() - relativedelta(months=1)
+    wanted = None if days is None else {day.date() for day in days}
+    to_list = months(start, end)
+    if wanted is not None:
+        wanted_months = {(d.year, d.month) for d in wanted}
+        to_list = [m for m in to_list if (m.year, m.month) in wanted_months]
+    found = {}
+    for month in to_list:
+        dir_tag = month.strftime('%Y-%m')
+        directory = root.joinpath(dir_tag)
+        if index is None:
+            files = scan_month(directory)
+        else:
+            files = index.scan_month(directory, recent=month.date() >= recent.replace(day=1))
+        for name, (size, mtime) in files.items():
+            try:
+                day = datetime.datetime.strptime(DATA_NAME.match(name).group(1), '%Y%m%d')
+            except ValueError:
+                continue  # like data-20210231.dat
+            if not start.date() <= day.date() <= end.date():
+                continue
+            if wanted is not None and day.date() not in wanted:
+                continue
+            if day.date() in found and not name.startswith(this_set.file_base):
+                continue
+            day = day.replace(tzinfo=start.tzinfo)
+            found[day.date()] = RawFile(f'{this_set.raw_data_tag}/{dir_tag}/{name}', day, size,
+                                        mtime)
+    return [found[d] for d in sorted(found)]
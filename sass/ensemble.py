@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Calibrate the same data with several sets of coefficients at once.
+
+When an instrument comes back from the manufacturer with new coefficients, it helps to see a
+deployment with the old ones, the new ones and a few blends in between. Instead of a run for
+each, give all of them as rows of a table and get a column of calibrated values for each:
+
+from sass.ensemble import blend, ensemble
+candidates = blend(old, new, [0, 0.5, 1])
+o2 = ensemble(data, 'o2', candidates)
+
+The equations are the same as in sbe63_o2, ctd_chlorophyll and seafet_ph, written for numpy
+arrays, so the data (n rows) and the coefficients (K rows) are broadcast into an n by K array in
+one pass. For pH, the chloride corrections only depend on salinity and temperature, so they are
+calculated once for all the candidates. The oxygen and chlorophyll versions are checked
+against the original equations in equivalence.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .seafet_ph import calibrate_ph
+from .ph_lookup import default_table, exact_correction
+from .calibrations import ph_inputs
+
+# names of the coefficients in the equations, from the names of the Google Sheet columns
+COEFFICIENT_NAMES = {
+    'chlor': {'Scale Factor': 'scale_factor', 'Clean Water Offset (CWO)': 'clean_water_offset'},
+    'o2': {name: name for name in ['A0', 'A1', 'A2', 'B0', 'B1', 'C0', 'C1', 'C2', 'E',
+                                   'TA0', 'TA1', 'TA2', 'TA3']},
+    'ph': {'Kext0': 'k0', 'Kext2': 'k2'},
+}
+# decimal places, same as calibrations.py
+NDIGITS = {'chlor': 2, 'o2': 2, 'ph': 2}
+
+
+def chlorophyll(output, scale_factor, clean_water_offset, **kwargs):
+    """Same as ctd_chlorophyll.calibrate_chlorophyll, for arrays that broadcast together."""
+    return (output - clean_water_offset) * scale_factor
+
+
+def oxygen(voltage, output, salinity, pressure, A0, A1, A2, B0, B1, C0, C1, C2, E,
+           TA0, TA1, TA2, TA3, **kwargs):
+    """Same as sbe63_o2.calibrate_temperature then calibrate_oxygen, for arrays.
+
+    Inputs the original equations can't handle (like log of a negative number) give NaN.
+    """
+    with np.errstate(all='ignore'):
+        lscale = np.log(100000 * voltage / (3.3 - voltage))
+        temperature = 1 / (TA0 + TA1 * lscale + TA2 * lscale ** 2 + TA3 * lscale ** 3) - 273.15
+
+        vscale = output / 39.457071
+        atmp = A0 + A1 * temperature + A2 * vscale ** 2
+        btmp = B0 + B1 * vscale
+        ksv = C0 + C1 * temperature + C2 * temperature ** 2
+        tscale = np.log((298.15 - temperature) / (273.15 + temperature))
+        scorr = np.exp(salinity * (-6.24523e-3 - 7.37614e-3 * tscale - 1.03410e-2 * tscale ** 2
+                                   - 8.17083e-3 * tscale ** 3) - 4.88682e-7 * salinity ** 2)
+        pcorr = np.exp(E * pressure / (temperature + 273.15))
+        return ((atmp / btmp - 1) / ksv) * scorr * pcorr
+
+
+def coefficient_arrays(parameter, coefficients):
+    """The coefficients of each candidate, as arrays that broadcast across the data.
+
+    :param parameter: 'chlor', 'o2' or 'ph'
+    :param coefficients: DataFrame with a row for each candidate and the columns of the
+        Google Sheet tab (or the names in the equations, like scale_factor or k0)
+    :return: dictionary of arrays of shape (1, K) named like the arguments of the equations
+    """
+    names = COEFFICIENT_NAMES[parameter]
+    arrays = {}
+    for column, name in names.items():
+        if column in coefficients.columns:
+            values = coefficients[column]
+        elif name in coefficients.columns:
+            values = coefficients[name]
+        else:
+            raise ValueError(f'Coefficients for {parameter} need a {column} column')
+        arrays[name] = values.to_numpy(dtype=float)[np.newaxis, :]
+    return arrays
+
+
+def blend(first, second, fractions):
+    """Candidates between two sets of coefficients.
+
+    :param first: Series (or DataFrame row) of coefficients, like the old ones
+    :param second: Series of coefficients, like the new ones
+    :param fractions: list of how far to go from first to second. 0 is first, 1 is second.
+    :return: DataFrame with a row for each fraction, indexed by the fraction. Only the columns
+        that are numbers in both are blended.
+    """
+    first = pd.to_numeric(pd.Series(first), errors='coerce')
+    second = pd.to_numeric(pd.Series(second), errors='coerce')
+    columns = [c for c in first.index if c in second.index
+               and pd.notna(first[c]) and pd.notna(second[c])]
+    rows = [first[columns] * (1 - f) + second[columns] * f for f in fractions]
+    return pd.DataFrame(rows, index=pd.Index(fractions, name='fraction'))
+
+
+def ensemble(data, parameter, coefficients, ctd_data=None, ph_engine='exact'):
+    """Calibrate a parameter with each of several sets of coefficients.
+
+    :param data: DataFrame of cleaned raw data, like InstrumentSet.retrieve_and_parse_raw_data
+    :param parameter: 'chlor', 'o2' or 'ph'
+    :param coefficients: DataFrame with a row for each candidate (see coefficient_arrays).
+        Its index names the columns of the result.
+    :param ctd_data: DataFrame of cleaned raw data from the set with salinity. Needed for pH.
+    :param ph_engine: 'exact' or 'table' for the pH corrections (see ph_lookup.py)
+    :return: DataFrame with time and a column of calibrated values for each candidate. For
+        chlor and o2 there's a row for each row of data (with the same index); for pH, a row for
+        each row with voltage, sorted by time (like calibrations.get_ph).
+    """
+    arrays = coefficient_arrays(parameter, coefficients)
+    if parameter == 'chlor':
+        inputs = data[['time']].copy()
+        values = chlorophyll(data['fluorometer_v'].to_numpy(dtype=float)[:, np.newaxis],
+                             **arrays)
+    elif parameter == 'o2':
+        inputs = data[['time']].copy()
+        columns = {'voltage': 'O2_raw_voltage', 'output': 'O2_phase_delay',
+                   'salinity': 'salinity', 'pressure': 'pressure'}
+        values = oxygen(**{name: data[column].to_numpy(dtype=float)[:, np.newaxis]
+                           for name, column in columns.items()}, **arrays)
+    elif parameter == 'ph':
+        if ctd_data is None or len(ctd_data) == 0:
+            raise ValueError('pH needs the data of the set with salinity')
+        inputs = ph_inputs(data, ctd_data)
+        voltage = inputs['voltage'].to_numpy(dtype=float)
+        temperature = inputs['temperature'].to_numpy(dtype=float)
+        salinity = inputs['salinity'].to_numpy(dtype=float)
+        # the corrections are the same for every candidate
+        if ph_engine == 'table':
+            correction = default_table()(salinity, temperature)
+        else:
+            correction = np.array([exact_correction(s, t)
+                                   for s, t in zip(salinity, temperature)])
+        values = calibrate_ph(voltage[:, np.newaxis], temperature[:, np.newaxis],
+                              **arrays) + correction[:, np.newaxis]
+        inputs = inputs[['time']]
+    else:
+        raise ValueError(f'Unknown parameter {parameter}. Must be one of {list(NDIGITS)}')
+
+    values = np.round(values, NDIGITS[parameter])
+    result = pd.DataFrame(values, index=inputs.index, columns=coefficients.index)
+    result.insert(0, 'time', inputs['time'])
+    return result
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Check that faster ways of calibrating give the same answers as the original equations.
+
+The original equations (in sbe63_o2, seafet_ph, aanderaa_o2 and ctd_chlorophyll) work on one
+measurement at a time and are the reference. Any other engine, like the pH lookup table, is
+registered here as a candidate for one of the calibrations. The harness makes up lots of
+realistic inputs, including the awkward ones (thermistor voltage near 3.3 V, zero salinity,
+missing values), runs both, and reports how far apart they are:
+
+* max_abs and max_rel: largest absolute and relative differences
+* nonfinite_mismatch: inputs where one gave a number and the other didn't (NaN, inf, or an
+  error in the reference)
+* rounded_mismatch: inputs where the values differ after rounding like calibrations.py does.
+  Values that fall right on a rounding boundary can flip with even a tiny difference, so a few
+  of these are expected. max_rounded is the largest of those differences, which should be at
+  most one in the last decimal place.
+
+Run from the command line like:
+sass-equivalence --n 1000000
+"""
+
+import argparse
+
+import numpy as np
+
+from sass import logger
+
+from . import ensemble
+from .sbe63_o2 import calibrate_oxygen, calibrate_temperature
+from .seafet_ph import calibrate_ph
+from .aanderaa_o2 import correct_oxygen
+from .ph_lookup import calibrate_external_ph
+from .ctd_chlorophyll import calibrate_chlorophyll
+
+# decimal places the calibrated values are rounded to in calibrations.py
+ndigits = {'oxygen': 2, 'chlorophyll': 2, 'ph': 2, 'aanderaa': 4}
+
+# calibration coefficients copied from the Google Sheet to use as examples
+sbe63_coefficients = [
+    {'A0': 1.0513, 'A1': -1.5e-3, 'A2': 0.36705, 'B0': -0.19565, 'B1': 1.5666, 'C0': 0.10553,
+     'C1': 4.4254e-3, 'C2': 5.6166e-5, 'E': 0.011, 'TA0': 6.68437e-4, 'TA1': 2.609999e-4,
+     'TA2': -3.172095e-7, 'TA3': 1.350047e-7},
+    {'A0': 1.0513, 'A1': -1.5e-3, 'A2': 0.33684, 'B0': -0.20567, 'B1': 1.5444, 'C0': 0.10978,
+     'C1': 4.6656e-3, 'C2': 6.3253e-5, 'E': 0.011, 'TA0': 7.006421e-4, 'TA1': 2.518783e-4,
+     'TA2': 5.636693e-7, 'TA3': 1.066324e-7},
+]
+
+
+def with_edges(rng, n, low, high, edges=(), missing=0.001):
+    """Uniform random values, with some set to edge cases and some missing.
+
+    :param rng: numpy random Generator
+    :param n: how many values
+    :param low: lowest typical value
+    :param high: highest typical value
+    :param edges: awkward values to put in about 1% of the time
+    :param missing: fraction of values that are NaN
+    :return: array
+    """
+    values = rng.uniform(low, high, n)
+    if edges:
+        pick = rng.random(n) < 0.01
+        values[pick] = rng.choice(edges, pick.sum())
+    values[rng.random(n) < missing] = np.nan
+    return values
+
+
+def generate(kind, n, seed=0):
+    """Make up realistic inputs for a calibration.
+
+    :param kind: 'oxygen', 'chlorophyll', 'ph' or 'aanderaa'
+    :param n: number of inputs
+    :param seed: for the random numbers
+    :return: dictionary of arrays, named like the arguments of the reference equations
+    """
+    rng = np.random.default_rng(seed)
+    if kind == 'oxygen':
+        inputs = {
+            'voltage': with_edges(rng, n, 0.5, 3.2, edges=(3.29, 3.299, 3.2999, 3.3, 0.0)),
+            'output': with_edges(rng, n, 10, 40),
+            'salinity': with_edges(rng, n, 20, 40, edges=(0.0,)),
+            'pressure': with_edges(rng, n, 0, 10, edges=(0.0,)),
+        }
+        which = rng.integers(len(sbe63_coefficients), size=n)
+        for name in sbe63_coefficients[0]:
+            inputs[name] = np.array([c[name] for c in sbe63_coefficients])[which]
+    elif kind == 'chlorophyll':
+        inputs = {
+            'output': with_edges(rng, n, 0, 5, edges=(0.0, 5.0)),
+            'scale_factor': with_edges(rng, n, 5, 15, missing=0),
+            'clean_water_offset': with_edges(rng, n, 0.05, 0.1, missing=0),
+        }
+    elif kind == 'ph':
+        inputs = {
+            'voltage': with_edges(rng, n, -1.0, -0.8),
+            'temperature': with_edges(rng, n, 5, 30, edges=(-2.0, 35.0)),
+            'salinity': with_edges(rng, n, 20, 40, edges=(0.0, 1.0, 45.0)),
+            'k0': with_edges(rng, n, -1.45, -1.35, missing=0),
+            'k2': with_edges(rng, n, -1.3e-3, -1.1e-3, missing=0),
+        }
+    elif kind == 'aanderaa':
+        inputs = {
+            'O2_uM': with_edges(rng, n, 0, 400, edges=(0.0,)),
+            'temperature': with_edges(rng, n, 5, 30),
+            'salinity': with_edges(rng, n, 20, 40, edges=(0.0,)),
+            'pressure': with_edges(rng, n, 0, 10, edges=(0.0, -1.0)),
+        }
+    else:
+        raise ValueError(f'Unknown calibration {kind}')
+
+    return inputs
+
+
+def oxygen_reference(voltage, output, salinity, pressure, **coefficients):
+    """SBE63 oxygen for one measurement, the way get_o2 does it."""
+    temperature = calibrate_temperature(voltage, **coefficients)
+    return calibrate_oxygen(output, temperature, salinity, pressure, **coefficients)
+
+
+def ph_reference(**inputs):
+    """External pH for one measurement, the way get_ph does it."""
+    return calibrate_ph(**inputs, external=True)
+
+
+references = {
+    'oxygen': oxygen_reference,
+    'chlorophyll': calibrate_chlorophyll,
+    'ph': ph_reference,
+    'aanderaa': correct_oxygen,
+}
+
+# other ways of calculating the same thing. Each takes the dictionary of arrays from generate
+candidates = {kind: {} for kind in references}
+
+
+def register(kind, name, function):
+    """Add a candidate engine to be checked against the reference equations.
+
+    :param kind: 'oxygen', 'chlorophyll', 'ph' or 'aanderaa'
+    :param name: what to call it in reports
+    :param function: takes keyword arrays like generate makes and returns an array
+    """
+    candidates[kind][name] = function
+
+
+register('ph', 'table', calibrate_external_ph)
+register('oxygen', 'numpy', ensemble.oxygen)
+register('chlorophyll', 'numpy', ensemble.chlorophyll)
+
+
+def run_reference(kind, inputs):
+    """Calculate with the reference equation one measurement at a time.
+
+    :param kind: 'oxygen', 'chlorophyll', 'ph' or 'aanderaa'
+    :param inputs: dictionary of arrays
+    :return: array. Inputs the equations can't handle (like log of 0) are NaN.
+    """
+    function = references[kind]
+    names = list(inputs)
+    values = np.empty(len(inputs[names[0]]))
+    # the values are numpy floats, like in DataFrame.apply, so dividing by 0 is inf, not an error
+    with np.errstate(all='ignore'):
+        for i, row in enumerate(zip(*inputs.values())):
+            try:
+                values[i] = function(**dict(zip(names, row)))
+            except (ValueError, ZeroDivisionError, OverflowError):
+                values[i] = np.nan
+    return values
+
+
+def compare(reference, candidate, digits):
+    """Measure how different two sets of calibrated values are.
+
+    :param reference: array from the reference equations
+    :param candidate: array from another engine
+    :param digits: decimal places the values are rounded to
+    :return: dictionary report (see module documentation)
+    """
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    finite_ref = np.isfinite(reference)
+    finite_cand = np.isfinite(candidate)
+    both = finite_ref & finite_cand
+
+    diff = np.abs(reference[both] - candidate[both])
+    scale = np.abs(reference[both])
+    rel = np.divide(diff, scale, out=np.zeros_like(diff), where=scale > 0)
+    rounded = np.abs(np.round(reference[both], digits) - np.round(candidate[both], digits))
+
+    return {
+        'n': len(reference),
+        'compared': int(both.sum()),
+        'max_abs': float(diff.max()) if len(diff) else 0.0,
+        'max_rel': float(rel.max()) if len(rel) else 0.0,
+        'nonfinite_mismatch': int((finite_ref != finite_cand).sum()),
+        'rounded_mismatch': int((rounded > 0).sum()),
+        'max_rounded': float(rounded.max()) if len(rounded) else 0.0,
+    }
+
+
+def agrees(report, digits):
+    """True if the candidate is as good as the reference once the values are rounded.
+
+    :param report: dictionary from compare
+    :param digits: decimal places the values are rounded to
+    :return: boolean
+    """
+    unit = 10 ** -digits
+    return report['nonfinite_mismatch'] == 0 \
+        and report['max_abs'] < unit / 2 \
+        and report['max_rounded'] <= unit * (1 + 1e-9)
+
+
+def check(kind, n, seed=0, engines=None):
+    """Compare all (or some) candidates for a calibration to the reference.
+
+    :param kind: 'oxygen', 'chlorophyll', 'ph' or 'aanderaa'
+    :param n: number of made up inputs
+    :param seed: for the random numbers
+    :param engines: optional list of candidate names
+    :return: dictionary of candidate name to report
+    """
+    inputs = generate(kind, n, seed)
+    reference = run_reference(kind, inputs)
+    reports = {}
+    for name, function in candidates[kind].items():
+        if engines and name not in engines:
+            continue
+        with np.errstate(all='ignore'):
+            values = function(**inputs)
+        report = compare(reference, values, ndigits[kind])
+        report['agrees'] = agrees(report, ndigits[kind])
+        reports[name] = report
+    return reports
+
+
+def main():
+    """Organizes the input arguments and checks the candidates."""
+    parser = argparse.ArgumentParser(description='Compare fast calibration engines to the '
+                                                 'original equations.')
+    parser.add_argument('-n', '--n', dest='n', default=1000000, type=int,
+                        help='Number of made up inputs for each calibration.')
+    parser.add_argument('-k', '--kind', dest='kinds', action='append',
+                        choices=list(references),
+                        help='Calibration to check. Can be repeated. If omitted, all of them.')
+    parser.add_argument('--seed', dest='seed', default=0, type=int,
+                        help='Seed for the random numbers.')
+    args = parser.parse_args()
+
+    failed = False
+    for kind in args.kinds or list(references):
+        if not candidates[kind]:
+            logger.info(f'{kind}: nothing to compare to')
+            continue
+        for name, report in check(kind, args.n, args.seed).items():
+            logger.info(f'{kind} {name}: {report}')
+            if not report['agrees']:
+                logger.error(f'{kind} {name} does not agree with the reference equations')
+                failed = True
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 """Descriptions of instrument sets."""
 
 import string
+import itertools
 import pathlib
 import datetime
 from io import StringIO
@@ -15,7 +16,36 @@ from dateutil.relativedelta import relativedelta
 
 from sass import logger
 
-from . import utilities
+from . import utilities, arrow_ingest
+from .dialects import find_dialect
+from .calibrations import find_calibration
+
+# raw columns that are written out whether they are calibrated or not by sets that trim their
+# columns (server time and ip, the first 2 columns of every set, are always kept too)
+OUTPUT_COLUMNS = ['serial_number', 'temperature', 'conductivity', 'pressure', 'salinity', 'sigmat',
+                  'sensor_date', 'sensor_time', 'ph_ext', 'ph_int', 'v_ext', 'v_int',
+                  'O2con', 'O2sat', 'O2temp']
+# low cardinality strings
+CATEGORY_COLUMNS = ['ip', 'serial_number']
+# values the instruments use for missing data
+MISSING_VALUES = [-9.999, -0.999]
+# change this whenever retrieve_and_parse_raw_data gives different results, so cached
+# copies of cleaned data are not used
+PARSER_VERSION = 3
+
+
+def too_many_fields(error):
+    """Whether pandas failed to read lines because the first has too many fields.
+
+    That is, more fields than the set has columns, and they were read with usecols. Without
+    usecols, pandas would shift the extra fields into the index, and nothing would match the
+    ip, so these files have no data either way.
+
+    :param error: ValueError raised by pandas.read_csv
+    :return: bool
+    """
+    return not isinstance(error, pd.errors.ParserError) and \
+        str(error).startswith('Number of passed names did not match')
 
 
 class InstrumentSet:
@@ -24,7 +54,8 @@ class InstrumentSet:
                  station_name=None, raw_data_tag=None, proc_data_tag=None, columns=[],
                  calibration_url='', chlor_tab=None, chlor_gid=None,
                  o2_tab=None, o2_gid=None,
-                 ph_tab=None, ph_gid=None, ph_salinity_set=None, ip=None, **kwargs):
+                 ph_tab=None, ph_gid=None, ph_salinity_set=None, ip=None, dialect=None,
+                 trim_columns=False, **kwargs):
         """Fills an InstrumentSet with information read from a JSON config file.
 
         :param set_id: unique identifier of the set (string)
@@ -43,6 +74,10 @@ class InstrumentSet:
         :param ph_gid: Google sheet id code for the SeaFET (string)
         :param ph_salinity_set: set_id of the instrument set that will provide salinity
         :param ip: IP address connects the instrument to each line in the data file (string)
+        :param dialect: name of the layout of the raw files (see dialects.py), or 'generic'.
+            If omitted, it's found from the columns.
+        :param trim_columns: True to only read (and write out) the columns in OUTPUT_COLUMNS
+            and the inputs of the set's calibrations. Otherwise all the columns are kept.
         :param kwargs:
         """
         # basic info like where and when
@@ -75,6 +110,12 @@ class InstrumentSet:
 
         # where to get calibration coefficients
         self.data_columns = columns
+        self.trim_columns = trim_columns
+        self.dialect = find_dialect(self, dialect) if columns else None
+        # how dates are written in a separate sensor_date column, from the layout of the files
+        # (even if they are cleaned the generic way) rather than from the lines of each one
+        layout = self.dialect or (find_dialect(self) if columns else None)
+        self.date_format = layout.date_format if layout else None
         self.calibration_url = calibration_url
         self.cal_tabs = {
             'chlor': chlor_tab,
@@ -92,6 +133,36 @@ class InstrumentSet:
             if value:
                 self.parameters.append(key)
 
+    @property
+    def calibrations(self):
+        """How each parameter is calibrated (see calibrations.py).
+
+        :return: list of Calibrations
+        """
+        return [find_calibration(parameter, builtin=self.cal_gids[parameter] == 1)
+                for parameter in self.parameters]
+
+    @property
+    def usecols(self):
+        """Raw columns that are read.
+
+        All of them, or if the set trims its columns, the ones needed for the output and the
+        calibration of the parameters.
+
+        :return: list of column names in the order they appear in the raw data
+        """
+        if not self.trim_columns:
+            return list(self.data_columns)
+        keep = set(self.data_columns[:2]) | set(OUTPUT_COLUMNS)
+        for calibration in self.calibrations:
+            keep.update(calibration.inputs)
+        return [name for name in self.data_columns if name in keep]
+
+    @property
+    def _read_usecols(self):
+        """The usecols of pandas.read_csv: None to read every column the way it always was."""
+        return self.usecols if self.trim_columns else None
+
     def __repr__(self):
         """Returns a printable string."""
         return str(self)
@@ -118,7 +189,7 @@ class InstrumentSet:
 
         return files
 
-    def retrieve_and_parse_raw_data(self, url) -> pd.DataFrame:
+    def retrieve_and_parse_raw_data(self, url, engine='pandas', chunk_rows=None) -> pd.DataFrame:
         """Read raw SASS data from URL and convert it to a DataFrame with headers.
 
         sio scs is whitespace delim but others are comma delim.  pandas should be able to
@@ -127,26 +198,47 @@ class InstrumentSet:
         See README.md for notes on how bad data is filtered out.
 
         :param url: name of a file to process. Was once a URL also.
-        :param start: earliest datetime allowed
-        :param end: latest datetime allowed
+        :param engine: 'pandas' or 'pyarrow' to read and clean local comma delimited files
+            with pyarrow (see arrow_ingest.py). Both give the same results.
+        :param chunk_rows: optional number of lines of a local file to read and clean at a
+            time, so that a huge file (like a day of garbage at a high rate) only needs memory
+            for that many lines of text plus the good data. Gives the same results, read with
+            pandas.
         :return: DataFrame of raw data
         """
+        if chunk_rows and type(url) is pathlib.PosixPath:
+            return self._parse_in_chunks(url, chunk_rows)
+        if engine == 'pyarrow' and type(url) is pathlib.PosixPath:
+            data = arrow_ingest.read_and_clean(self, url)
+            if data is not None:  # None if pyarrow can't read this kind of file
+                if len(data) == 0:
+                    return pd.DataFrame({})
+                return self._finish_raw_data(data)
+
         names = self.data_columns
-        start_column = names[2]  # skipping fields server time and ip
+        usecols = self._read_usecols
         if type(url) is pathlib.PosixPath:
             try:
-                delim_whitespace = False
-                # adding this check for SIO Self-calibrating SeapHOx
-                with open(url, encoding="ISO-8859-1") as f:
-                    line = f.readline()
-                    if ',' not in line:
-                        delim_whitespace = True
-                data = pd.read_csv(url, names=names, encoding="ISO-8859-1",
+                if self.dialect:
+                    delim_whitespace = self.dialect.whitespace
+                else:
+                    delim_whitespace = False
+                    # adding this check for SIO Self-calibrating SeapHOx
+                    with open(url, encoding="ISO-8859-1") as f:
+                        line = f.readline()
+                        if ',' not in line:
+                            delim_whitespace = True
+                data = pd.read_csv(url, names=names, usecols=usecols, encoding="ISO-8859-1",
                                    delim_whitespace=delim_whitespace)
             except FileNotFoundError:
                 # hopefully runner will catch before this
                 logger.warn(f"No data found at {url}")
                 return pd.DataFrame({})
+            except ValueError as e:
+                if not too_many_fields(e):
+                    raise
+                logger.warn(f"{url} does not have the columns of {self.set_id}")
+                return pd.DataFrame({})
         else:
             try:
                 raw_dataset = utilities.requests_get(url)
@@ -155,7 +247,150 @@ class InstrumentSet:
                 return pd.DataFrame({})
 
             # No column headers at all here
-            data = pd.read_csv(StringIO(raw_dataset), names=names)
+            data = pd.read_csv(StringIO(raw_dataset), names=names, usecols=usecols)
+
+        return self.clean_raw_data(data)
+
+    def _read_chunks(self, path, chunk_rows, dtype=None):
+        """Read a local raw file a few lines at a time.
+
+        pandas won't read lines with fewer fields than the set has columns unless at least one
+        line has them all, which might only be in another chunk. So a chunk like that is read
+        with an extra line of empty fields, which is then dropped.
+
+        :param path: Posix path to the raw file
+        :param chunk_rows: number of lines in each chunk
+        :param dtype: optional dictionary of columns to read as something other than what
+            pandas guesses from the lines of the chunk
+        :return: iterator of (DataFrame of lines with the usecols columns, True if no line of
+            the chunk had all the fields)
+        """
+        with open(path, encoding="ISO-8859-1") as f:
+            delim_whitespace = ',' not in f.readline()
+            if self.dialect:
+                delim_whitespace = self.dialect.whitespace
+            f.seek(0)
+            delimiter = ' ' if delim_whitespace else ','
+            padding = '\n' + delimiter.join(['nan'] * len(self.data_columns))
+            while True:
+                lines = list(itertools.islice(f, chunk_rows))
+                if not lines:
+                    break
+                text = ''.join(lines)
+                kwargs = dict(names=self.data_columns, usecols=self._read_usecols,
+                              delim_whitespace=delim_whitespace, dtype=dtype)
+                try:
+                    yield pd.read_csv(StringIO(text), **kwargs), False
+                except pd.errors.EmptyDataError:
+                    continue
+                except pd.errors.ParserError as e:
+                    if 'Too many columns specified' not in str(e):
+                        raise
+                    data = pd.read_csv(StringIO(text.rstrip('\n') + padding), **kwargs)
+                    yield data.iloc[:-1], True
+
+    def _parse_in_chunks(self, path, chunk_rows):
+        """Same as retrieve_and_parse_raw_data, for a local file a few lines at a time.
+
+        The cleaning depends on which columns pandas reads as text (if any line of a column
+        isn't a number, the whole column is text). So the file is read twice: first to find
+        those columns, then to clean each chunk of lines on its own with those columns read as
+        text. The good rows of all the chunks are then sorted by time together.
+
+        :param path: Posix path to the raw file
+        :param chunk_rows: number of lines in each chunk
+        :return: DataFrame of raw data
+        """
+        try:
+            text = set()
+            complete = False
+            for data, short in self._read_chunks(path, chunk_rows):
+                text.update(data.select_dtypes(object).columns)
+                complete = complete or not short
+            if not complete:
+                logger.warn(f"No line of {path} has all the columns of {self.set_id}")
+                return pd.DataFrame({})
+            chunks = []
+            for data, _ in self._read_chunks(path, chunk_rows, dtype={c: object for c in text}):
+                data = self._good_lines(data)
+                if len(data) > 0:
+                    data = self._convert_raw_data(data)
+                if len(data) > 0:
+                    chunks.append(data)
+        except FileNotFoundError:
+            logger.warn(f"No data found at {path}")
+            return pd.DataFrame({})
+        except ValueError as e:
+            if not too_many_fields(e):
+                raise
+            logger.warn(f"{path} does not have the columns of {self.set_id}")
+            return pd.DataFrame({})
+
+        if not chunks:
+            return pd.DataFrame({})
+        data = pd.concat(chunks, ignore_index=True)
+        del chunks
+        return self._sort_raw_data(data)
+
+    def parse_raw_text(self, text) -> pd.DataFrame:
+        """Convert raw SASS data that are already in memory to a DataFrame with headers.
+
+        Same as retrieve_and_parse_raw_data, but without reading a file.
+
+        :param text: string of lines from a raw data file
+        :return: DataFrame of raw data
+        """
+        if self.dialect:
+            delim_whitespace = self.dialect.whitespace
+        else:
+            delim_whitespace = ',' not in text.split('\n', 1)[0]
+        try:
+            data = pd.read_csv(StringIO(text), names=self.data_columns,
+                               usecols=self._read_usecols, delim_whitespace=delim_whitespace)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame({})
+        except ValueError as e:
+            if not too_many_fields(e):
+                raise
+            logger.warn(f"Lines do not have the columns of {self.set_id}")
+            return pd.DataFrame({})
+
+        return self.clean_raw_data(data)
+
+    def clean_raw_data(self, data):
+        """Remove the bad lines of raw data that were just read.
+
+        See README.md for notes on how bad data is filtered out.
+
+        :param data: DataFrame of every line, with the usecols columns
+        :return: DataFrame of raw data
+        """
+        data = self._good_lines(data)
+        if len(data) == 0:
+            return pd.DataFrame({})
+        return self._finish_raw_data(data)
+
+    def _good_lines(self, data):
+        """The lines of raw data of this set that look good, still as text.
+
+        Cleaned the way of the set's dialect, or the generic way if it doesn't have one.
+
+        :param data: DataFrame of lines, with the usecols columns
+        :return: DataFrame of the good lines (empty if there are none)
+        """
+        if self.dialect:
+            good = self.dialect.clean(self, data)
+            if good is not None:
+                return good
+        return self._drop_bad_lines(data)
+
+    def _drop_bad_lines(self, data):
+        """The lines of raw data of any set that look good, still as text (the generic way).
+
+        :param data: DataFrame of lines, with the usecols columns
+        :return: DataFrame of the good lines (empty if there are none)
+        """
+        start_column = self.data_columns[2]  # skipping fields server time and ip
 
         # some incoming files have data from multiple instruments, so filter to just one
         # also filters out 0.0.0.0 except SIO SCS which has ip 0.0.0.0 in its instrument set
@@ -195,8 +430,10 @@ class InstrumentSet:
             # like SIO "19 Oct 2015 21:50:40"
             data = data.loc[~data['sensor_date'].str.contains(':')]
             # and SIO SCS has its dates like "2022/04/30" so convert that first
-            if data['sensor_date'].str.contains('/').all():
-                data['tmp_date'] = pd.to_datetime(data['sensor_date'], format="%Y/%m/%d")
+            if self.date_format:
+                data['tmp_date'] = pd.to_datetime(data['sensor_date'], format=self.date_format,
+                                                  errors='coerce')
+                data = data.loc[data['tmp_date'].notna()]
                 data['sensor_date'] = data['tmp_date'].dt.strftime("%d %b %Y ")
                 data.drop(labels=['tmp_date'], inplace=True, axis=1)
             data['sensor_time'] = data['sensor_date'] + data['sensor_time']
@@ -207,14 +444,29 @@ class InstrumentSet:
         data = data.loc[data['sensor_time'].str.contains(':')]
         if len(data) == 0:
             return pd.DataFrame({})
+        return data
+
+    def _finish_raw_data(self, data):
+        """Parse time, sort and convert to numbers, after the bad lines have been removed.
 
+        :param data: DataFrame of raw data with only good lines
+        :return: DataFrame of raw data
+        """
+        data = self._convert_raw_data(data)
+        if len(data) == 0:
+            return pd.DataFrame({})
+        return self._sort_raw_data(data)
+
+    def _convert_raw_data(self, data):
+        """Parse time and convert to numbers, after the bad lines have been removed.
+
+        :param data: DataFrame of raw data with only good lines
+        :return: DataFrame of raw data (empty if no line has a time)
+        """
         data["time"] = pd.to_datetime(data["sensor_time"], utc=True, errors='coerce')
         data.dropna(axis=0, subset=['time'], inplace=True)
         if len(data) == 0:
             return pd.DataFrame({})
-        # for the merge with calibration coefficients, make sure data are sorted by time
-        data = data.sort_values(by=['time'])
-        data.reset_index(drop=True, inplace=True)
 
         # It's important that these columns are floats
         # There might be some residual letters hanging around, and sets those cells to NoN
@@ -225,23 +477,47 @@ class InstrumentSet:
         cols = data[names].select_dtypes(object)
         data[cols.columns] = cols.apply(lambda x: pd.to_numeric(x, errors='coerce'))
 
-        # clean-up missing O2 values
-        data = data.where(data != -9.999)
-        data = data.where(data != -0.999)
+        # clean-up missing O2 values. Only numbers can be missing values, so no need to copy
+        # the whole frame to find them.
+        for column in data.select_dtypes('float').columns:
+            data.loc[data[column].isin(MISSING_VALUES), column] = np.nan
+        return data
+
+    def _sort_raw_data(self, data):
+        """Sort by time and make the low cardinality columns categories.
+
+        :param data: DataFrame of raw data from _convert_raw_data
+        :return: DataFrame of raw data
+        """
+        # for the merge with calibration coefficients, make sure data are sorted by time.
+        # Stable, so lines with the same time stay in the order of the file however it was read.
+        data = data.sort_values(by=['time'], kind='stable')
+        data.reset_index(drop=True, inplace=True)
+
+        for column in CATEGORY_COLUMNS:
+            if column in data.columns:
+                data[column] = data[column].astype('category')
 
         return data
 
-    def get_cals(self, parameter):
+    def get_cals(self, parameter, path=None):
         """Retrieve table of calibration coefficients from Google Sheet tab.
 
         For the merge with data, make sure they are sorted by time
+
+        :param parameter: 'chlor', 'o2' or 'ph'
+        :param path: optional Posix path to a CSV copy of the tab (like the ones stashed in
+            data/incoming/cals) to read instead of the Google Sheet
         """
         if self.cal_gids[parameter] == 1:
             # Short circuit for SCS O2, which has corrections but coefficients are hardcoded
             return pd.DataFrame({})
 
-        url = self.calibration_url + self.cal_gids[parameter]
-        df = pd.read_excel(url)
+        if path:
+            df = pd.read_csv(path)
+        else:
+            url = self.calibration_url + self.cal_gids[parameter]
+            df = pd.read_excel(url)
 
         if parameter == 'chlor' or parameter == 'o2':
             df['time'] = pd.to_datetime(df['START TIME UTC'], utc=True)
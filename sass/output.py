@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Write calibrated data files.
+
+Files can be compressed with gzip or (if the zstandard package is installed) zstd. Compressed
+files have the usual name plus .gz or .zst, like data-20210826.dat.gz, and pandas can read them
+directly with pd.read_csv.
+
+Rows are converted to text and compressed a chunk at a time, so the whole file is never held
+in memory as a string.
+"""
+
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# file name extension for each kind of compression
+extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def output_path(path, compression=None):
+    """Name of the file that will be written.
+
+    :param path: Posix path of the uncompressed file
+    :param compression: None, 'gzip' or 'zstd'
+    :return: Posix path with the extension for the compression added
+    """
+    if compression not in extensions:
+        raise ValueError(f'Unknown compression {compression}. '
+                         f'Must be one of {list(extensions)}')
+    return path.with_name(path.name + extensions[compression])
+
+
+def open_output(path, compression=None, level=None):
+    """Open a file for writing text, compressing as it is written.
+
+    :param path: Posix path of the file (with extension)
+    :param compression: None, 'gzip' or 'zstd'
+    :param level: compression level. If omitted, the default of each kind is used.
+    :return: file object
+    """
+    if compression is None:
+        return open(path, 'w', newline='')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', compresslevel=6 if level is None else level, newline='')
+    if zstandard is None:
+        raise ImportError('zstd compression needs the zstandard package to be installed')
+    cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+    return zstandard.open(path, 'wt', cctx=cctx, newline='')
+
+
+def write_calibrated(data, path, compression=None, level=None, chunksize=10000):
+    """Write calibrated data as CSV.
+
+    :param data: DataFrame to write
+    :param path: Posix path of the uncompressed file. The extension is added if compressed.
+    :param compression: None, 'gzip' or 'zstd'
+    :param level: compression level
+    :param chunksize: number of rows converted to text at a time
+    :return: Posix path of the file that was written
+    """
+    path = output_path(path, compression)
+    with open_output(path, compression, level) as f:
+        data.to_csv(f, index=False, na_rep='NaN', chunksize=chunksize)
+
+    return path
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read the next files and write the last ones while calibrating the current one.
+
+SassCalibrationRunner.process reads, calibrates and writes one file after another, so the disk
+waits while a day is calibrated and the CPU waits while files are read and written. Here the
+three stages run at the same time:
+
+* a reader thread reads and cleans the raw files in order (and the CTD file for pH),
+* the calling thread calibrates them,
+* a writer thread writes them (and to the store, aggregates and coverage index).
+
+Between the stages are queues of at most `depth` files. A stage that gets ahead waits for the
+next one, so no more than about 2 * depth + 3 days are in memory however long the range is.
+Files are written in the same order as SassCalibrationRunner.process writes them, by one
+thread, so the month files of the store and aggregates are updated the same way. A file that
+fails is logged and the others are still done:
+
+./call_sass.py --set np-ctd-2016b --start 2021-01-01 --end 2021-12-31 --pipeline
+"""
+
+import queue
+import threading
+
+from sass import logger
+
+# put on a queue after the last file
+DONE = object()
+
+
+def put(to, item, stop):
+    """Put an item on a queue, waiting for room unless the pipeline is stopped.
+
+    :param to: Queue
+    :param item: what to put on it
+    :param stop: threading Event that is set when the pipeline stops early
+    :return: True if the item was put on the queue
+    """
+    while not stop.is_set():
+        try:
+            to.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def read_files(runner, job, read_queue, stop):
+    """Read the files of a run onto a queue as (file, raw data, or None, or the exception).
+
+    :param runner: SassCalibrationRunner
+    :param job: Job from runner.prepare
+    :param read_queue: Queue to the calibration
+    :param stop: threading Event that is set when the pipeline stops early
+    """
+    for file in job.files:
+        try:
+            raw = runner.read_file(job, file)
+        except Exception as e:
+            logger.exception(f'Reading {file} failed')
+            raw = e
+        if not put(read_queue, (file, raw), stop):
+            return
+    put(read_queue, DONE, stop)
+
+
+def write_files(runner, job, write_queue, results, stopped):
+    """Write the calibrated files from a queue until DONE.
+
+    :param runner: SassCalibrationRunner
+    :param job: Job from runner.prepare
+    :param write_queue: Queue of (file, DataFrame of calibrated data)
+    :param results: dictionary to put the number of rows written (or the exception) by file
+    :param stopped: threading Event that is set when this stops taking files, however it stops
+    """
+    try:
+        while True:
+            item = write_queue.get()
+            if item is DONE:
+                return
+            file, data = item
+            try:
+                runner.write_file(job, file, data)
+                results[file] = len(data)
+            except Exception as e:
+                logger.exception(f'Writing {file} failed')
+                results[file] = e
+    finally:
+        stopped.set()
+
+
+def process_pipelined(runner, job, depth=2):
+    """Read, calibrate and write the files of a run, overlapping the three.
+
+    :param runner: SassCalibrationRunner
+    :param job: Job from runner.prepare
+    :param depth: number of files that can wait between two stages
+    :return: list with an item for each of job.files: the number of calibrated rows written,
+        None if there were no data, or the exception if it failed
+    """
+    if depth < 1:
+        raise ValueError(f'depth must be at least 1, not {depth}')
+    read_queue = queue.Queue(maxsize=depth)
+    write_queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    writer_stopped = threading.Event()  # so nothing waits for room on its queue
+    results = {}
+    sent = []  # files given to the writer
+    item = None
+    reader = threading.Thread(target=read_files, args=(runner, job, read_queue, stop),
+                              name='sass-reader', daemon=True)
+    writer = threading.Thread(target=write_files,
+                              args=(runner, job, write_queue, results, writer_stopped),
+                              name='sass-writer', daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            item = read_queue.get()
+            if item is DONE:
+                break
+            file, raw = item
+            if raw is None or isinstance(raw, Exception):
+                results[file] = raw
+                continue
+            try:
+                data = runner.calibrate_file(job, file, *raw)
+            except Exception as e:
+                logger.exception(f'Calibrating {file} failed')
+                results[file] = e
+                continue
+            if not put(write_queue, (file, data), writer_stopped):
+                break
+            sent.append(file)
+    finally:
+        stop.set()  # the reader stops early if this thread did
+        put(write_queue, DONE, writer_stopped)  # the writer finishes what it was given
+        writer.join()
+        reader.join()
+
+    if item is not DONE or any(file not in results for file in sent):
+        logger.error('The writer stopped before all the files were written')
+        for file in job.files:
+            results.setdefault(file, RuntimeError(f'{file} was not written'))
+    return [results.get(file) for file in job.files]
+
+
+def calibrate_pipelined(runner, set_id, start, end, days=None, cals=None, depth=2):
+    """Calibrate the days of a set, reading and writing in the background.
+
+    :param runner: SassCalibrationRunner that reads, calibrates and writes each day
+    :param set_id: unique identifier for set of instruments to be processed
+    :param start: datetime for first data to be processed
+    :param end: datetime for last data to be processed
+    :param days: optional list of datetimes (see SassCalibrationRunner.run)
+    :param cals: optional dictionary of calibration coefficients by parameter
+    :param depth: number of files that can wait between two stages
+    :return: None if successful, 1 if not (same as SassCalibrationRunner.run)
+    """
+    job = runner.prepare(start=start, end=end, set_id=set_id, days=days, cals=cals)
+    if job is None:
+        return 1
+
+    results = process_pipelined(runner, job, depth=depth)
+
+    failed = [file for file, result in zip(job.files, results) if isinstance(result, Exception)]
+    rows = sum(result for result in results if isinstance(result, int))
+    done = sum(isinstance(result, int) for result in results)
+    logger.info(f'Calibrated {rows} rows in {done} files of {set_id}')
+    if failed:
+        logger.error(f'{len(failed)} files of {set_id} failed: {failed}')
+        return 1
+    runner.stash_cals(job)
+    logger.info("All done!")
+    return None
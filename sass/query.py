@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read calibrated data of a station or set between two times.
+
+For example, O2 at Newport Pier for a week:
+sass-query --station "Newport Pier" -t1 2021-01-10 -t2 2021-01-17 --columns o2 > o2.csv
+
+or in Python:
+from sass.query import query
+for chunk in query('np-ctd-2016b', start, end, columns=['o2']):
+    ...
+
+Only the sets active in the time range and only the day files that can have those times (plus
+the day on each side, since a file can have a few rows from the next or previous day) are read.
+Only the requested columns are parsed from them, rows outside the range are dropped as each file
+is read, and the results come back a file at a time, so a long range never has to fit in memory.
+
+If a set has an array store (see array_store.py), the days in it are read from that instead, a
+month at a time, and the days that aren't in it (like the days before the store was started)
+from the calibrated files. Calibrated files can be plain or compressed (see output.py).
+"""
+
+import re
+import sys
+import argparse
+import datetime
+from pathlib import Path
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from sass import logger, utilities
+
+from . import discovery, output, sass_runner
+from .array_store import ArrayStore, extensions
+
+# calibrated day files, like data-20210826.dat or data-20210826.dat.gz
+CALIBRATED_NAME = re.compile(r'^data[-_](\d{8})\.dat(%s)?$'
+                             % '|'.join(re.escape(e) for e in output.extensions.values() if e))
+
+
+def find_sets(target, configs, start, end):
+    """Sets of a station (or one set) that were active in a time range.
+
+    :param target: set_id or station name (not case sensitive)
+    :param configs: list of InstrumentSets
+    :param start: datetime (UTC)
+    :param end: datetime (UTC)
+    :return: list of InstrumentSets
+    """
+    sets = [s for s in configs if s.set_id == target
+            or (s.station_name or '').lower() == target.lower()]
+    return [s for s in sets if s.start_date and s.start_date <= end and s.end_date >= start]
+
+
+def calibrated_files(this_set, start, end, outgoing_dir):
+    """Calibrated day files of a set that might have data between two times.
+
+    Each month's directory is listed once (see discovery.py). If a day was written more than
+    once with different compressions, the newest file is used.
+
+    :param this_set: InstrumentSet
+    :param start: datetime (UTC)
+    :param end: datetime (UTC)
+    :param outgoing_dir: Posix path of the directory with calibrated data
+    :return: list of Posix paths that exist, in order
+    """
+    first = max(start - relativedelta(days=1), this_set.start_date)
+    last = min(end + relativedelta(days=1), this_set.end_date)
+    root = Path(outgoing_dir).joinpath(this_set.proc_data_tag)
+    found = {}
+    for month in discovery.months(first, last):
+        directory = root.joinpath(month.strftime('%Y-%m'))
+        for name, (_, mtime) in discovery.scan_month(directory, CALIBRATED_NAME).items():
+            try:
+                day = datetime.datetime.strptime(CALIBRATED_NAME.match(name).group(1), '%Y%m%d')
+            except ValueError:
+                continue  # like data-20210231.dat
+            if not first.date() <= day.date() <= last.date():
+                continue
+            if day.date() not in found or mtime > found[day.date()][1]:
+                found[day.date()] = (directory.joinpath(name), mtime)
+    return [found[day][0] for day in sorted(found)]
+
+
+def find_store(set_id, store_dir):
+    """The array store of a set, if there is one.
+
+    :param set_id: unique identifier for set of instruments
+    :param store_dir: Posix path of the array store
+    :return: ArrayStore or None
+    """
+    directory = Path(store_dir).joinpath(set_id)
+    if not directory.exists():
+        return None
+    for format, extension in extensions.items():
+        if any(directory.glob('*' + extension)):
+            try:
+                return ArrayStore(store_dir, format)
+            except ImportError:
+                logger.debug(f'{set_id} has an array store, but xarray is not installed')
+                return None
+    return None
+
+
+def read_file(path, start, end, columns=None, chunksize=None):
+    """Read the rows of a calibrated file between two times.
+
+    :param path: Posix path
+    :param start: datetime (UTC)
+    :param end: datetime (UTC)
+    :param columns: optional list of columns. If omitted, all of them.
+    :param chunksize: optional number of lines to parse at a time
+    :return: generator of DataFrames with a time column (UTC)
+    """
+    usecols = None
+    if columns is not None:
+        wanted = set(columns) | {'sensor_time'}
+        usecols = lambda column: column in wanted  # noqa: E731
+    chunks = pd.read_csv(path, usecols=usecols, chunksize=chunksize)
+    for chunk in [chunks] if chunksize is None else chunks:
+        time = pd.to_datetime(chunk['sensor_time'], utc=True, errors='coerce')
+        keep = (time >= start) & (time <= end)
+        if columns is not None and 'sensor_time' not in columns:
+            chunk = chunk.drop(columns=['sensor_time'])
+        chunk = chunk.loc[keep]
+        chunk.insert(0, 'time', time[keep])
+        if len(chunk):
+            yield chunk
+
+
+def read_set(this_set, start, end, columns, outgoing_dir, store=None, chunksize=None):
+    """Read a set's calibrated data between two times, a month at a time.
+
+    The days in the array store are read from it, and the other days from the calibrated files.
+
+    :param this_set: InstrumentSet
+    :param start: datetime (UTC)
+    :param end: datetime (UTC)
+    :param columns: list of columns, or None for all of them
+    :param outgoing_dir: Posix path of the directory with calibrated data
+    :param store: optional ArrayStore of the set
+    :param chunksize: optional number of lines to parse at a time
+    :return: generator of DataFrames with a time column (UTC), in the order of the days
+    """
+    months = {}
+    for path in calibrated_files(this_set, start.to_pydatetime(), end.to_pydatetime(),
+                                 outgoing_dir):
+        file_date = int(CALIBRATED_NAME.match(path.name).group(1))
+        months.setdefault(file_date // 100, {})[file_date] = path
+    month_files = {}
+    if store:
+        for path in store.paths(this_set.set_id, start, end):
+            month = int(path.stem.replace('-', ''))
+            month_files[month] = path
+            months.setdefault(month, {})
+
+    for month in sorted(months):
+        files = months[month]
+        stored, days = {}, set()
+        if month in month_files:
+            wanted = None if columns is None else list(columns) + ['file_date']
+            data = store.read_path(month_files[month], start, end, wanted)
+            stored = dict(tuple(data.groupby('file_date')))
+            days = store.days(month_files[month])
+        for day in sorted(set(files) | days):
+            if day not in days:
+                yield from read_file(files[day], start, end, columns, chunksize)
+            elif day in stored:  # it has rows in the range
+                chunk = stored[day].reset_index(drop=True)
+                if columns is None or 'file_date' not in columns:
+                    chunk = chunk.drop(columns=['file_date'])
+                yield chunk
+
+
+def query(target, start, end, columns=None, config_path=None, outgoing_dir=None,
+          store_dir=None, chunksize=None):
+    """Read calibrated data between two times.
+
+    :param target: set_id or station name
+    :param start: datetime (UTC) of earliest time
+    :param end: datetime (UTC) of latest time
+    :param columns: optional list of columns. If omitted, all of them.
+    :param config_path: Posix path to JSON configuration file
+    :param outgoing_dir: Posix path of the directory with calibrated data
+    :param store_dir: Posix path of the array store
+    :param chunksize: optional number of lines to parse at a time
+    :return: generator of DataFrames with set_id, time (UTC) and the columns. Each set's
+        rows are in the order of its files.
+    """
+    config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+    outgoing_dir = outgoing_dir or sass_runner.here.joinpath(sass_runner.outgoing)
+    store_dir = store_dir or sass_runner.here.joinpath(sass_runner.store)
+    start = pd.Timestamp(start).tz_localize('UTC') if pd.Timestamp(start).tzinfo is None \
+        else pd.Timestamp(start)
+    end = pd.Timestamp(end).tz_localize('UTC') if pd.Timestamp(end).tzinfo is None \
+        else pd.Timestamp(end)
+
+    sets = find_sets(target, sass_runner.load_configs(config_path), start, end)
+    if not sets:
+        logger.warning(f'No sets of {target} between {start} and {end}')
+    for this_set in sets:
+        store = find_store(this_set.set_id, store_dir)
+        if store:
+            logger.debug(f'Reading {this_set.set_id} from {store.format} store and files')
+        for chunk in read_set(this_set, start, end, columns, outgoing_dir, store, chunksize):
+            chunk.insert(0, 'set_id', this_set.set_id)
+            yield chunk
+
+
+def main():
+    """Organizes the input arguments and writes the results to stdout as CSV."""
+    parser = argparse.ArgumentParser(description='Read calibrated SASS data of a station or set '
+                                                 'between two times.')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-s', '--set', dest='target', type=str, help='Id of an instrument set.')
+    target.add_argument('--station', dest='target', type=str,
+                        help='Station name, like "Newport Pier". All its sets are read.')
+    parser.add_argument('-t1', '--start', dest='start', required=True, type=str,
+                        help='Start time, like 2021-08-26 or 2021-08-26T06:00:00Z (UTC).')
+    parser.add_argument('-t2', '--end', dest='end', required=True, type=str,
+                        help='End time. A date alone means the end of that day.')
+    parser.add_argument('-c', '--columns', dest='columns', type=str,
+                        help='Comma separated columns, like chlor,o2. If omitted, all of them.')
+    args = parser.parse_args()
+
+    utilities.log_to_stderr(logger)  # stdout is for the data
+    start = utilities.parse_datetime(args.start)
+    end = utilities.parse_datetime(args.end)
+    if len(args.end) <= 10:  # just a date
+        end = end + relativedelta(days=1, microseconds=-1)
+    columns = args.columns.split(',') if args.columns else None
+
+    header = None
+    for chunk in query(args.target, start, end, columns):
+        if header is None:
+            header = list(chunk.columns)
+            chunk.to_csv(sys.stdout, index=False, na_rep='NaN', date_format='%Y-%m-%dT%H:%M:%SZ')
+        else:
+            # sets of a station can have different columns, but a CSV has one header
+            missing = set(chunk.columns) - set(header)
+            if missing:
+                logger.warning(f'Leaving out {sorted(missing)} of {chunk["set_id"].iloc[0]}. '
+                               'Use --columns to choose them.')
+            chunk.reindex(columns=header).to_csv(sys.stdout, header=False, index=False,
+                                                 na_rep='NaN', date_format='%Y-%m-%dT%H:%M:%SZ')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cache of raw data files that have already been cleaned.
+
+Cleaning a raw data file is the slowest part of processing it. When only the calibration
+coefficients have changed, the cleaned data will be the same as last time, so keep a copy.
+
+Copies are named by a hash of the contents of the raw file, the instrument set (its columns,
+which of them are kept, its IP and the dialect its files are cleaned with), and the version of
+the parser. If any of those
+change, the copy isn't found and the file is cleaned again. Old copies are never used, just
+left behind, so it is always safe to delete the cache directory.
+
+Copies are written as Feather files if pyarrow is installed, and pickles otherwise.
+"""
+
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from sass import logger
+
+from .instrument_set import PARSER_VERSION
+
+try:
+    import pyarrow  # noqa: F401
+    suffix = '.feather'
+except ImportError:
+    suffix = '.pkl'
+
+
+class RawDataCache:
+    """Stores cleaned DataFrames under a directory."""
+    def __init__(self, root):
+        """Set where the cleaned DataFrames are kept.
+
+        :param root: Posix path to the cache directory. Created if it doesn't exist.
+        """
+        self.root = Path(root)
+
+    def key(self, this_set, path):
+        """Unique name for the cleaned version of a raw file.
+
+        :param this_set: InstrumentSet that will parse the file
+        :param path: Posix path to the raw file
+        :return: hex string
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        dialect = this_set.dialect.name if this_set.dialect else 'generic'
+        digest.update(f'{this_set.set_id}|{this_set.ip}|{this_set.data_columns}|'
+                      f'{this_set.usecols}|{dialect}|{PARSER_VERSION}'.encode())
+        return digest.hexdigest()
+
+    def path(self, this_set, key):
+        """Where the cleaned DataFrame is kept."""
+        return self.root.joinpath(this_set.set_id, key[:2], key + suffix)
+
+    def load(self, path):
+        """Read a cleaned DataFrame.
+
+        :param path: Posix path of the copy
+        :return: DataFrame or None if there isn't a copy
+        """
+        if path.with_suffix('.empty').exists():
+            return pd.DataFrame({})  # same as what the parser returns when there is no data
+        if not path.exists():
+            return None
+        if suffix == '.feather':
+            return pd.read_feather(path)
+        return pd.read_pickle(path)
+
+    def save(self, path, data):
+        """Write a cleaned DataFrame.
+
+        It is written under a temporary name (of this process and thread) and moved into place,
+        so nobody ever reads half a file, even if two runs clean the same file at once.
+
+        :param path: Posix path of the copy
+        :param data: DataFrame of cleaned data
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if len(data.columns) == 0:
+            # feather can't write a DataFrame without columns, so just leave a marker
+            path.with_suffix('.empty').touch()
+            return
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        if suffix == '.feather':
+            data.to_feather(tmp)
+        else:
+            data.to_pickle(tmp)
+        tmp.replace(path)
+
+    def retrieve_and_parse_raw_data(self, this_set, path, engine='pandas', chunk_rows=None):
+        """Same as InstrumentSet.retrieve_and_parse_raw_data, but use a copy if there is one.
+
+        :param this_set: InstrumentSet that parses the file
+        :param path: Posix path to the raw file
+        :param engine: 'pandas' or 'pyarrow'. Either gives the same result, so it is not part
+            of the name of the copy.
+        :param chunk_rows: optional number of lines to clean at a time. Not part of the name
+            either.
+        :return: DataFrame of raw data
+        """
+        cached = self.path(this_set, self.key(this_set, path))
+        data = self.load(cached)
+        if data is not None:
+            logger.debug(f'Using cleaned copy of {path}')
+            return data
+
+        data = this_set.retrieve_and_parse_raw_data(path, engine=engine, chunk_rows=chunk_rows)
+        self.save(cached, data)
+        return data
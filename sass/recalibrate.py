@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Recalibrate only the days affected by changes to the calibration coefficients.
+
+Each run of SassCalibrationRunner that succeeds stashes the coefficients it used in
+data/incoming/cals. When
+SCCOOS staff fix a row in the Google Sheet, the new table is compared to that copy to find the
+rows that changed.
+
+For chlorophyll and O2, a row applies from its START TIME UTC until the next row starts, so the
+days to redo are the ones in that interval (in either the old or the new version of the table).
+pH coefficients are looked up by SERIAL NUMBER, so the days to redo are the ones where that
+SeaFET appears in the raw data.
+"""
+
+import argparse
+from io import StringIO
+from pathlib import Path
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from sass import logger
+
+from . import sass_runner
+from .discovery import find_files
+
+
+def changed_rows(old, new):
+    """Find the rows that are not the same in both versions of a coefficient table.
+
+    Both tables are compared as text, the way they are stashed, so that reading from CSV
+    or from the Sheet doesn't matter.
+
+    :param old: DataFrame of previous coefficients or None if there wasn't any
+    :param new: DataFrame of current coefficients
+    :return: DataFrame (all strings) of rows removed from old or added to new
+    """
+    def as_text(df):
+        if len(df.columns) == 0:  # like the table of builtin coefficients
+            return pd.DataFrame({})
+        return pd.read_csv(StringIO(df.to_csv(index=False)), dtype=str, keep_default_na=False)
+
+    new = as_text(new)
+    if old is None:
+        return new
+    old = as_text(old)
+
+    columns = list(dict.fromkeys(list(old.columns) + list(new.columns)))
+    old = old.reindex(columns=columns, fill_value='')
+    new = new.reindex(columns=columns, fill_value='')
+    old_rows = set(old.itertuples(index=False, name=None))
+    new_rows = set(new.itertuples(index=False, name=None))
+    changes = sorted((old_rows - new_rows) | (new_rows - old_rows))
+
+    return pd.DataFrame(changes, columns=columns)
+
+
+def affected_intervals(old, new, changes):
+    """Find the times when the changed rows are in effect.
+
+    :param old: DataFrame of previous coefficients or None
+    :param new: DataFrame of current coefficients
+    :param changes: DataFrame returned by changed_rows
+    :return: list of (start, end) Timestamps. end is None if the row is still in effect.
+    """
+    def starts(df):
+        if df is None or len(df) == 0:
+            return pd.Series([], dtype='datetime64[ns, UTC]')
+        return pd.to_datetime(df['START TIME UTC'], utc=True)
+
+    old_starts = starts(old)
+    new_starts = starts(new)
+    intervals = []
+    for start in starts(changes).dropna().unique():
+        ends = []
+        for table_starts in (old_starts, new_starts):
+            later = table_starts[table_starts > start]
+            ends.append(later.min() if len(later) else None)
+        # until whichever version kept the row longer
+        end = None if None in ends else max(ends)
+        intervals.append((start, end))
+
+    return intervals
+
+
+def days_in_intervals(this_set, intervals, incoming_dir):
+    """Days with raw data files that have any time in the intervals.
+
+    :param this_set: InstrumentSet
+    :param intervals: list of (start, end) Timestamps
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: set of datetimes (midnight)
+    """
+    days = set()
+    for start, end in intervals:
+        start = max(start.to_pydatetime(), this_set.start_date)
+        if end is None:
+            end = this_set.end_date
+        else:
+            # end is when the next row starts, so it isn't included
+            end = min(end.to_pydatetime() - relativedelta(microseconds=1), this_set.end_date)
+        days.update(existing_days(this_set, start, end, incoming_dir))
+
+    return days
+
+
+def existing_days(this_set, start, end, incoming_dir):
+    """Days between start and end that have a raw data file.
+
+    :param this_set: InstrumentSet
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: dictionary of datetime (midnight) to Posix path of the file
+    """
+    return {f.day: Path(incoming_dir).joinpath(f.name)
+            for f in find_files(this_set, start, end, incoming_dir)}
+
+
+def days_with_serial_numbers(this_set, serial_numbers, incoming_dir):
+    """Days when one of the SeaFETs appears in the raw data.
+
+    :param this_set: InstrumentSet
+    :param serial_numbers: set of ints, like 2145 for SEAFET02145
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: set of datetimes (midnight)
+    """
+    days = set()
+    files = existing_days(this_set, this_set.start_date, this_set.end_date, incoming_dir)
+    whitespace = this_set.dialect.whitespace if this_set.dialect else False
+    for day, path in files.items():
+        try:
+            # lines with too many fields are garbled anyway
+            raw = pd.read_csv(path, names=this_set.data_columns, usecols=['ip', 'serial_number'],
+                              encoding="ISO-8859-1", dtype=str, on_bad_lines='skip',
+                              delim_whitespace=whitespace)
+        except pd.errors.EmptyDataError:
+            continue
+        except ValueError as e:  # like the first line having too many fields
+            logger.warning(f'Could not read the serial numbers of {path}: {e}')
+            continue
+        raw = raw.loc[raw['ip'] == this_set.ip]
+        found = raw['serial_number'].str.replace('SEAFET', '')
+        found = set(pd.to_numeric(found, errors='coerce').dropna().astype(int))
+        if found & serial_numbers:
+            days.add(day)
+
+    return days
+
+
+def affected_days(this_set, parameter, old, new, incoming_dir):
+    """Days that will calibrate differently with the new coefficients.
+
+    :param this_set: InstrumentSet
+    :param parameter: 'chlor', 'o2' or 'ph'
+    :param old: DataFrame of previous coefficients or None if there wasn't any
+    :param new: DataFrame of current coefficients
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: set of datetimes (midnight)
+    """
+    changes = changed_rows(old, new)
+    if len(changes) == 0:
+        return set()
+    logger.info(f'{len(changes)} changed rows of {parameter} coefficients for {this_set.set_id}')
+
+    if parameter == 'ph':
+        serial_numbers = set(pd.to_numeric(changes['SERIAL NUMBER'], errors='coerce')
+                             .dropna().astype(int))
+        return days_with_serial_numbers(this_set, serial_numbers, incoming_dir)
+
+    intervals = affected_intervals(old, new, changes)
+    return days_in_intervals(this_set, intervals, incoming_dir)
+
+
+def recalibrate(set_id, runner=None, config_path=None, incoming_dir=None):
+    """Get the current coefficients and redo the days where they changed.
+
+    :param set_id: unique identifier for set of instruments
+    :param runner: SassCalibrationRunner to do the processing
+    :param config_path: Posix path to JSON configuration file
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: None if successful, 1 if not (same as SassCalibrationRunner.run)
+    """
+    config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+    incoming_dir = incoming_dir or sass_runner.here.joinpath(sass_runner.incoming)
+    runner = runner or sass_runner.SassCalibrationRunner()
+
+    configs = sass_runner.load_configs(config_path, set=set_id)
+    if len(configs) == 0:
+        logger.error(f'****  {set_id} is not defined in instrument_set.json ****')
+        return 1
+    this_set = configs[0]
+    if not this_set.start_date:
+        logger.info(f'{set_id} is not active yet. Nothing to recalibrate.')
+        return None
+
+    cals = {}
+    days = set()
+    for parameter in this_set.parameters:
+        if this_set.cal_gids[parameter] == 1:
+            continue  # builtin coefficients, like SCS O2. They only change with the code.
+        new = this_set.get_cals(parameter)
+        path = sass_runner.cal_path(set_id, parameter, incoming_dir)
+        if path.exists():
+            old = pd.read_csv(path)
+        else:
+            logger.info(f'No previous {parameter} coefficients for {set_id}. Redo all days.')
+            old = None
+        days.update(affected_days(this_set, parameter, old, new, incoming_dir))
+        cals[parameter] = new
+
+    if not days:
+        logger.info(f'No coefficients changed for {set_id}')
+        return None
+
+    logger.info(f'Recalibrating {len(days)} days of {set_id}')
+    # to the end of the last day, in case the set starts during it
+    return runner.run(start=min(days), end=max(days) + relativedelta(days=1, microseconds=-1),
+                      set_id=set_id, days=days, cals=cals)
+
+
+def main():
+    """Organizes the input arguments and recalibrates."""
+    parser = argparse.ArgumentParser(description='Recalibrate SASS data where the calibration '
+                                                 'coefficients have changed.')
+    parser.add_argument('-s', '--set', dest='set_id', required=True, type=str,
+                        help='Id of the set of instruments to check. '
+                             'Must be defined in instrument_sets.json or be '
+                             '"all" to do all instrument sets.')
+    args = parser.parse_args()
+
+    if args.set_id != 'all':
+        set_ids = [args.set_id]
+    else:
+        path = sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+        set_ids = [s.set_id for s in sass_runner.load_configs(path)]
+
+    failed = [s for s in set_ids if recalibrate(s)]
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,17 +3,31 @@
 
 """Functions to establish the processing pathway."""
 
+import os
 import json
+import threading
 from pathlib import Path
 
 from sass import logger, instrument_set
 
-from .calibrations import get_o2, get_ph, get_chlor, get_scs_o2
+from . import output
+from .raw_cache import RawDataCache
+from .aggregates import Aggregates
+from .array_store import ArrayStore, file_day
+from .station import merge_nearest, station_file
+from .calibrations import calibrate_data
+from .discovery import DirectoryIndex, find_files
+from .coverage import CoverageIndex, count_lines
 
 here = Path(__file__).parent
 instrument_set_filename = 'config/instrument_sets.json'
 incoming = '../data/incoming/'
 outgoing = '../data/calibrated/'
+cache = '../data/cache/'
+store = '../data/store/'
+aggregates = '../data/aggregates/'
+file_index = '../data/file_index.json'
+coverage = '../data/coverage.sqlite'
 
 
 def load_configs(path_to_file, set=None):
@@ -35,25 +49,130 @@ def load_configs(path_to_file, set=None):
     return configs
 
 
+def cal_path(set_id, parameter, incoming_dir=None):
+    """Where the latest copy of the calibration coefficients of a set are stashed.
+
+    :param set_id: unique identifier for set of instruments
+    :param parameter: 'chlor', 'o2' or 'ph'
+    :param incoming_dir: Posix path to the directory where raw data are found. If omitted,
+        the usual one.
+    :return: Posix path to a CSV file
+    """
+    incoming_dir = Path(incoming_dir or here.joinpath(incoming))
+    return incoming_dir.joinpath(f'cals/{set_id}_{parameter}.csv')
+
+
 class SassCalibrationRunner:
-    """Run the processing pipeline."""
+    """Run the processing pipeline.
 
-    def run(self, start=None, end=None, set_id=None):
-        """Run the processing.
+    Nothing is changed by a run (not the runner, the InstrumentSets or coefficients that are
+    passed in), so one runner can do many runs, one after another or at the same time in
+    different threads.
+    """
+
+    def __init__(self, cache_dir=None, engine='pandas', compression=None,
+                 compression_level=None, ph_engine='exact', store_dir=None, store_format='zarr',
+                 merge_tolerance=None, aggregates_dir=None, workers=1, config_path=None,
+                 incoming_dir=None, outgoing_dir=None, file_index=None, chunk_rows=None,
+                 coverage_path=None):
+        """Set up how the processing is done.
+
+        :param cache_dir: optional Posix path where cleaned raw data are cached. If omitted,
+            every raw file is cleaned every time.
+        :param engine: 'pandas' or 'pyarrow' (if installed) to read and clean raw data
+        :param compression: None, 'gzip' or 'zstd' (if installed) to compress output files
+        :param compression_level: optional level of compression
+        :param ph_engine: 'exact' or 'table' to calculate external pH with a lookup table of
+            the salinity and temperature corrections (see ph_lookup.py)
+        :param store_dir: optional Posix path of an array store where calibrated days are
+            also written (see array_store.py)
+        :param store_format: 'zarr' or 'netcdf' for the array store
+        :param merge_tolerance: optional largest time difference (like '2min') to also write
+            pH merged with the calibrated CTD data of its station (see station.py)
+        :param aggregates_dir: optional Posix path where hourly and daily statistics of the
+            calibrated data are kept (see aggregates.py)
+        :param workers: number of parameters of a set (like chlor and o2) that can be
+            calibrated at the same time
+        :param config_path: Posix path to JSON configuration file. If omitted, the usual one.
+        :param incoming_dir: Posix path to the directory where raw data are found (and
+            coefficients are stashed in cals/). If omitted, the usual one.
+        :param outgoing_dir: Posix path to the directory where calibrated data are written. If
+            omitted, the usual one.
+        :param file_index: optional Posix path of a JSON file where the raw files found in
+            each month's directory are kept between runs (see discovery.py)
+        :param chunk_rows: optional number of lines of a raw file to clean at a time, so that
+            memory doesn't depend on the size of the file (see
+            InstrumentSet.retrieve_and_parse_raw_data)
+        :param coverage_path: optional Posix path of a SQLite file where the rows, times and
+            missing values of each calibrated day are recorded (see coverage.py)
+        """
+        self.config_path = Path(config_path or here.joinpath(instrument_set_filename))
+        self.incoming_dir = Path(incoming_dir or here.joinpath(incoming))
+        self.outgoing_dir = Path(outgoing_dir or here.joinpath(outgoing))
+        self.cache = RawDataCache(cache_dir) if cache_dir else None
+        self.engine = engine
+        output.output_path(self.outgoing_dir, compression)  # check it now rather than later
+        self.compression = compression
+        self.compression_level = compression_level
+        self.ph_engine = ph_engine
+        self.store = ArrayStore(store_dir, store_format) if store_dir else None
+        self.merge_tolerance = merge_tolerance
+        self.aggregates = Aggregates(aggregates_dir) if aggregates_dir else None
+        self.workers = workers
+        self.file_index = DirectoryIndex(file_index) if file_index else None
+        self.chunk_rows = chunk_rows
+        self.coverage = CoverageIndex(coverage_path) if coverage_path else None
+
+    def read_raw_data(self, this_set, path):
+        """Read and clean a raw data file, using the cache if there is one.
+
+        :param this_set: InstrumentSet that parses the file
+        :param path: Posix path to the raw file
+        :return: DataFrame of raw data
+        """
+        if self.cache:
+            return self.cache.retrieve_and_parse_raw_data(this_set, path, engine=self.engine,
+                                                          chunk_rows=self.chunk_rows)
+        return this_set.retrieve_and_parse_raw_data(path, engine=self.engine,
+                                                    chunk_rows=self.chunk_rows)
+
+    def write_station(self, station_set, ctd_data, cals, ph_data, file):
+        """Calibrate the CTD data that were read for salinity, and write them with the pH.
+
+        :param station_set: InstrumentSet of the CTD
+        :param ctd_data: DataFrame of cleaned raw CTD data
+        :param cals: dictionary of calibration coefficients of the CTD by parameter
+        :param ph_data: DataFrame of calibrated pH data
+        :param file: name of the raw pH file
+        """
+        station = calibrate_data(ctd_data.copy(), station_set.calibrations, cals,
+                                 ph_engine=self.ph_engine, workers=self.workers)
+        station = merge_nearest(station, ph_data, 'ph', self.merge_tolerance)
+        path = self.outgoing_dir.joinpath(station_file(file, station_set))
+        logger.debug(f'Writing to {str(path)}')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        output.write_calibrated(station.drop(columns=['time']), path,
+                                compression=self.compression, level=self.compression_level)
+
+    def prepare(self, start=None, end=None, set_id=None, days=None, cals=None):
+        """Find the set, its files and its calibration coefficients for a run.
 
         :param start: datetime for first data to be processed
         :param end: Datetime for last data to be processed
         :param set_id: unique identifier for set of instruments to be processed
-        :return:
+        :param days: optional list of datetimes. If given, only these days between start and
+            end are processed
+        :param cals: optional dictionary of calibration coefficients by parameter that were
+            already retrieved. They are not changed, so they can be used for other runs.
+        :return: Job, or None if the set can't be processed
         """
         logger.info(f'{start.date()} to {end.date()} for instrument set {set_id}')
         # Get the instrument configuration
-        path = here.joinpath(instrument_set_filename)
-        configs = load_configs(path, set=set_id)
+        configs = load_configs(self.config_path, set=set_id)
         if len(configs) == 0:
             logger.error(f'****  {set_id} is not defined in instrument_set.json ****')
             logger.error('Job failed.')
-            return 1
+            return None
         else:
             this_set = configs[0]
 
@@ -62,92 +181,218 @@ class SassCalibrationRunner:
             logger.error(f'{this_set.set_id} is not active yet. '
                          'Set start_date in instrument_set.json and try again.')
             logger.error('Job failed.')
-            return 1
+            return None
         if end < this_set.start_date or start > this_set.end_date:
             logger.error(f'{this_set.set_id} is not active during the time you requested.')
             logger.error('Job failed.')
-            return 1
+            return None
         start = max(start, this_set.start_date)
         end = min(end, this_set.end_date)
         logger.info(f'Adjusted: {start.date()} to {end.date()} for instrument set {set_id}')
         logger.info(this_set)
-        files = this_set.build_file_list(start, end)
+        files = [f.name for f in find_files(this_set, start, end, self.incoming_dir,
+                                            index=self.file_index, days=days)]
+        if self.file_index:
+            self.file_index.save()
+        logger.info(f'Found {len(files)} raw data files')
 
         # If doing pH, then also need salinity from the CTD. Don't do it if can't find it.
+        # The parameters of this run are kept apart so the InstrumentSet isn't changed.
+        parameters = list(this_set.parameters)
         salinity_set = instrument_set.InstrumentSet(set_id='Empty')
-        if 'ph' in this_set.parameters:
+        if 'ph' in parameters:
             if this_set.ph_salinity_set:
-                configs = load_configs(path, set=this_set.ph_salinity_set)
+                configs = load_configs(self.config_path, set=this_set.ph_salinity_set)
                 if len(configs) == 0:
                     logger.error('For pH, must include where to get salinity. But can not find '
                                  f'the {this_set.ph_salinity_set}. Just copying files without '
                                  'pH adjustment.')
-                    this_set.parameters.remove('ph')
+                    parameters.remove('ph')
                 else:
                     salinity_set = configs[0]
                 logger.debug(salinity_set)
             else:
                 logger.error('For pH, must include where to get salinity. Set ph_salinity_set in '
                              'instrument_set.json. Just copying files without pH adjustment.')
-                this_set.parameters.remove('ph')
+                parameters.remove('ph')
 
-        # read and stash the calibration coeffs
-        # TODO maybe switch to reading local, pre-grabbed coeffs?
+        # read the calibration coeffs. They are stashed once the run succeeds (see stash_cals)
         # Note: SCS O2 doesn't have coefficients in a Google Sheet, but still needs correction
-        cals = {}
-        for parameter in this_set.parameters:
-            logger.info(f'Getting calibration coefficients for {parameter}')
-            df_cal = this_set.get_cals(parameter)
-            cal_filename = f'{incoming}cals/{this_set.set_id}_{parameter}.csv'
-            path = here.joinpath(cal_filename)
-            df_cal.to_csv(path, index=False)
-            cals[parameter] = df_cal
-
-        for file in files:
-            path = here.joinpath(incoming + file)
-            if not path.exists():
-                logger.debug(f"No {file}. Skipping...")
-                continue
-            logger.debug(f'Reading {path}')
-            data = this_set.retrieve_and_parse_raw_data(path)
-            if len(data) == 0:
-                logger.debug("no data")
-                continue
+        cals = dict(cals or {})
+        for parameter in parameters:
+            if parameter not in cals:
+                logger.info(f'Getting calibration coefficients for {parameter}')
+                cals[parameter] = this_set.get_cals(parameter)
+
+        # to merge pH with the CTD, the CTD needs its own coefficients
+        salinity_cals = {}
+        if self.merge_tolerance and 'ph' in parameters:
+            for parameter in salinity_set.parameters:
+                logger.info(f'Getting calibration coefficients for {parameter} of '
+                            f'{salinity_set.set_id}')
+                salinity_cals[parameter] = salinity_set.get_cals(parameter)
+
+        return Job(this_set, files, parameters, cals, salinity_set, salinity_cals)
+
+    def stash_cals(self, job):
+        """Keep a copy of the coefficients of a run that succeeded, for recalibrate.py.
+
+        Each copy is written to a temporary file and then replaces the old one all at once, so
+        runs at the same time (or a reader) never see half a file.
+
+        :param job: Job from prepare
+        """
+        for parameter in job.parameters:
+            path = cal_path(job.this_set.set_id, parameter, self.incoming_dir)
+            tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            job.cals[parameter].to_csv(tmp, index=False)
+            tmp.replace(path)
+
+    def read_file(self, job, file):
+        """Read and clean a raw data file of a run, and the CTD file for pH.
+
+        :param job: Job
+        :param file: name of the raw file, like 'newport_pier/2021-01/data-20210110.dat'
+        :return: (DataFrame of raw data, DataFrame of raw CTD data or None), or None if there
+            are no data. With a coverage index, the raw data's attrs have the number of lines
+            in the file as 'raw_lines'.
+        """
+        this_set = job.this_set
+        path = self.incoming_dir.joinpath(file)
+        if not path.exists():
+            logger.debug(f"No {file}. Skipping...")
+            return None
+        logger.debug(f'Reading {path}')
+        data = self.read_raw_data(this_set, path)
+        if len(data) == 0:
+            logger.debug("no data")
+            return None
+        if self.coverage:
+            # counted here, while the file is being read, for write_file
+            data.attrs['raw_lines'] = count_lines(path)
+
+        ctd_data = None
+        if 'ph' in job.parameters:
+            # also read the accompanying CTD file for salinity
+            ctd_file = file.replace(this_set.raw_data_tag, job.salinity_set.raw_data_tag)
+            ctd_path = self.incoming_dir.joinpath(ctd_file)
+            if ctd_path.exists():
+                logger.debug(f'Reading {ctd_path}')
+                ctd_data = self.read_raw_data(job.salinity_set, ctd_path)
+            else:
+                logger.debug(f"No {ctd_file}. Cannot calibrate pH ...")
+        return data, ctd_data
+
+    def calibrate_file(self, job, file, data, ctd_data=None):
+        """Calibrate the data of a raw file (and write the station file, if asked for).
+
+        :param job: Job
+        :param file: name of the raw file
+        :param data: DataFrame of raw data from read_file (changed in place)
+        :param ctd_data: DataFrame of raw CTD data from read_file, for pH
+        :return: DataFrame of calibrated data with a time column
+        """
+        data = calibrate_data(data, job.calibrations, job.cals, ctd_data,
+                              ph_engine=self.ph_engine, workers=self.workers)
+
+        if self.merge_tolerance and ctd_data is not None and len(ctd_data) > 0 \
+                and 'corrected_ph' in data.columns:
+            self.write_station(job.salinity_set, ctd_data, job.salinity_cals, data, file)
+        return data
+
+    def write_file(self, job, file, data):
+        """Write the calibrated data of a raw file (and to the store and aggregates).
+
+        :param job: Job
+        :param file: name of the raw file
+        :param data: DataFrame of calibrated data with a time column (and the attrs of the raw
+            data from read_file)
+        :return: Posix path of the calibrated file
+        """
+        this_set = job.this_set
+        # write it out - whether successfully created calibrated values or not
+        outfile = file.replace(this_set.raw_data_tag, this_set.proc_data_tag)
+        # reset sio-scs-2022 weird filename to what all the others are
+        outfile = outfile.replace("data_", "data-")
+        path = self.outgoing_dir.joinpath(outfile)
+        logger.debug(f'Writing to {str(path)}')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.store:
+            self.store.write_day(this_set, file_day(file), data)
+        if self.aggregates:
+            self.aggregates.update_day(this_set, file_day(file), data)
+        if self.coverage:
+            columns = [column for calibration in job.calibrations
+                       for column in calibration.outputs]
+            self.coverage.record(this_set.set_id, file_day(file), data, columns,
+                                 raw_lines=data.attrs.get('raw_lines'))
+        data = data.drop(columns=['time'])  # don't need this
+        return output.write_calibrated(data, path, compression=self.compression,
+                                       level=self.compression_level)
+
+    def run(self, start=None, end=None, set_id=None, days=None, cals=None):
+        """Run the processing.
+
+        :param start: datetime for first data to be processed
+        :param end: Datetime for last data to be processed
+        :param set_id: unique identifier for set of instruments to be processed
+        :param days: optional list of datetimes. If given, only these days between start and
+            end are processed
+        :param cals: optional dictionary of calibration coefficients by parameter that were
+            already retrieved. They are not changed, so they can be used for other runs.
+        :return:
+        """
+        job = self.prepare(start=start, end=end, set_id=set_id, days=days, cals=cals)
+        if job is None:
+            return 1
+        result = self.process(job)
+        if result is None:
+            self.stash_cals(job)
+        return result
 
-            for parameter in this_set.parameters:
-                df_cal = cals[parameter]
-                if parameter == 'chlor':
-                    data['chlor'] = get_chlor(data, df_cal)
-                if parameter == 'o2':
-                    if len(df_cal) == 0:  # SCS/Aanderaa
-                        data['O2_uM'] = get_scs_o2(data)
-                    else:
-                        data['o2'] = get_o2(data, df_cal)
-                if parameter == 'ph':
-                    # also read the accompanying CTD file for salinity
-                    ctd_file = file.replace(this_set.raw_data_tag, salinity_set.raw_data_tag)
-                    ctd_path = here.joinpath(incoming + ctd_file)
-                    if not ctd_path.exists():
-                        logger.debug(f"No {ctd_file}. Cannot calibrate pH ...")
-                        continue
-                    logger.debug(f'Reading {ctd_path}')
-                    ctd_data = salinity_set.retrieve_and_parse_raw_data(ctd_path)
-                    if len(ctd_data) == 0:
-                        continue
-
-                    data.dropna(subset=['v_ext'], inplace=True)
-                    data['corrected_ph'] = get_ph(data, df_cal, ctd_data)
-
-            # write it out - whether successfully created calibrated values or not
-            outfile = file.replace(this_set.raw_data_tag, this_set.proc_data_tag)
-            # reset sio-scs-2022 weird filename to what all the others are
-            outfile = outfile.replace("data_", "data-")
-            path = here.joinpath(outgoing + outfile)
-            logger.debug(f'Writing to {str(path)}')
-            if not path.parents[0].exists():
-                path.parents[0].mkdir(parents=True)
-            data.drop(columns=['time'], inplace=True)  # don't need this
-            data.to_csv(path, index=False, na_rep='NaN')
+    def process(self, job):
+        """Read, calibrate and write the files of a run, one after another.
+
+        :param job: Job from prepare
+        :return: None
+        """
+        for file in job.files:
+            raw = self.read_file(job, file)
+            if raw is None:
+                continue
+            data = self.calibrate_file(job, file, *raw)
+            self.write_file(job, file, data)
 
         logger.info("All done!")
         return None
+
+
+class Job:
+    """What a run needs: the set, its files and the calibration coefficients."""
+
+    def __init__(self, this_set, files, parameters, cals, salinity_set, salinity_cals):
+        """Collect the pieces of a run.
+
+        :param this_set: InstrumentSet
+        :param files: list of raw files, like 'newport_pier/2021-01/data-20210110.dat'
+        :param parameters: parameters of the set that are calibrated in this run
+        :param cals: dictionary of calibration coefficients by parameter
+        :param salinity_set: InstrumentSet with salinity for pH
+        :param salinity_cals: dictionary of calibration coefficients of the salinity set, to
+            merge pH with the CTD
+        """
+        self.this_set = this_set
+        self.files = files
+        self.parameters = parameters
+        self.cals = cals
+        self.salinity_set = salinity_set
+        self.salinity_cals = salinity_cals
+
+    @property
+    def calibrations(self):
+        """How each parameter of the run is calibrated.
+
+        :return: list of Calibrations
+        """
+        return [calibration for calibration in self.this_set.calibrations
+                if calibration.parameter in self.parameters]
@@ -173,19 +173,31 @@ def calibrate_ph(voltage, temperature, salinity=0, external=False, k0=None, k2=N
 
     ph = (voltage - k0 - k2 * temperature) / s_nernst
     if external:
-        # define the corrections
-        Cl_total = total_chloride_in_seawater(salinity)
-        ionic_strength = sample_ionic_strength(salinity)
-        A_DH = dubye_huckel_hci(temperature)
-        S_total = total_sulfate_in_seawater(salinity)
-        Ks = acid_dissociation_HSO4(salinity, temperature, ionic_strength)
-        log_chi_HCl = log_of_HCl_activity_coefficient(A_DH, ionic_strength, temperature)
-
-        # add the corrections
-        ph = ph \
-            + math.log10(Cl_total) \
-            + 2 * log_chi_HCl \
-            - math.log10(1 + S_total / Ks) \
-            - math.log10((1000 - 1.005 * salinity) / 1000)
+        ph = ph + external_correction(salinity, temperature)
 
     return ph
+
+
+def external_correction(salinity, temperature):
+    """Sum of the corrections to external pH for chloride activity.
+
+    These only depend on salinity and temperature, so they can be calculated ahead of time
+    (see ph_lookup.py).
+
+    :param salinity: salinity is in psu
+    :param temperature: temperature is in degrees Celsius
+    :return: what to add to the Nernstian pH
+    """
+    # define the corrections
+    Cl_total = total_chloride_in_seawater(salinity)
+    ionic_strength = sample_ionic_strength(salinity)
+    A_DH = dubye_huckel_hci(temperature)
+    S_total = total_sulfate_in_seawater(salinity)
+    Ks = acid_dissociation_HSO4(salinity, temperature, ionic_strength)
+    log_chi_HCl = log_of_HCl_activity_coefficient(A_DH, ionic_strength, temperature)
+
+    # add the corrections
+    return math.log10(Cl_total) \
+        + 2 * log_chi_HCl \
+        - math.log10(1 + S_total / Ks) \
+        - math.log10((1000 - 1.005 * salinity) / 1000)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A small HTTP service that calibrates batches of raw lines.
+
+The instrument sets and calibration coefficients are loaded once and kept (see api.py), so
+each request only pays for cleaning and calibrating its own rows. Start it with:
+sass-serve --port 8080
+
+and send raw data of a set to /calibrate/<set_id>:
+* as CSV: the raw lines, exactly as they are in the raw files
+* as JSON: {"lines": [...]} of raw lines, or {"rows": [...]} of lists (in the order of the
+  set's columns) or of objects (keyed by column name). pH sets also need the lines or rows of
+  the set with salinity as "ctd".
+
+The calibrated columns come back as JSON {"columns": [...], "data": [[...], ...]}, or as CSV if
+the request asks for it with "Accept: text/csv". How long the request took is in the
+Server-Timing header, and GET /metrics has the count, rows and latency (mean, median, 95th
+percentile and maximum) of recent requests for each set.
+
+Each request is calibrated in its own thread. Calibrating doesn't change the instrument sets or
+the kept coefficients, so requests that arrive together don't wait for each other.
+"""
+
+import json
+import time
+import argparse
+import threading
+import collections
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from sass import logger
+
+from .api import Calibrator
+
+
+class Metrics:
+    """Count and time requests for each set."""
+
+    def __init__(self, keep=1000):
+        """Start counting.
+
+        :param keep: number of recent latencies to keep for each set
+        """
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.rows = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=self.keep))
+
+    def record(self, set_id, seconds, rows=0, error=False):
+        """Add a request.
+
+        :param set_id: unique identifier for set of instruments
+        :param seconds: how long the request took
+        :param rows: number of calibrated rows returned
+        :param error: True if the request failed
+        """
+        with self.lock:
+            self.requests[set_id] += 1
+            self.errors[set_id] += error
+            self.rows[set_id] += rows
+            self.latencies[set_id].append(seconds * 1000)
+
+    def summary(self):
+        """Counts and latencies in milliseconds.
+
+        :return: dictionary by set_id
+        """
+        with self.lock:
+            summary = {}
+            for set_id, latencies in self.latencies.items():
+                latencies = np.array(latencies)
+                summary[set_id] = {
+                    'requests': self.requests[set_id],
+                    'errors': self.errors[set_id],
+                    'rows': self.rows[set_id],
+                    'mean_ms': round(float(latencies.mean()), 3),
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                    'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                    'max_ms': round(float(latencies.max()), 3),
+                }
+            return summary
+
+
+def read_rows(this_set, body):
+    """Raw data from the JSON of a request.
+
+    :param this_set: InstrumentSet
+    :param body: dictionary with a list of lines, or a list of lists or objects as rows
+    :return: something api.Calibrator.parse can clean
+    """
+    if not isinstance(body, dict):
+        raise ValueError('Send an object with "lines" or "rows"')
+    if 'lines' in body:
+        return body['lines']
+    rows = body.get('rows', [])
+    if rows and isinstance(rows[0], dict):
+        return pd.DataFrame(rows)
+    return pd.DataFrame(rows, columns=this_set.data_columns[:len(rows[0]) if rows else 0])
+
+
+class CalibrationHandler(BaseHTTPRequestHandler):
+    """Answers requests to a CalibrationServer."""
+
+    def log_message(self, format, *args):
+        """Log requests with the rest of the messages, instead of to stderr."""
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def send(self, status, body, content_type='application/json', seconds=None):
+        """Send a response.
+
+        :param status: HTTP status code
+        :param body: dictionary (sent as JSON) or string
+        :param content_type: of the body
+        :param seconds: how long the request took, for the Server-Timing header
+        """
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if seconds is not None:
+            self.send_header('Server-Timing', f'calibrate;dur={seconds * 1000:.3f}')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """Health and metrics."""
+        path = urlparse(self.path).path
+        if path == '/health':
+            self.send(200, {'status': 'ok', 'sets': sorted(self.server.calibrator.sets)})
+        elif path == '/metrics':
+            self.send(200, self.server.metrics.summary())
+        else:
+            self.send(404, {'error': f'No {path}'})
+
+    def do_POST(self):
+        """Calibrate raw data of a set."""
+        started = time.perf_counter()
+        path = urlparse(self.path).path.strip('/').split('/')
+        if len(path) != 2 or path[0] != 'calibrate':
+            self.send(404, {'error': 'POST raw data to /calibrate/<set_id>'})
+            return
+        set_id = path[1]
+        calibrator = self.server.calibrator
+        length = int(self.headers.get('Content-Length', 0))
+        text = self.rfile.read(length).decode('ISO-8859-1')
+
+        try:
+            this_set = calibrator.instrument_set(set_id)
+        except ValueError as e:
+            self.send(404, {'error': str(e)})
+            return
+
+        try:
+            ctd = None
+            if self.headers.get_content_type() == 'application/json':
+                body = json.loads(text)
+                raw = read_rows(this_set, body)
+                if 'ctd' in body and this_set.ph_salinity_set:
+                    salinity_set = calibrator.instrument_set(this_set.ph_salinity_set)
+                    ctd = read_rows(salinity_set, body['ctd'])
+            else:
+                raw = text
+        except (ValueError, TypeError, KeyError) as e:
+            self.server.metrics.record(set_id, time.perf_counter() - started, error=True)
+            self.send(400, {'error': f'Could not read the request: {e}'})
+            return
+
+        try:
+            data = calibrator.calibrate(set_id, raw, ctd=ctd)
+        except Exception as e:
+            logger.exception(f'Calibrating {set_id} failed')
+            self.server.metrics.record(set_id, time.perf_counter() - started, error=True)
+            self.send(500, {'error': str(e)})
+            return
+
+        if 'time' in data.columns:
+            data = data.drop(columns=['time'])
+        if 'text/csv' in self.headers.get('Accept', ''):
+            body = data.to_csv(index=False, na_rep='NaN')
+            content_type = 'text/csv'
+        else:
+            body = data.to_json(orient='split', index=False)
+            content_type = 'application/json'
+        seconds = time.perf_counter() - started
+        self.server.metrics.record(set_id, seconds, rows=len(data))
+        self.send(200, body, content_type=content_type, seconds=seconds)
+
+
+class CalibrationServer(ThreadingHTTPServer):
+    """HTTP server that keeps a Calibrator and Metrics."""
+
+    daemon_threads = True
+
+    def __init__(self, address, calibrator=None):
+        """Load the instrument sets and start listening.
+
+        :param address: (host, port). Port 0 picks any free port.
+        :param calibrator: api.Calibrator. If omitted, one with the usual instrument sets.
+        """
+        super().__init__(address, CalibrationHandler)
+        self.calibrator = calibrator or Calibrator()
+        self.metrics = Metrics()
+
+
+def main():
+    """Organizes the input arguments and runs the service."""
+    parser = argparse.ArgumentParser(description='Run an HTTP service that calibrates raw SASS '
+                                                 'data.')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', type=str,
+                        help='Address to listen on. Only this computer by default.')
+    parser.add_argument('--port', dest='port', default=8080, type=int,
+                        help='Port to listen on.')
+    parser.add_argument('--max-age', dest='max_age', type=float,
+                        help='Seconds before coefficients are downloaded again. If omitted, '
+                             'they are downloaded only once.')
+    parser.add_argument('--cals', dest='cals', action='append', default=[],
+                        metavar='SET_ID:PARAMETER=PATH',
+                        help='Read coefficients from a CSV file (like '
+                             'sio-ctd-2016:chlor=data/incoming/cals/sio-ctd-2016_chlor.csv) '
+                             'instead of the Google Sheet. Can be repeated.')
+    parser.add_argument('--ph-engine', dest='ph_engine', default='exact',
+                        choices=['exact', 'table'],
+                        help='How to calculate external pH (see call_sass.py).')
+    args = parser.parse_args()
+
+    cal_paths = {}
+    for cal in args.cals:
+        key, _, path = cal.partition('=')
+        set_id, _, parameter = key.partition(':')
+        cal_paths[(set_id, parameter)] = path
+    calibrator = Calibrator(ph_engine=args.ph_engine, max_age=args.max_age, cal_paths=cal_paths)
+    server = CalibrationServer((args.host, args.port), calibrator)
+    logger.info(f'Listening on http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
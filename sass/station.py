@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Put the calibrated data of the sets at a station on one time axis.
+
+At Newport the CTD (with chlorophyll and O2) and the SeaFET (pH) are separate sets with their
+own files, but the pH run already reads the CTD file for salinity. With a merge tolerance, the
+runner also calibrates that CTD data and adds the pH of the nearest time (within the tolerance)
+to each CTD row, then writes the result to data/calibrated/stations/<CTD tag>/, like
+stations/newport_pier/2021-01/data-20210110.dat.
+
+Columns of the pH set that have the same name as a CTD column (like temperature, sensor_time)
+get a suffix, like temperature_ph. CTD rows with no pH close enough have NaN pH.
+"""
+
+import pandas as pd
+
+
+def merge_nearest(base, other, suffix, tolerance='2min'):
+    """Add the nearest row of another set to each row of a set.
+
+    :param base: DataFrame of calibrated data with a time column, sorted by time
+    :param other: DataFrame of calibrated data of the other set, sorted by time
+    :param suffix: added to the names of columns of other that are also in base, like 'ph'
+    :param tolerance: largest time difference (pandas Timedelta or string like '2min')
+    :return: DataFrame with a row for each row of base
+    """
+    other = other.drop(columns=['ip'], errors='ignore')
+    other = other.rename(columns={c: f'{c}_{suffix}' for c in other.columns
+                                  if c in base.columns and c != 'time'})
+    return pd.merge_asof(base.reset_index(drop=True), other.reset_index(drop=True), on='time',
+                         direction='nearest', tolerance=pd.Timedelta(tolerance))
+
+
+def station_file(file, station_set):
+    """Name of the merged file for a raw data file of a set at the station.
+
+    :param file: raw data file, like 'newport_pier_ph/2021-01/data-20210110.dat'
+    :param station_set: InstrumentSet whose times are used, like the CTD
+    :return: string like 'stations/newport_pier/2021-01/data-20210110.dat'
+    """
+    name = file.split('/', 1)[1].replace('data_', 'data-')
+    return f'stations/{station_set.proc_data_tag}/{name}'
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Calibrate raw lines as they arrive on stdin and write calibrated CSV to stdout.
+
+For example:
+tail -F raw.dat | sass-calibrate --set sio-ctd-2016 > calibrated.csv
+
+Lines are collected into small batches, of up to --lines lines or whatever arrived within
+--ms milliseconds of the first one, whichever comes first. Each batch is cleaned and calibrated
+like a file (see api.py) and written out right away. Only one batch (plus a bounded queue of
+lines waiting to be read) is in memory at a time, so memory stays the same however long the
+stream runs. Calibration coefficients are downloaded once at the start (or read from local CSV
+files with --cals).
+
+The header is written with the first batch that has good lines. Log messages go to stderr.
+
+pH needs salinity from another set, which isn't in the stream, so pH is not calibrated here.
+"""
+
+import io
+import sys
+import time
+import queue
+import argparse
+import threading
+
+from sass import logger, utilities
+
+from .api import Calibrator
+
+
+def read_lines(infile, lines):
+    """Put lines from a file onto a queue, then None at the end.
+
+    :param infile: file object (like stdin)
+    :param lines: queue.Queue
+    """
+    for line in infile:
+        lines.put(line)
+    lines.put(None)
+
+
+def batches(lines, size=1000, wait=1.0):
+    """Group lines from a queue.
+
+    :param lines: queue.Queue of lines, ending with None
+    :param size: most lines in a batch
+    :param wait: most seconds to wait after the first line of a batch
+    :return: generator of lists of lines
+    """
+    while True:
+        line = lines.get()
+        if line is None:
+            return
+        batch = [line]
+        deadline = time.monotonic() + wait
+        while len(batch) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = lines.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if line is None:
+                yield batch
+                return
+            batch.append(line)
+        yield batch
+
+
+def stream(calibrator, set_id, infile, outfile, size=1000, wait=1.0):
+    """Calibrate lines from one file object and write them to another, a batch at a time.
+
+    :param calibrator: api.Calibrator
+    :param set_id: unique identifier for set of instruments
+    :param infile: file object of raw lines
+    :param outfile: file object for calibrated CSV
+    :param size: most lines in a batch
+    :param wait: most seconds to wait for a batch to fill
+    :return: number of calibrated rows written
+    """
+    this_set = calibrator.instrument_set(set_id)
+    if 'ph' in this_set.parameters:
+        logger.warning(f'pH needs salinity from {this_set.ph_salinity_set}, so it is not '
+                       'calibrated when streaming')
+    # get them now, not while lines are waiting
+    coefficients = {p: calibrator.coefficients(set_id, p) for p in this_set.parameters}
+
+    lines = queue.Queue(maxsize=10 * size)
+    reader = threading.Thread(target=read_lines, args=(infile, lines), daemon=True)
+    reader.start()
+
+    columns = None
+    rows = 0
+    for batch in batches(lines, size, wait):
+        try:
+            data = calibrator.calibrate(set_id, batch, coefficients=coefficients)
+        except Exception as e:  # one bad batch shouldn't stop the stream
+            logger.error(f'Could not calibrate {len(batch)} lines: {e}')
+            continue
+        if len(data) == 0:
+            continue
+        data = data.drop(columns=['time'])
+        if columns is None:
+            columns = list(data.columns)
+        data.reindex(columns=columns).to_csv(outfile, header=rows == 0, index=False,
+                                             na_rep='NaN')
+        outfile.flush()
+        rows += len(data)
+
+    return rows
+
+
+def main():
+    """Organizes the input arguments and calibrates stdin to stdout."""
+    parser = argparse.ArgumentParser(description='Calibrate raw SASS lines from stdin and write '
+                                                 'calibrated CSV to stdout.')
+    parser.add_argument('-s', '--set', dest='set_id', required=True, type=str,
+                        help='Id of the set of instruments the lines are from. '
+                             'Must be defined in instrument_sets.json.')
+    parser.add_argument('--lines', dest='size', default=1000, type=int,
+                        help='Most lines to calibrate at once.')
+    parser.add_argument('--ms', dest='ms', default=1000, type=int,
+                        help='Most milliseconds to wait for more lines before calibrating.')
+    parser.add_argument('--cals', dest='cals', action='append', default=[],
+                        metavar='PARAMETER=PATH',
+                        help='Read coefficients for a parameter from a CSV file (like '
+                             'chlor=data/incoming/cals/sio-ctd-2016_chlor.csv) instead of the '
+                             'Google Sheet. Can be repeated.')
+    args = parser.parse_args()
+
+    utilities.log_to_stderr(logger)  # stdout is for the data
+
+    cal_paths = {}
+    for cal in args.cals:
+        parameter, _, path = cal.partition('=')
+        cal_paths[(args.set_id, parameter)] = path
+    try:
+        calibrator = Calibrator(cal_paths=cal_paths)
+        infile = io.TextIOWrapper(sys.stdin.buffer, encoding='ISO-8859-1')
+        stream(calibrator, args.set_id, infile, sys.stdout, size=args.size,
+               wait=args.ms / 1000)
+    except ValueError as e:
+        logger.error(e)
+        exit(1)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Fixtures shared by the tests of the package."""
+
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+here = Path(__file__).parent
+
+
+@pytest.fixture
+def chlor_sheet():
+    """Chlorophyll coefficients that apply to all the example files, like the Google Sheet."""
+    return pd.DataFrame({'START TIME UTC': ['2016-03-03T00:00:00Z'], 'Scale Factor': [10.0],
+                         'Clean Water Offset (CWO)': [0.08]})
+
+
+@pytest.fixture
+def chlor_cals(chlor_sheet):
+    """The same coefficients with their times parsed, like InstrumentSet.get_cals gives them."""
+    cals = chlor_sheet.drop(columns=['START TIME UTC'])
+    cals.insert(0, 'time', pd.to_datetime(chlor_sheet['START TIME UTC'], utc=True))
+    return cals
+
+
+@pytest.fixture
+def np_cals(chlor_cals):
+    """Chlorophyll and O2 coefficients for np-ctd-2016b."""
+    o2 = pd.read_csv(here.joinpath('resources/oxygen/calibration_coefficients_20210826.csv'))
+    o2['time'] = pd.Timestamp('2020-01-01T00:00:00Z')
+    return {'chlor': chlor_cals, 'o2': o2.iloc[:1].copy()}
+
+
+@pytest.fixture
+def ph_cals():
+    """The coefficients of the SeaFET (serial number 2145) in the example pH files."""
+    return pd.DataFrame({'SERIAL NUMBER': [2145], 'Kext0': [-1.429278], 'Kext2': [-1.142026e-3]})
+
+
+@pytest.fixture
+def np_incoming(tmp_path):
+    """Copies an example file of np-ctd-2016b to days of February 2021.
+
+    The fixture is a function of the list of days of the month, which returns the incoming
+    directory (with an empty cals/ for the stash).
+    """
+    incoming = tmp_path.joinpath('incoming')
+    raw = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+
+    def copy_days(days):
+        for day in days:
+            path = incoming.joinpath(f'newport_pier/2021-02/data-202102{day:02d}.dat')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(raw, path)
+        incoming.joinpath('cals').mkdir(exist_ok=True)
+        return incoming
+
+    return copy_days
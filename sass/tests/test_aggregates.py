@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the hourly and daily statistics of calibrated data."""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..aggregates import Aggregates, STATISTICS
+from ..instrument_set import InstrumentSet
+
+
+def calibrated_day(day, seed, start='00:00', periods=360):
+    """Made up calibrated data every 4 minutes."""
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(f'{day}T{start}Z', periods=periods, freq='4min')
+    data = pd.DataFrame({'time': time, 'temperature': rng.normal(20, 1, periods),
+                         'salinity': rng.normal(33, 0.1, periods),
+                         'chlor': rng.normal(2, 0.5, periods), 'sensor_time': 'x'})
+    data.loc[data.sample(frac=0.1, random_state=seed).index, 'chlor'] = np.nan
+    return data
+
+
+def expected(data, freq):
+    """Statistics of all the rows at once."""
+    summary = data.groupby(data['time'].dt.floor(freq))[['temperature', 'salinity', 'chlor']]
+    summary = summary.agg(STATISTICS)
+    summary.columns = [f'{c}_{s}' for c, s in summary.columns]
+    return summary.reset_index()
+
+
+@pytest.mark.parametrize('suffix', ['.parquet', '.csv'])
+def test_update_and_read(tmp_path, suffix):
+    """Days combine into the same statistics as all the data, and a day can be replaced."""
+    if suffix == '.parquet':
+        pytest.importorskip('pyarrow')
+    this_set = InstrumentSet(set_id='sio-ctd-2016')
+    aggregates = Aggregates(tmp_path)
+    aggregates.suffix = suffix
+    first = calibrated_day('2021-08-31', 1)
+    # the next file starts an hour before midnight
+    second = calibrated_day('2021-08-31', 2, start='23:00')
+    aggregates.update_day(this_set, pd.Timestamp('2021-08-31'), first)
+    aggregates.update_day(this_set, pd.Timestamp('2021-09-01'), calibrated_day('2021-09-01', 3))
+    aggregates.update_day(this_set, pd.Timestamp('2021-09-01'), second)  # recalibrated
+
+    both = pd.concat([first, second])
+    for level, freq in (('hourly', 'H'), ('daily', 'D')):
+        result = aggregates.read('sio-ctd-2016', level)
+        pd.testing.assert_frame_equal(result[expected(both, freq).columns], expected(both, freq),
+                                      check_dtype=False)
+
+    names = sorted(p.name for p in tmp_path.joinpath('sio-ctd-2016/hourly').iterdir())
+    assert [n.split('.')[0] for n in names] == ['2021-08', '2021-09']
+
+    some = aggregates.read('sio-ctd-2016', 'hourly', start=pd.Timestamp('2021-09-01T00:00Z'),
+                           end=pd.Timestamp('2021-09-01T05:00Z'))
+    assert list(some['time'].dt.hour) == [0, 1, 2, 3, 4, 5]
+    naive = aggregates.read('sio-ctd-2016', 'hourly', start=datetime(2021, 9, 1),
+                            end=datetime(2021, 9, 1, 5))
+    pd.testing.assert_frame_equal(naive, some)
+    assert len(aggregates.read('sio-ctd-2016', 'daily', start=pd.Timestamp('2022-01-01'))) == 0
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test calibrating raw data in memory."""
+
+from pathlib import Path
+
+import pandas as pd
+
+from ..api import Calibrator
+from ..instrument_set import InstrumentSet
+from ..calibrations import calibrate_data
+
+here = Path(__file__).parent
+
+
+def test_same_as_file(monkeypatch, chlor_cals):
+    """Lines, text and a DataFrame of a raw file calibrate the same as the file itself."""
+    calls = []
+
+    def get_cals(self, parameter, path=None):
+        calls.append(parameter)
+        return chlor_cals
+
+    monkeypatch.setattr(InstrumentSet, 'get_cals', get_cals)
+    calibrator = Calibrator()
+    this_set = calibrator.instrument_set('sio-ctd-2016')
+    path = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+    expected = calibrate_data(this_set.retrieve_and_parse_raw_data(path), this_set.calibrations,
+                              {'chlor': chlor_cals})
+
+    text = path.read_text(encoding='ISO-8859-1')
+    raw = pd.read_csv(path, names=this_set.data_columns, dtype=str, keep_default_na=False)
+    for data in (text, text.splitlines(), raw):
+        pd.testing.assert_frame_equal(calibrator.calibrate('sio-ctd-2016', data), expected)
+
+    # coefficients only downloaded once
+    assert calls == ['chlor']
+
+
+def test_given_coefficients(monkeypatch, chlor_cals):
+    """Coefficients that are passed in are used instead of the Sheet."""
+    def get_cals(self, parameter, path=None):
+        raise AssertionError('should not download')
+
+    monkeypatch.setattr(InstrumentSet, 'get_cals', get_cals)
+    calibrator = Calibrator()
+    path = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+    data = calibrator.calibrate('sio-ctd-2016', path.read_bytes(),
+                                coefficients={'chlor': chlor_cals})
+    assert data['chlor'].notna().all()
+
+    assert len(calibrator.calibrate('sio-ctd-2016', [], coefficients={'chlor': chlor_cals})) == 0
+
+
+def test_ph(ph_cals):
+    """The pH is calibrated with salinity from the CTD lines."""
+    calibrator = Calibrator()
+    ph = here.joinpath('resources/raw_data/newport_ph_data-20210110_corrupt.dat').read_bytes()
+    ctd = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat').read_bytes()
+
+    data = calibrator.calibrate('np-ph-2020', ph, coefficients={'ph': ph_cals})
+    assert 'corrected_ph' not in data.columns
+    data = calibrator.calibrate('np-ph-2020', ph, coefficients={'ph': ph_cals}, ctd=ctd)
+    assert data['corrected_ph'].notna().all()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test calibrating a set's archive with dask."""
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..utilities import parse_datetime
+from ..sass_runner import SassCalibrationRunner
+from ..archive import calibrate_archive
+from ..aggregates import Aggregates
+
+here = Path(__file__).parent
+config_path = here.parent.joinpath('config/instrument_sets.json')
+days = [26, 27, 28]
+
+
+@pytest.fixture
+def incoming(np_incoming):
+    """Three days of np-ctd-2016b, and one missing."""
+    return np_incoming(days)
+
+
+def read_days(outgoing):
+    """The calibrated files that were written."""
+    return [pd.read_csv(outgoing.joinpath(f'newport_pier/2021-02/data-202102{day}.dat'))
+            for day in days]
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes'])
+def test_calibrate_archive(tmp_path, incoming, np_cals, scheduler):
+    """Tasks give the same files as the day by day loop."""
+    pytest.importorskip('dask')
+    start = parse_datetime('2021-02-25T00:00:00Z')
+    end = parse_datetime('2021-02-28T00:00:00Z')
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('loop'))
+    assert runner.run(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals) is None
+
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('archive'))
+    assert calibrate_archive(runner, 'np-ctd-2016b', start, end, cals=np_cals,
+                             scheduler=scheduler, workers=2) is None
+    for loop, archive in zip(read_days(tmp_path.joinpath('loop')),
+                             read_days(tmp_path.joinpath('archive'))):
+        pd.testing.assert_frame_equal(loop, archive)
+
+
+def test_archive_options(tmp_path, incoming, np_cals):
+    """Aggregates are shared by threads, but not processes."""
+    pytest.importorskip('dask')
+    start = parse_datetime('2021-02-26T00:00:00Z')
+    end = parse_datetime('2021-02-28T00:00:00Z')
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('calibrated'),
+                                   aggregates_dir=tmp_path.joinpath('aggregates'))
+    with pytest.raises(ValueError):
+        calibrate_archive(runner, 'np-ctd-2016b', start, end, scheduler='processes')
+    assert calibrate_archive(runner, 'np-ctd-2016b', start, end, cals=np_cals,
+                             workers=3) is None
+    daily = Aggregates(tmp_path.joinpath('aggregates')).read('np-ctd-2016b', 'daily')
+    assert daily['chlor_count'].sum() == sum(len(d) for d in read_days(
+        tmp_path.joinpath('calibrated')))
+    assert calibrate_archive(runner, 'foo', start, end) == 1
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the monthly array store of calibrated data."""
+
+import pickle
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..api import Calibrator
+from ..array_store import ArrayStore, file_day, xr
+
+here = Path(__file__).parent
+backends = {'zarr': 'zarr', 'netcdf': 'netCDF4'}
+
+
+class PickleStore(ArrayStore):
+    """Months kept as pickled Datasets, so writing is tested without zarr or netCDF4."""
+
+    def __init__(self, root):
+        """Same as a store's, and remembers how each month was written."""
+        super().__init__(root)
+        self.writes = []
+
+    def open(self, path):
+        """Same as a store's."""
+        return pickle.loads(path.read_bytes())
+
+    def create(self, path, ds):
+        """Same as a store's."""
+        self.writes.append('create')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(pickle.dumps(ds))
+
+    def append(self, path, ds):
+        """Same as a store's."""
+        self.writes.append('append')
+        with self.open(path) as old:
+            path.write_bytes(pickle.dumps(xr.concat([old, ds], dim='time')))
+
+
+def test_file_day():
+    """Day from a raw data file name."""
+    assert file_day('sio-ctd/2021-08/data-20210826.dat') == pd.Timestamp('2021-08-26')
+    assert file_day('sio-scs/2022-04/data_20220430.dat') == pd.Timestamp('2022-04-30')
+    with pytest.raises(ValueError):
+        file_day('sio-ctd/2021-08/')
+
+
+def test_append_days(tmp_path):
+    """New days are appended, and only a day written again rewrites the month."""
+    pytest.importorskip('xarray')
+    this_set = Calibrator().instrument_set('sio-ctd-2016')
+
+    def day(date, temperature):
+        time = pd.date_range(f'{date}T00:00:00Z', periods=4, freq='6H')
+        return pd.DataFrame({'time': time, 'temperature': temperature,
+                             'sensor_time': time.strftime('%d %b %Y %H:%M:%S')})
+
+    store = PickleStore(tmp_path)
+    for date in ['2021-08-27', '2021-08-26', '2021-08-28']:
+        month = store.write_day(this_set, pd.Timestamp(date), day(date, 10.0))
+    assert store.writes == ['create', 'append', 'append']
+    with store.open(month) as ds:  # in the order they were written
+        assert list(pd.unique(ds['file_date'].values)) == [20210827, 20210826, 20210828]
+
+    store.write_day(this_set, pd.Timestamp('2021-08-26'), day('2021-08-26', 12.0))
+    assert store.writes[-1] == 'create'
+    stored = store.load(month)
+    assert stored['time'].is_monotonic_increasing
+    assert len(stored) == 12
+    by_day = stored.groupby('file_date')['temperature'].mean()
+    assert list(by_day) == [12.0, 10.0, 10.0]
+    assert list(stored['sensor_time'][:4]) == list(day('2021-08-26', 12.0)['sensor_time'])
+
+
+@pytest.mark.parametrize('format', ['zarr', 'netcdf'])
+def test_write_day(tmp_path, chlor_cals, format):
+    """Days are added, rewriting a day replaces it, and ranges are read back."""
+    pytest.importorskip('xarray')
+    pytest.importorskip(backends[format], exc_type=ImportError)  # also if it's broken
+    calibrator = Calibrator()
+    this_set = calibrator.instrument_set('sio-ctd-2016')
+    path = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+    data = calibrator.calibrate('sio-ctd-2016', path.read_bytes(),
+                                coefficients={'chlor': chlor_cals})
+    next_day = data.assign(time=data['time'] + pd.Timedelta(days=1))
+
+    store = ArrayStore(tmp_path, format)
+    store.write_day(this_set, file_day(path), data)
+    month = store.write_day(this_set, file_day('data-20210827.dat'), next_day)
+    appended = store.load(month)
+    appended = appended.loc[appended['file_date'] == 20210827].reset_index(drop=True)
+    pd.testing.assert_series_equal(appended['time'], next_day['time'])
+    assert list(appended['sensor_time']) == list(next_day['sensor_time'])
+
+    month = store.write_day(this_set, file_day(path), data)  # again
+    assert month.name == '2021-08' + ('.zarr' if format == 'zarr' else '.nc')
+    assert [p.name for p in month.parent.iterdir()] == [month.name]
+
+    stored = store.load(month)
+    assert len(stored) == 2 * len(data)
+    first = stored.loc[stored['file_date'] == 20210826].reset_index(drop=True)
+    pd.testing.assert_series_equal(first['time'], data['time'])
+    pd.testing.assert_series_equal(first['chlor'], data['chlor'])
+    assert list(first['sensor_time']) == list(data['sensor_time'])
+
+    with store.open(month) as ds:
+        assert ds.attrs['Conventions'] == 'CF-1.8'
+        assert ds['salinity'].attrs['standard_name'] == 'sea_water_practical_salinity'
+
+    start = pd.Timestamp('2021-08-26T12:00:00Z')
+    end = pd.Timestamp('2021-08-27T06:00:00Z')
+    some = store.read('sio-ctd-2016', start, end, columns=['chlor'])
+    assert list(some.columns) == ['time', 'chlor']
+    assert some['time'].between(start, end).all()
+    both = pd.concat([data, next_day])
+    assert len(some) == both['time'].between(start, end).sum()
+    assert len(store.read('sio-ctd-2016', '2021-10-01', '2021-10-02')) == 0
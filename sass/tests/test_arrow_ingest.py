@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test reading raw data with pyarrow gives the same results as pandas.
+
+Also benchmarks the two against each other:
+pytest --benchmark-only sass/tests/test_arrow_ingest.py
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..sass_runner import load_configs
+
+pytest.importorskip('pyarrow')
+
+here = Path(__file__).parent
+instrument_set_filename = '../config/instrument_sets.json'
+
+raw_files = [
+    ('sio-ctd-2016', 'raw_data/sio_data-20210826.dat'),
+    ('np-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sw-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sio-ctd-2016', 'raw_data/data-20170117_no_hash.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20210720_corrupt.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211014_superbad.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211010_superbad.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210226_badwhash.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210227_worst.dat'),
+    ('np-ph-2020', 'raw_data/newport_ph_data-20210110_corrupt.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad1.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad2.dat'),
+    ('sio-scs-2022', 'raw_data/sio_scs_data_20220430.dat'),
+]
+
+
+def get_set(set_id):
+    """Create an InstrumentSet from JSON file defined above."""
+    return load_configs(here.joinpath(instrument_set_filename), set=set_id)[0]
+
+
+@pytest.mark.parametrize('set_id,filename', raw_files)
+def test_same_as_pandas(set_id, filename):
+    """Both engines clean the example files the same way."""
+    this_set = get_set(set_id)
+    path = here.joinpath('resources', filename)
+
+    expected = this_set.retrieve_and_parse_raw_data(path)
+    data = this_set.retrieve_and_parse_raw_data(path, engine='pyarrow')
+    pd.testing.assert_frame_equal(expected, data)
+
+
+@pytest.fixture(params=['sio_data-20210826.dat', 'stearns_data-20211014_superbad.dat'])
+def big_file(request, tmp_path):
+    """A day of data repeated to be a more realistic size."""
+    lines = here.joinpath('resources/raw_data', request.param).read_bytes()
+    lines = lines.rstrip(b'\n') + b'\n'
+    path = tmp_path.joinpath(request.param)
+    path.write_bytes(lines * 200)
+    return path
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_benchmark_engines(benchmark, big_file, engine):
+    """Time both engines on the same file: one typical, the other mostly garbage."""
+    set_id = 'sio-ctd-2016' if big_file.name.startswith('sio') else 'sw-ctd-2018'
+    this_set = get_set(set_id)
+    data = benchmark(this_set.retrieve_and_parse_raw_data, big_file, engine=engine)
+    assert len(data) == len(this_set.retrieve_and_parse_raw_data(big_file))
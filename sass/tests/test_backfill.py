@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test planning and executing a backfill."""
+
+from pathlib import Path
+
+import pandas as pd
+
+from ..utilities import parse_datetime
+from ..instrument_set import InstrumentSet
+from ..backfill import plan, execute, read_journal, fetch_cals, write_plan, read_plan
+
+here = Path(__file__).parent
+instrument_set_filename = '../config/instrument_sets.json'
+
+
+def fake_run(unit):
+    """Stand in for the runner. Fails for August so resuming can be tested."""
+    if unit.start.month == 8:
+        return 1
+    return None
+
+
+def pass_run(unit):
+    """Stand in for the runner that always works."""
+    return None
+
+
+def make_incoming(tmp_path):
+    """Put a few fake raw files where the planner will find them."""
+    incoming = tmp_path.joinpath('incoming')
+    for name, size in [('scripps_pier/2021-07/data-20210701.dat', 10),
+                       ('scripps_pier/2021-08/data-20210801.dat', 50),
+                       ('scripps_pier/2021-08/data-20210802.dat', 50),
+                       ('scripps_pier/2021-09/data-20210930.dat', 20)]:
+        path = incoming.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('x' * size)
+    return incoming
+
+
+def test_plan(tmp_path):
+    """Units are split by month, sized from the files, and ordered by cost."""
+    incoming = make_incoming(tmp_path)
+    start = parse_datetime("2021-07-15T00:00:00Z")
+    end = parse_datetime("2021-10-15T00:00:00Z")
+
+    units = plan(start, end, set_ids=['sio-ctd-2016'],
+                 config_path=here.joinpath(instrument_set_filename), incoming_dir=incoming)
+
+    # July file is before the start, and October has no files
+    assert [u.start.month for u in units] == [8, 9]
+    assert units[0].size == 100
+    assert units[0].files == 2
+    assert units[0].start.date() == parse_datetime("2021-08-01T00:00:00Z").date()
+    assert units[1].end.date() == parse_datetime("2021-09-30T00:00:00Z").date()
+
+
+def test_execute_resumes(tmp_path):
+    """Only the units that aren't in the journal are run again."""
+    incoming = make_incoming(tmp_path)
+    journal = tmp_path.joinpath('journal.jsonl')
+    start = parse_datetime("2021-07-01T00:00:00Z")
+    end = parse_datetime("2021-09-30T00:00:00Z")
+    units = plan(start, end, set_ids=['sio-ctd-2016'],
+                 config_path=here.joinpath(instrument_set_filename), incoming_dir=incoming)
+    assert len(units) == 3
+
+    assert 1 == execute(units, journal, workers=2, run=fake_run)
+    assert len(read_journal(journal)) == 2
+
+    # a crash might leave half a line
+    with open(journal, 'a') as f:
+        f.write('{"key": "sio-ctd')
+
+    assert 0 == execute(units, journal, workers=2, run=pass_run)
+    assert read_journal(journal) == {u.key for u in units}
+
+
+def test_execute_with_plan(tmp_path, monkeypatch, np_incoming, chlor_sheet):
+    """Units run against the plan's directories with the coefficients downloaded once."""
+    incoming = np_incoming([26, 27])
+    config_path = here.joinpath(instrument_set_filename)
+
+    # coefficients like they come from the Google Sheet
+    sheets = {
+        'chlor': chlor_sheet,
+        'o2': pd.read_csv(here.joinpath('resources/oxygen/calibration_coefficients_20210826.csv'))
+        .iloc[:1].assign(**{'START TIME UTC': '2020-01-01T00:00:00Z'}),
+    }
+    downloads = []
+
+    def get_cals(this_set, parameter, path=None):
+        if path:
+            return original(this_set, parameter, path=path)
+        downloads.append((this_set.set_id, parameter))
+        cals = sheets[parameter].copy()
+        cals['time'] = pd.to_datetime(cals['START TIME UTC'], utc=True)
+        return cals
+
+    original = InstrumentSet.get_cals
+    monkeypatch.setattr(InstrumentSet, 'get_cals', get_cals)
+
+    units = plan(parse_datetime('2021-02-01T00:00:00Z'), parse_datetime('2021-03-31T00:00:00Z'),
+                 set_ids=['np-ctd-2016b'], config_path=config_path, incoming_dir=incoming)
+    cals_dir = tmp_path.joinpath('backfill.cals')
+    fetch_cals(units, cals_dir, config_path=config_path)
+    assert sorted(downloads) == [('np-ctd-2016b', 'chlor'), ('np-ctd-2016b', 'o2')]
+
+    plan_path = tmp_path.joinpath('backfill.json')
+    outgoing = tmp_path.joinpath('calibrated')
+    write_plan(plan_path, units, config_path=config_path, incoming_dir=incoming,
+               outgoing_dir=outgoing, cals_dir=cals_dir)
+    units, paths = read_plan(plan_path)
+    assert paths['incoming_dir'] == str(incoming)
+
+    def no_download(this_set, parameter, path=None):
+        assert path, 'downloaded again'
+        return original(this_set, parameter, path=path)
+
+    monkeypatch.setattr(InstrumentSet, 'get_cals', no_download)
+    assert 0 == execute(units, tmp_path.joinpath('journal.jsonl'), workers=2, **paths)
+    calibrated = pd.read_csv(outgoing.joinpath('newport_pier/2021-02/data-20210226.dat'))
+    assert calibrated['chlor'].notna().any()
+    assert calibrated['o2'].notna().any()
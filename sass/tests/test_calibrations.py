@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the registry of calibrations."""
+
+import copy
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from .. import calibrations
+from ..calibrations import Calibration, calibrate_data, find_calibration, stages
+from ..sass_runner import load_configs
+
+here = Path(__file__).parent
+configs = {s.set_id: s for s in load_configs(here.parent.joinpath('config/instrument_sets.json'))}
+
+
+def test_find_calibration():
+    """Each set's parameters have a calibration, and the SCS uses the Aanderaa one."""
+    assert [c.name for c in configs['np-ctd-2016b'].calibrations] == ['chlorophyll', 'sbe63']
+    assert [c.name for c in configs['sio-scs-2022'].calibrations] == ['aanderaa']
+    assert [c.name for c in configs['np-ph-2020'].calibrations] == ['seafet']
+    assert find_calibration('o2', builtin=True).outputs == ['O2_uM']
+    with pytest.raises(ValueError):
+        find_calibration('chlor', builtin=True)
+
+
+def test_usecols():
+    """Sets that trim their columns only parse the inputs of their own calibrations."""
+    assert configs['np-ph-2020'].usecols == configs['np-ph-2020'].data_columns
+    np_set = copy.copy(configs['np-ph-2020'])
+    np_set.trim_columns = True
+    assert 'rh' not in np_set.usecols
+    assert {'ph_ext', 'ph_int', 'v_ext', 'v_int', 'temperature'} <= set(np_set.usecols)
+    scs_set = copy.copy(configs['sio-scs-2022'])
+    scs_set.trim_columns = True
+    assert 'Dphase' not in scs_set.usecols
+    assert {'O2con', 'O2temp', 'salinity', 'pressure'} <= set(scs_set.usecols)
+
+
+def test_stages():
+    """Calibrations that read another's output wait for it."""
+    first = Calibration('a', 'chlor', None, inputs=['fluorometer_v'], outputs=['chlor'],
+                        coefficients='time')
+    second = Calibration('b', 'o2', None, inputs=['chlor'], outputs=['o2'], coefficients='time')
+    third = Calibration('c', 'ph', None, inputs=['v_ext'], outputs=['corrected_ph'],
+                        coefficients='serial_number')
+    assert stages([second, first, third]) == [[first, third], [second]]
+    loop = Calibration('d', 'chlor', None, inputs=['o2'], outputs=['chlor'], coefficients='time')
+    with pytest.raises(ValueError):
+        stages([second, loop])
+
+
+def test_concurrent(np_cals):
+    """Running the calibrations at the same time gives the same results."""
+    this_set = configs['np-ctd-2016b']
+    path = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+    one = calibrate_data(this_set.retrieve_and_parse_raw_data(path), this_set.calibrations,
+                         np_cals)
+    both = calibrate_data(this_set.retrieve_and_parse_raw_data(path), this_set.calibrations,
+                          np_cals, workers=2)
+    assert one['chlor'].notna().any() and one['o2'].notna().any()
+    pd.testing.assert_frame_equal(one, both)
+
+
+def test_empty_sheet(np_cals):
+    """A set with coefficients in a sheet keeps its calibration when the sheet has none."""
+    this_set = configs['np-ctd-2016b']
+    path = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+    cals = dict(np_cals, o2=np_cals['o2'].iloc[:0])
+    data = calibrate_data(this_set.retrieve_and_parse_raw_data(path), this_set.calibrations, cals)
+    assert data['o2'].isna().all()  # not the builtin Aanderaa calibration
+    assert 'O2_uM' not in data.columns
+
+
+def test_register(monkeypatch, chlor_cals):
+    """A registered calibration is used for its parameter."""
+    monkeypatch.setattr(calibrations, 'CALIBRATIONS', {})
+    calibrations.register(Calibration(
+        'double', 'chlor', lambda data, cals, ctd_data, ph_engine: data['fluorometer_v'] * 2,
+        inputs=['fluorometer_v'], outputs=['chlor'], coefficients='time'))
+    data = pd.DataFrame({'fluorometer_v': [0.5, 1.0]})
+    calibrated = calibrate_data(data, [find_calibration('chlor')],
+                                {'chlor': chlor_cals})
+    assert list(calibrated['chlor']) == [1.0, 2.0]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the index of calibrated days."""
+
+from pathlib import Path
+
+import pandas as pd
+
+from ..utilities import parse_datetime
+from ..sass_runner import SassCalibrationRunner, load_configs
+from ..coverage import CoverageIndex, count_lines, gaps
+
+here = Path(__file__).parent
+config_path = here.parent.joinpath('config/instrument_sets.json')
+raw = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+
+
+def test_coverage(tmp_path, np_cals):
+    """Days written by the runner are in the index, and the others are gaps."""
+    incoming = tmp_path.joinpath('incoming')
+    lines = raw.read_text(encoding='ISO-8859-1').splitlines(keepends=True)
+    for day, copies in [(26, 2), (27, 1), (28, 2)]:
+        path = incoming.joinpath(f'newport_pier/2021-02/data-202102{day}.dat')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(''.join(lines * copies), encoding='ISO-8859-1')
+    incoming.joinpath('cals').mkdir()
+
+    index_path = tmp_path.joinpath('coverage.sqlite')
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('calibrated'),
+                                   coverage_path=index_path)
+    start = parse_datetime('2021-02-24T00:00:00Z')
+    end = parse_datetime('2021-03-02T00:00:00Z')
+    assert runner.run(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals) is None
+
+    days = CoverageIndex(index_path).days(start, end, ['np-ctd-2016b'])
+    assert list(days['day']) == ['2021-02-26', '2021-02-27', '2021-02-28']
+    calibrated = pd.read_csv(tmp_path.joinpath('calibrated/newport_pier/2021-02/'
+                                               'data-20210226.dat'))
+    first = days.iloc[0]
+    assert first['rows'] == len(calibrated)
+    assert first['raw_lines'] == 2 * count_lines(raw) == 2 * len(lines)
+    assert first['drop_ratio'] == 1 - len(calibrated) / (2 * len(lines))
+    assert first['o2_nans'] == calibrated['o2'].isna().sum()
+    assert first['chlor_nans'] == calibrated['chlor'].isna().sum()
+    assert first['first_time'] < first['last_time']
+
+    np_set = load_configs(config_path, set='np-ctd-2016b')[0]
+    found = gaps(CoverageIndex(index_path), [np_set], start, end, short=0.6)
+    assert found.values.tolist() == [
+        ['np-ctd-2016b', '2021-02-24', '2021-02-25', 2, 'missing'],
+        ['np-ctd-2016b', '2021-02-27', '2021-02-27', 1, 'short'],
+        ['np-ctd-2016b', '2021-03-01', '2021-03-02', 2, 'missing'],
+    ]
+
+    # again replaces the rows of those days
+    assert runner.run(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals) is None
+    assert len(CoverageIndex(index_path).days(start, end)) == 3
+
+
+def test_lines_counted_when_read(tmp_path, np_incoming, np_cals):
+    """The raw lines are counted by read_file, so write_file doesn't read the raw file again."""
+    incoming = np_incoming([26])
+    file = 'newport_pier/2021-02/data-20210226.dat'
+    index_path = tmp_path.joinpath('coverage.sqlite')
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('calibrated'),
+                                   coverage_path=index_path)
+    day = parse_datetime('2021-02-26T00:00:00Z')
+    job = runner.prepare(start=day, end=day, set_id='np-ctd-2016b', cals=np_cals)
+    data, ctd_data = runner.read_file(job, file)
+    incoming.joinpath(file).unlink()
+    runner.write_file(job, file, runner.calibrate_file(job, file, data, ctd_data))
+    assert CoverageIndex(index_path).days(day, day)['raw_lines'].tolist() == [count_lines(raw)]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test cleaning raw data with the dialect of each set gives the same results as the generic way.
+
+Also benchmarks the two against each other:
+pytest --benchmark-only sass/tests/test_dialects.py
+"""
+
+import copy
+import random
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..sass_runner import load_configs
+from ..instrument_set import InstrumentSet
+from ..dialects import NORMAL, find_dialect, normal_text, only_numbers
+
+here = Path(__file__).parent
+configs = {s.set_id: s for s in load_configs(here.parent.joinpath('config/instrument_sets.json'))}
+
+raw_files = [
+    ('sio-ctd-2016', 'raw_data/sio_data-20210826.dat'),
+    ('sio-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('np-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sw-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sio-ctd-2016', 'raw_data/data-20170117_no_hash.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20210720_corrupt.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211014_superbad.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211010_superbad.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210226_badwhash.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210227_worst.dat'),
+    ('np-ph-2020', 'raw_data/newport_ph_data-20210110_corrupt.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad1.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad2.dat'),
+    ('np-ph-2020', 'pH/data-20210909_trimmed.dat'),
+    ('sio-scs-2022', 'raw_data/sio_scs_data_20220430.dat'),
+]
+
+
+def generic(this_set):
+    """The same set without its dialect."""
+    this_set = copy.copy(this_set)
+    this_set.dialect = None
+    return this_set
+
+
+def test_find_dialect():
+    """Sets are bound to the dialect of their columns, unless they name one."""
+    assert configs['sio-ctd-2013'].dialect.name == 'ctd_hash'
+    assert configs['sw-ctd-2018'].dialect.name == 'ctd_hash'
+    assert configs['np-ph-2020'].dialect.name == 'seafet'
+    assert configs['sio-scs-2022'].dialect.name == 'scs'
+    columns = configs['sio-ctd-2016'].data_columns
+    assert InstrumentSet(set_id='x', columns=columns, dialect='generic').dialect is None
+    assert InstrumentSet(set_id='x', columns=columns, dialect='ctd_no_hash').dialect.name == \
+        'ctd_no_hash'
+    with pytest.raises(ValueError):
+        find_dialect(configs['sio-ctd-2016'], 'ctd')
+
+
+@pytest.mark.parametrize('set_id,filename', raw_files)
+def test_same_as_generic(set_id, filename):
+    """Each dialect cleans the example files like the generic way, however they are read."""
+    this_set = configs[set_id]
+    path = here.joinpath('resources', filename)
+    expected = generic(this_set).retrieve_and_parse_raw_data(path)
+    pd.testing.assert_frame_equal(expected, this_set.retrieve_and_parse_raw_data(path))
+    text = path.read_text(encoding='ISO-8859-1')
+    pd.testing.assert_frame_equal(expected, this_set.parse_raw_text(text))
+    pd.testing.assert_frame_equal(expected,
+                                  this_set.retrieve_and_parse_raw_data(path, chunk_rows=4))
+
+
+def test_no_hash_files():
+    """A set whose files can have hash marks also cleans a file without any."""
+    path = here.joinpath('resources/raw_data/data-20170117_no_hash.dat')
+    for name in ['ctd_hash', 'ctd_no_hash']:
+        this_set = copy.copy(configs['sio-ctd-2016'])
+        this_set.dialect = find_dialect(this_set, name)
+        data = this_set.retrieve_and_parse_raw_data(path)
+        pd.testing.assert_frame_equal(
+            generic(this_set).retrieve_and_parse_raw_data(path), data)
+        assert len(data) == 5
+
+
+def test_scs_dates(tmp_path):
+    """SCS dates are read as such even when a line of the file has a date written otherwise."""
+    this_set = configs['sio-scs-2022']
+    assert this_set.date_format == '%Y/%m/%d' and generic(this_set).date_format == '%Y/%m/%d'
+    assert configs['sio-ctd-2016'].date_format is None
+    lines = here.joinpath('resources/raw_data/sio_scs_data_20220430.dat').read_text(
+        encoding='ISO-8859-1').splitlines(keepends=True)
+    lines[1] = lines[1].replace('2022/04/30', '04/30/2022', 1)
+    path = tmp_path.joinpath('data_20220430.dat')
+    path.write_text(''.join(lines), encoding='ISO-8859-1')
+
+    expected = generic(this_set).retrieve_and_parse_raw_data(path)
+    assert len(expected) == len(lines) - 1
+    pd.testing.assert_frame_equal(expected, this_set.retrieve_and_parse_raw_data(path))
+    for chunk_rows in [1, 2, 4]:
+        pd.testing.assert_frame_equal(
+            expected, this_set.retrieve_and_parse_raw_data(path, chunk_rows=chunk_rows))
+
+
+def test_text_helpers():
+    """The helpers that work on all the values at once agree with the one at a time way."""
+    random.seed(0)
+    values = [''.join(random.choice(NORMAL + '\x00\x7fÿé#') for _ in range(random.randint(0, 8)))
+              for _ in range(5000)] + [np.nan, '', 'a\x00']
+    column = pd.Series(values, dtype=object)
+    expected = ~column.str.strip(NORMAL).astype(bool).to_numpy()
+    np.testing.assert_array_equal(normal_text(column), expected)
+
+    column = column[expected]
+    pd.testing.assert_series_equal(only_numbers(column),
+                                   column.str.replace(r'[^0-9.\-]', '', regex=True))
+
+
+@pytest.fixture(params=['sio_data-20210826.dat', 'stearns_data-20211014_superbad.dat'])
+def big_file(request, tmp_path):
+    """A day of data repeated to be a more realistic size."""
+    lines = here.joinpath('resources/raw_data', request.param).read_bytes()
+    lines = lines.rstrip(b'\n') + b'\n'
+    path = tmp_path.joinpath(request.param)
+    path.write_bytes(lines * 200)
+    return path
+
+
+@pytest.mark.parametrize('dialect', ['generic', 'ctd_hash'])
+def test_benchmark_dialects(benchmark, big_file, dialect):
+    """Time the generic way and the dialect on the same file: one typical, one mostly garbage."""
+    this_set = configs['sio-ctd-2016' if big_file.name.startswith('sio') else 'sw-ctd-2018']
+    if dialect == 'generic':
+        this_set = generic(this_set)
+    data = benchmark(this_set.retrieve_and_parse_raw_data, big_file)
+    assert len(data) > 0
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test finding raw data files by listing directories."""
+
+import os
+import pickle
+from pathlib import Path
+
+import pytest
+
+from .. import discovery
+from ..utilities import parse_datetime
+from ..sass_runner import load_configs
+from ..discovery import DirectoryIndex, find_files
+
+here = Path(__file__).parent
+configs = {s.set_id: s for s in load_configs(here.parent.joinpath('config/instrument_sets.json'))}
+
+
+@pytest.fixture
+def incoming(tmp_path):
+    """A few days of newport_pier over three months, with an outage in between."""
+    incoming = tmp_path.joinpath('incoming')
+    names = ['2021-01/data-20210130.dat', '2021-01/data-20210131.dat',
+             '2021-01/data_20210131.dat', '2021-01/data-20210132.dat', '2021-01/notes.txt',
+             '2021-03/data-20210301.dat', '2021-03/data_20210302.dat']
+    for name in names:
+        path = incoming.joinpath('newport_pier', name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('x' * len(name))
+    return incoming
+
+
+def test_find_files(incoming):
+    """Only the files that exist, by day, with their sizes."""
+    np_set = configs['np-ctd-2016b']
+    start = parse_datetime('2021-01-31T00:00:00Z')
+    end = parse_datetime('2021-03-05T00:00:00Z')
+    files = find_files(np_set, start, end, incoming)
+    assert [f.name for f in files] == ['newport_pier/2021-01/data-20210131.dat',
+                                       'newport_pier/2021-03/data-20210301.dat',
+                                       'newport_pier/2021-03/data_20210302.dat']
+    assert [f.day for f in files] == [parse_datetime(d) for d in [
+        '2021-01-31T00:00:00Z', '2021-03-01T00:00:00Z', '2021-03-02T00:00:00Z']]
+    assert files[0].size == len('2021-01/data-20210131.dat')
+
+    days = [parse_datetime('2021-03-02T00:00:00Z'), parse_datetime('2021-04-01T00:00:00Z')]
+    assert [f.day.day for f in find_files(np_set, start, end, incoming, days=days)] == [2]
+    assert find_files(np_set, end, start, incoming) == []
+
+
+def test_directory_index(tmp_path, incoming, monkeypatch):
+    """Directories are only listed again when they change."""
+    np_set = configs['np-ctd-2016b']
+    start = parse_datetime('2020-12-01T00:00:00Z')
+    end = parse_datetime('2021-03-31T00:00:00Z')
+    listed = []
+    scan_month = discovery.scan_month
+    monkeypatch.setattr(discovery, 'scan_month', lambda d: listed.append(d) or scan_month(d))
+
+    index = DirectoryIndex(tmp_path.joinpath('index.json'))
+    first = [f.name for f in find_files(np_set, start, end, incoming, index=index)]
+    assert len(listed) == 2  # 2021-01 and 2021-03
+    index.save()
+
+    index = pickle.loads(pickle.dumps(DirectoryIndex(tmp_path.joinpath('index.json'))))
+    assert [f.name for f in find_files(np_set, start, end, incoming, index=index)] == first
+    assert len(listed) == 2
+
+    march = incoming.joinpath('newport_pier/2021-03')
+    march.joinpath('data-20210303.dat').write_text('x')
+    os.utime(march, (0, 0))
+    files = find_files(np_set, start, end, incoming, index=index)
+    assert len(listed) == 3
+    assert files[-1].name == 'newport_pier/2021-03/data-20210303.dat'
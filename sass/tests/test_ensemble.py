@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test calibrating with several sets of coefficients at once."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..calibrations import get_chlor, get_o2, get_ph
+from ..ensemble import blend, ensemble
+from ..sass_runner import load_configs
+
+here = Path(__file__).parent
+configs = {s.set_id: s for s in load_configs(here.parent.joinpath('config/instrument_sets.json'))}
+
+
+@pytest.fixture
+def np_data():
+    """Cleaned raw data of np-ctd-2016b."""
+    path = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+    return configs['np-ctd-2016b'].retrieve_and_parse_raw_data(path)
+
+
+def one_row(row):
+    """Coefficients like get_cals gives, with one row that applies to everything."""
+    cals = pd.DataFrame([row])
+    cals['time'] = pd.Timestamp('2000-01-01T00:00:00Z')
+    return cals
+
+
+def test_chlorophyll(np_data):
+    """Each column is what the usual calibration gives with that row."""
+    candidates = pd.DataFrame({'Scale Factor': [10.0, 11.0, 12.0],
+                               'Clean Water Offset (CWO)': [0.08, 0.07, 0.06]},
+                              index=['old', 'new', 'other'])
+    result = ensemble(np_data, 'chlor', candidates)
+    assert list(result.columns) == ['time', 'old', 'new', 'other']
+    for name, row in candidates.iterrows():
+        expected = get_chlor(np_data, one_row(row))
+        np.testing.assert_array_equal(result[name], expected)
+
+
+def test_oxygen(np_data):
+    """O2 of each candidate, including a blend."""
+    o2 = pd.read_csv(here.joinpath('resources/oxygen/calibration_coefficients_20210826.csv'))
+    candidates = blend(o2.iloc[0], o2.iloc[1], [0, 0.5, 1])
+    assert list(candidates.index) == [0, 0.5, 1]
+    assert candidates.loc[0.5, 'A2'] == pytest.approx((o2['A2'][0] + o2['A2'][1]) / 2)
+    result = ensemble(np_data, 'o2', candidates)
+    assert result[0].notna().any()
+    for fraction, row in candidates.iterrows():
+        expected = get_o2(np_data, one_row(row))
+        np.testing.assert_allclose(result[fraction], expected, atol=0.01)
+
+
+@pytest.mark.parametrize('engine', ['exact', 'table'])
+def test_ph(engine):
+    """Each candidate gives the pH of get_ph, with the salinity interpolated once."""
+    times = pd.date_range('2021-01-10T00:00:00Z', periods=6, freq='10min')
+    data = pd.DataFrame({'time': times, 'v_ext': [-0.90, -0.91, np.nan, -0.92, -0.93, -0.94],
+                         'temperature': [15.0, 15.2, 15.3, 15.1, 14.9, 15.0],
+                         'serial_number': 'SEAFET02145'})
+    ctd = pd.DataFrame({'time': times[::2] + pd.Timedelta(minutes=1),
+                        'salinity': [33.4, 33.5, 33.6]})
+    candidates = pd.DataFrame({'Kext0': [-1.429278, -1.43], 'Kext2': [-1.142026e-3, -1.1e-3]})
+    result = ensemble(data, 'ph', candidates, ctd_data=ctd, ph_engine=engine)
+    assert len(result) == 5
+    for k, row in candidates.iterrows():
+        cals = pd.DataFrame([row]).assign(**{'SERIAL NUMBER': 2145})
+        expected = get_ph(data, cals, ctd, engine=engine)
+        np.testing.assert_allclose(result[k], expected, atol=0.01)
+
+    with pytest.raises(ValueError):
+        ensemble(data, 'ph', candidates)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the harness that compares calibration engines to the original equations."""
+
+import numpy as np
+
+from .. import equivalence
+
+
+def test_generate_edges():
+    """Made up inputs include the awkward cases."""
+    inputs = equivalence.generate('oxygen', 20000)
+    assert (inputs['voltage'] == 3.3).any()
+    assert (inputs['salinity'] == 0).any()
+    assert np.isnan(inputs['output']).any()
+
+    reference = equivalence.run_reference('oxygen', inputs)
+    assert np.isnan(reference[inputs['voltage'] == 0]).all()
+    assert np.isfinite(reference).mean() > 0.98
+
+
+def test_compare():
+    """Differences and rounding flips are counted."""
+    reference = np.array([1.0, 2.0, 2.004999, np.nan, np.inf])
+    candidate = np.array([1.0, 2.001, 2.005001, np.nan, 3.0])
+    report = equivalence.compare(reference, candidate, 2)
+    assert report['compared'] == 3
+    assert np.isclose(report['max_abs'], 0.001)
+    assert np.isclose(report['max_rel'], 0.0005)
+    assert report['nonfinite_mismatch'] == 1
+    assert report['rounded_mismatch'] == 1
+    assert not equivalence.agrees(report, 2)
+
+
+def test_ph_table():
+    """The pH lookup table agrees with the exact equations, including at salinity 0."""
+    report = equivalence.check('ph', 20000)['table']
+    assert report['nonfinite_mismatch'] == 0
+    assert report['max_abs'] < 1.5e-4
+    assert report['agrees']
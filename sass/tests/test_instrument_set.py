@@ -6,6 +6,7 @@
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 import pytest
 
 from ..utilities import parse_datetime
@@ -257,3 +258,102 @@ def test_retrieve_spacedelim(sio_scs_set):
     assert data.loc[0, 'temperature'] == 16.219  # temperature
     # time was added as the last column
     assert data.iloc[0, -1] == parse_datetime("2022-04-30T00:00:10")
+
+
+def test_retrieve_projected_columns(np_set):
+    """Verify only the needed columns are read by a set that trims them, and strings are compact.
+
+    :param np_set: a pre-filled InstrumentSet
+    :return:
+    """
+    assert 'battery' in np_set.usecols
+    np_set.trim_columns = True
+    assert 'battery' not in np_set.usecols
+    assert 'fluorometer_v' in np_set.usecols
+    assert 'O2_raw_voltage' in np_set.usecols
+
+    path = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat')
+    data = np_set.retrieve_and_parse_raw_data(path)
+    assert 'battery' not in data.columns
+    assert 'pump' not in data.columns
+    assert data['ip'].dtype == 'category'
+    # missing values are still cleaned up
+    assert (data.select_dtypes('float') != -9.999).all().all()
+
+
+@pytest.mark.parametrize('set_id,filename', [
+    ('sio-ctd-2016', 'raw_data/sio_data-20210826.dat'),
+    ('np-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sw-ctd-2013', 'raw_data/data-20131115_trimmed.dat'),
+    ('sio-ctd-2016', 'raw_data/data-20170117_no_hash.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20210720_corrupt.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211014_superbad.dat'),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211010_superbad.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210226_badwhash.dat'),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210227_worst.dat'),
+    ('np-ph-2020', 'raw_data/newport_ph_data-20210110_corrupt.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad1.dat'),
+    ('np-ph-2020', 'pH/data-20210909_bad2.dat'),
+    ('np-ph-2020', 'pH/data-20210909_trimmed.dat'),
+    ('sio-scs-2022', 'raw_data/sio_scs_data_20220430.dat'),
+])
+@pytest.mark.parametrize('engine', ['pandas', 'pyarrow'])
+def test_all_columns_kept(set_id, filename, engine):
+    """Every column of the set is still written out unless it trims them.
+
+    Like they always have been: all of them but the sensor date, which is joined to the sensor
+    time, and then the time.
+    """
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    this_set = load_configs(here.joinpath(instrument_set_filename), set=set_id)[0]
+    path = here.joinpath('resources', filename)
+    data = this_set.retrieve_and_parse_raw_data(path, engine=engine)
+    assert len(data) > 0
+    expected = [name for name in this_set.data_columns if name != 'sensor_date'] + ['time']
+    assert list(data.columns) == expected
+    assert list(this_set.retrieve_and_parse_raw_data(path, chunk_rows=3).columns) == expected
+
+
+@pytest.mark.parametrize('set_id,filename,chunk_rows', [
+    ('sio-ctd-2016', 'raw_data/sio_data-20210826.dat', 100),
+    ('sio-ctd-2016', 'raw_data/data-20170117_no_hash.dat', 7),
+    ('np-ctd-2013', 'raw_data/data-20131115_trimmed.dat', 5),
+    ('sw-ctd-2018', 'raw_data/stearns_data-20211014_superbad.dat', 3),
+    ('np-ctd-2016b', 'raw_data/newport_data-20210227_worst.dat', 10),
+    ('np-ph-2020', 'raw_data/newport_ph_data-20210110_corrupt.dat', 4),
+    ('sio-scs-2022', 'raw_data/sio_scs_data_20220430.dat', 2),
+    ('sio-ctd-2016', 'raw_data/sio_data-20210826.dat', 100000),
+])
+def test_retrieve_in_chunks(set_id, filename, chunk_rows):
+    """Cleaning a few lines at a time gives the same data as cleaning the whole file."""
+    this_set = load_configs(here.joinpath(instrument_set_filename), set=set_id)[0]
+    path = here.joinpath('resources', filename)
+    expected = this_set.retrieve_and_parse_raw_data(path)
+    data = this_set.retrieve_and_parse_raw_data(path, chunk_rows=chunk_rows)
+    pd.testing.assert_frame_equal(expected, data)
+
+
+@pytest.mark.parametrize('trim_columns', [False, True])
+def test_too_many_fields(np_set, tmp_path, trim_columns):
+    """A file whose first line has too many fields has no data, but other errors aren't hidden.
+
+    :param np_set: a pre-filled InstrumentSet
+    """
+    np_set.trim_columns = trim_columns
+    good = here.joinpath('resources/raw_data/newport_data-20210226_badwhash.dat').read_text(
+        encoding='ISO-8859-1')
+    extra = ',1' * 3
+    path = tmp_path.joinpath('long_first.dat')
+    path.write_text(good.replace('\n', extra + '\n', 1), encoding='ISO-8859-1')
+    assert len(np_set.retrieve_and_parse_raw_data(path)) == 0
+
+    path = tmp_path.joinpath('long_later.dat')
+    lines = good.splitlines(keepends=True)
+    path.write_text(''.join(lines[:3] + [lines[3].replace('\n', extra + '\n')] + lines[4:]),
+                    encoding='ISO-8859-1')
+    if trim_columns:  # pandas ignores the extra fields of later lines with usecols
+        assert len(np_set.retrieve_and_parse_raw_data(path)) > 0
+    else:
+        with pytest.raises(pd.errors.ParserError):
+            np_set.retrieve_and_parse_raw_data(path)
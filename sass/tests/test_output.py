@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test writing calibrated data files."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..output import write_calibrated
+from ..sass_runner import SassCalibrationRunner
+
+here = Path(__file__).parent
+
+
+@pytest.fixture
+def data():
+    """A calibrated looking DataFrame."""
+    return pd.DataFrame({'temperature': np.linspace(15, 20, 2500),
+                         'sensor_time': ['26 Aug 2021 03:02:18'] * 2500,
+                         'chlor': [1.23, np.nan] * 1250})
+
+
+@pytest.mark.parametrize('compression,extension', [(None, ''), ('gzip', '.gz'),
+                                                   ('zstd', '.zst')])
+def test_write_calibrated(tmp_path, data, compression, extension):
+    """Compressed files get the extension and read back the same."""
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = tmp_path.joinpath('data-20210826.dat')
+
+    written = write_calibrated(data, path, compression=compression, level=1, chunksize=1000)
+    assert written.name == 'data-20210826.dat' + extension
+
+    pd.testing.assert_frame_equal(pd.read_csv(written), data)
+    # NaN is written the same way as before
+    assert 'NaN' in pd.read_csv(written, keep_default_na=False)['chlor'].values
+
+
+def test_unknown_compression():
+    """Find out about a typo before processing anything."""
+    with pytest.raises(ValueError):
+        SassCalibrationRunner(compression='bzip')
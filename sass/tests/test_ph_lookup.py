@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the lookup table for external pH against the exact equations."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ..seafet_ph import external_correction
+from ..ph_lookup import default_table, calibrate_external_ph
+from ..calibrations import get_ph
+from ..sass_runner import load_configs
+
+here = Path(__file__).parent
+instrument_set_filename = '../config/instrument_sets.json'
+
+
+def test_table_error():
+    """The documented largest errors of the default table hold."""
+    rng = np.random.default_rng(42)
+    table = default_table()
+
+    # anywhere in the table
+    salinity = rng.uniform(1, 42, 50000)
+    temperature = rng.uniform(-2, 40, 50000)
+    exact = np.array([external_correction(s, t) for s, t in zip(salinity, temperature)])
+    error = np.abs(table(salinity, temperature) - exact)
+    assert error.max() < 1.5e-4
+
+    # where the piers usually are
+    salinity = rng.uniform(20, 40, 50000)
+    temperature = rng.uniform(5, 30, 50000)
+    exact = np.array([external_correction(s, t) for s, t in zip(salinity, temperature)])
+    error = np.abs(table(salinity, temperature) - exact)
+    assert error.max() < 3e-6
+
+
+def test_tech_note():
+    """Same value as the Technical Note (see test_ph_calibration.py)."""
+    ph = calibrate_external_ph(voltage=[-.965858], temperature=[15.8735], salinity=[36.817],
+                               k0=-1.429278, k2=-1.142026e-3)
+    assert round(ph[0], 4) == 7.8454
+
+
+def test_outside_table():
+    """Exact equations are used outside the table, and missing values stay missing."""
+    salinity = np.array([45.0, 33.0, np.nan])
+    temperature = np.array([15.0, -5.0, 15.0])
+    correction = default_table()(salinity, temperature)
+    assert correction[0] == external_correction(45.0, 15.0)
+    assert correction[1] == external_correction(33.0, -5.0)
+    assert np.isnan(correction[2])
+
+
+def test_get_ph_engines(ph_cals):
+    """Both engines give the same rounded pH for real data."""
+    path = here.joinpath(instrument_set_filename)
+    np_ph_set = load_configs(path, set='np-ph-2020')[0]
+    data = np_ph_set.retrieve_and_parse_raw_data(
+        here.joinpath('resources/raw_data/newport_ph_data-20210110_corrupt.dat'))
+    data.dropna(subset=['v_ext'], inplace=True)
+    ctd_data = pd.DataFrame({'time': data['time'],
+                             'salinity': np.linspace(30, 34, len(data))})
+
+    exact = get_ph(data, ph_cals, ctd_data)
+    fast = get_ph(data, ph_cals, ctd_data, engine='table')
+    pd.testing.assert_series_equal(exact, fast)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test reading and writing files in the background while calibrating."""
+
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..utilities import parse_datetime
+from ..sass_runner import SassCalibrationRunner
+from ..pipeline import calibrate_pipelined, process_pipelined
+
+here = Path(__file__).parent
+config_path = here.parent.joinpath('config/instrument_sets.json')
+days = [21, 22, 23, 24, 26, 27, 28]
+start = parse_datetime('2021-02-20T00:00:00Z')
+end = parse_datetime('2021-02-28T00:00:00Z')
+
+
+@pytest.fixture
+def incoming(np_incoming):
+    """A week of np-ctd-2016b, with a day missing."""
+    return np_incoming(days)
+
+
+def read_days(outgoing):
+    """The calibrated files that were written."""
+    return [pd.read_csv(outgoing.joinpath(f'newport_pier/2021-02/data-202102{day}.dat'))
+            for day in days]
+
+
+class WatchedRunner(SassCalibrationRunner):
+    """Keeps track of the order files are written in and how many are in memory."""
+
+    def __init__(self, fail=None, **kwargs):
+        """Same as a runner, and fail to calibrate the file with this name."""
+        super().__init__(**kwargs)
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.written = []
+        self.in_memory = 0
+        self.most_in_memory = 0
+
+    def read_file(self, job, file):
+        """Count the file as in memory once it's read."""
+        raw = super().read_file(job, file)
+        if raw is not None:
+            with self.lock:
+                self.in_memory += 1
+                self.most_in_memory = max(self.most_in_memory, self.in_memory)
+        return raw
+
+    def calibrate_file(self, job, file, data, ctd_data=None):
+        """Fail on purpose."""
+        if file == self.fail:
+            with self.lock:
+                self.in_memory -= 1
+            raise RuntimeError('on purpose')
+        return super().calibrate_file(job, file, data, ctd_data)
+
+    def write_file(self, job, file, data):
+        """Remember the order and that the file is out of memory."""
+        path = super().write_file(job, file, data)
+        with self.lock:
+            self.written.append(file)
+            self.in_memory -= 1
+        return path
+
+
+def test_calibrate_pipelined(tmp_path, incoming, np_cals):
+    """The same files as one after another, in the same order, with bounded memory."""
+    runner = SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('loop'))
+    assert runner.run(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals) is None
+
+    runner = WatchedRunner(config_path=config_path, incoming_dir=incoming,
+                           outgoing_dir=tmp_path.joinpath('pipeline'))
+    assert calibrate_pipelined(runner, 'np-ctd-2016b', start, end, cals=np_cals,
+                               depth=1) is None
+    for loop, pipeline in zip(read_days(tmp_path.joinpath('loop')),
+                              read_days(tmp_path.joinpath('pipeline'))):
+        pd.testing.assert_frame_equal(loop, pipeline)
+    assert runner.written == [f'newport_pier/2021-02/data-202102{day}.dat' for day in days]
+    assert 0 < runner.most_in_memory <= 2 * 1 + 3
+    assert runner.in_memory == 0
+
+    assert calibrate_pipelined(runner, 'foo', start, end) == 1
+
+
+def test_failed_file(tmp_path, incoming, np_cals):
+    """A file that fails is reported and the others are written."""
+    failing = 'newport_pier/2021-02/data-20210223.dat'
+    runner = WatchedRunner(fail=failing, config_path=config_path, incoming_dir=incoming,
+                           outgoing_dir=tmp_path)
+    job = runner.prepare(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals)
+    results = process_pipelined(runner, job)
+    by_file = dict(zip(job.files, results))
+    assert isinstance(by_file.pop(failing), RuntimeError)
+    assert all(rows > 0 for rows in by_file.values())
+    assert runner.written == sorted(by_file)
+    assert not tmp_path.joinpath(failing).exists()
+
+    assert calibrate_pipelined(runner, 'np-ctd-2016b', start, end, cals=np_cals) == 1
+    with pytest.raises(ValueError):
+        process_pipelined(runner, job, depth=0)
+
+
+def test_writer_stops(tmp_path, incoming, np_cals):
+    """If the writer stops without finishing, the calibration doesn't wait for it forever."""
+    class StoppingRunner(SassCalibrationRunner):
+        def write_file(self, job, file, data):
+            raise SystemExit  # not an Exception, so the writer thread ends
+
+    runner = StoppingRunner(config_path=config_path, incoming_dir=incoming, outgoing_dir=tmp_path)
+    job = runner.prepare(start=start, end=end, set_id='np-ctd-2016b', cals=np_cals)
+    results = []
+    pipeline = threading.Thread(target=lambda: results.extend(process_pipelined(runner, job,
+                                                                                depth=1)),
+                                daemon=True)
+    pipeline.start()
+    pipeline.join(timeout=60)
+    assert not pipeline.is_alive()
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(results) == len(job.files)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test reading calibrated data between two times."""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from .. import output
+from ..api import Calibrator
+from ..array_store import ArrayStore
+from ..query import find_sets, calibrated_files, query
+from ..sass_runner import load_configs
+
+here = Path(__file__).parent
+config_path = here.parent.joinpath('config/instrument_sets.json')
+
+
+def write_days(outgoing, cals):
+    """Calibrated files of two days of sio-ctd-2016, the second compressed.
+
+    :param outgoing: Posix path of the directory to write them in
+    :param cals: chlorophyll coefficients
+    :return: DataFrame of both days, with a time column
+    """
+    calibrator = Calibrator()
+    path = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+    data = calibrator.calibrate('sio-ctd-2016', path.read_bytes(), coefficients={'chlor': cals})
+    next_day = data.assign(time=data['time'] + pd.Timedelta(days=1))
+    next_day['sensor_time'] = next_day['time'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    month = outgoing.joinpath('scripps_pier/2021-08')
+    month.mkdir(parents=True)
+    output.write_calibrated(data.drop(columns=['time']), month.joinpath('data-20210826.dat'))
+    output.write_calibrated(next_day.drop(columns=['time']), month.joinpath('data-20210827.dat'),
+                            compression='gzip')
+    return pd.concat([data, next_day], ignore_index=True)
+
+
+def test_find_sets():
+    """Sets are found by id or by station, if they were active."""
+    configs = load_configs(config_path)
+    start = pd.Timestamp('2021-08-26T00:00:00Z')
+    end = pd.Timestamp('2021-08-27T00:00:00Z')
+    assert [s.set_id for s in find_sets('scripps pier', configs, start, end)] == ['sio-ctd-2016']
+    assert [s.set_id for s in find_sets('sio-ctd-2016', configs, start, end)] == ['sio-ctd-2016']
+    assert find_sets('sio-ctd-2016', configs, pd.Timestamp('2010-01-01T00:00:00Z'),
+                     pd.Timestamp('2010-01-02T00:00:00Z')) == []
+
+
+def test_calibrated_files(tmp_path, chlor_cals):
+    """Only the files of the days around the range are read, compressed or not."""
+    write_days(tmp_path, chlor_cals)
+    this_set = Calibrator().instrument_set('sio-ctd-2016')
+    start = pd.Timestamp('2021-08-25T06:00:00Z').to_pydatetime()
+    end = pd.Timestamp('2021-08-25T07:00:00Z').to_pydatetime()
+    assert [p.name for p in calibrated_files(this_set, start, end, tmp_path)] == \
+        ['data-20210826.dat']
+    end = pd.Timestamp('2021-08-27T07:00:00Z').to_pydatetime()
+    assert [p.name for p in calibrated_files(this_set, start, end, tmp_path)] == \
+        ['data-20210826.dat', 'data-20210827.dat.gz']
+
+    # written again compressed: the newer file is read, not the old plain one
+    month = tmp_path.joinpath('scripps_pier/2021-08')
+    newer = month.joinpath('data-20210826.dat.zst')
+    newer.write_bytes(b'')
+    os.utime(month.joinpath('data-20210826.dat'), (0, 0))
+    assert calibrated_files(this_set, start, end, tmp_path) == \
+        [newer, month.joinpath('data-20210827.dat.gz')]
+
+
+def test_query(tmp_path, chlor_cals):
+    """Rows in the range, with only the asked for columns."""
+    both = write_days(tmp_path, chlor_cals)
+    start = pd.Timestamp('2021-08-26T12:00:00Z')
+    end = pd.Timestamp('2021-08-27T06:00:00Z')
+    chunks = list(query('Scripps Pier', start, end, columns=['chlor'], config_path=config_path,
+                        outgoing_dir=tmp_path, store_dir=tmp_path.joinpath('store'),
+                        chunksize=50))
+    assert len(chunks) >= 2
+    data = pd.concat(chunks, ignore_index=True)
+    assert list(data.columns) == ['set_id', 'time', 'chlor']
+    assert (data['set_id'] == 'sio-ctd-2016').all()
+    expected = both.loc[both['time'].between(start, end)].reset_index(drop=True)
+    pd.testing.assert_series_equal(data['time'], expected['time'].dt.floor('s'))
+    pd.testing.assert_series_equal(data['chlor'], expected['chlor'], check_exact=False)
+
+    everything = pd.concat(query('sio-ctd-2016', start, end, config_path=config_path,
+                                 outgoing_dir=tmp_path, store_dir=tmp_path.joinpath('store')))
+    assert {'sensor_time', 'salinity', 'chlor'} <= set(everything.columns)
+    assert len(everything) == len(data)
+
+
+@pytest.mark.parametrize('format', ['zarr', 'netcdf'])
+def test_query_store(tmp_path, chlor_cals, format):
+    """Days in the array store are read from it, and the others from the calibrated files."""
+    pytest.importorskip('xarray')
+    pytest.importorskip({'zarr': 'zarr', 'netcdf': 'netCDF4'}[format], exc_type=ImportError)
+    both = write_days(tmp_path, chlor_cals)
+    # the store only has the second day, with different values to tell where they came from
+    second = both.loc[both['time'] >= pd.Timestamp('2021-08-27T00:00:00Z')]
+    second = second.assign(chlor=second['chlor'] + 100)
+    store = ArrayStore(tmp_path.joinpath('store'), format)
+    store.write_day(Calibrator().instrument_set('sio-ctd-2016'), pd.Timestamp('2021-08-27'),
+                    second)
+
+    start = pd.Timestamp('2021-08-26T00:00:00Z')
+    end = pd.Timestamp('2021-08-27T23:59:59Z')
+    data = pd.concat(query('sio-ctd-2016', start, end, columns=['chlor'],
+                           config_path=config_path, outgoing_dir=tmp_path,
+                           store_dir=tmp_path.joinpath('store')), ignore_index=True)
+    assert list(data.columns) == ['set_id', 'time', 'chlor']
+    expected = both.loc[both['time'].between(start, end)].reset_index(drop=True)
+    assert len(expected) == len(both)
+    expected.loc[expected['time'] >= pd.Timestamp('2021-08-27T00:00:00Z'), 'chlor'] += 100
+    pd.testing.assert_series_equal(data['time'], expected['time'].dt.floor('s'))
+    pd.testing.assert_series_equal(data['chlor'], expected['chlor'], check_exact=False)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the cache of cleaned raw data."""
+
+import copy
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..raw_cache import RawDataCache
+from ..sass_runner import load_configs
+
+here = Path(__file__).parent
+instrument_set_filename = '../config/instrument_sets.json'
+
+
+@pytest.mark.parametrize('set_id,filename', [
+    ('sw-ctd-2018', 'stearns_data-20210720_corrupt.dat'),
+    ('np-ctd-2016b', 'newport_data-20210226_badwhash.dat'),
+    ('np-ph-2020', 'newport_ph_data-20210110_corrupt.dat'),
+    ('sio-scs-2022', 'sio_scs_data_20220430.dat'),
+    ('np-ctd-2016b', 'sio_scs_data_20220430.dat'),  # nothing for this set in that file
+])
+def test_cached_same_as_cleaned(tmp_path, set_id, filename):
+    """The cached copy is the same as cleaning the file again."""
+    this_set = load_configs(here.joinpath(instrument_set_filename), set=set_id)[0]
+    path = here.joinpath('resources/raw_data', filename)
+    cache = RawDataCache(tmp_path)
+
+    expected = this_set.retrieve_and_parse_raw_data(path)
+    first = cache.retrieve_and_parse_raw_data(this_set, path)
+    second = cache.retrieve_and_parse_raw_data(this_set, path)
+    pd.testing.assert_frame_equal(expected, first)
+    pd.testing.assert_frame_equal(expected, second)
+
+
+def test_cache_used(tmp_path, monkeypatch):
+    """Cleaning only happens once unless the file or set changes."""
+    sets = load_configs(here.joinpath(instrument_set_filename))
+    sw_set = [s for s in sets if s.set_id == 'sw-ctd-2018'][0]
+    sio_set = [s for s in sets if s.set_id == 'sio-ctd-2016'][0]
+    path = tmp_path.joinpath('data-20210720.dat')
+    shutil.copy(here.joinpath('resources/raw_data/stearns_data-20210720_corrupt.dat'), path)
+    cache = RawDataCache(tmp_path.joinpath('cache'))
+
+    calls = []
+    original = sw_set.retrieve_and_parse_raw_data
+
+    def counting(url, **kwargs):
+        calls.append(url)
+        return original(url, **kwargs)
+
+    monkeypatch.setattr(sw_set, 'retrieve_and_parse_raw_data', counting)
+    cache.retrieve_and_parse_raw_data(sw_set, path)
+    cache.retrieve_and_parse_raw_data(sw_set, path)
+    assert len(calls) == 1
+
+    # a different set has a different copy
+    assert cache.key(sw_set, path) != cache.key(sio_set, path)
+
+    # a changed file is cleaned again
+    with open(path, 'a') as f:
+        f.write('\n')
+    cache.retrieve_and_parse_raw_data(sw_set, path)
+    assert len(calls) == 2
+
+
+def test_key_of_columns_and_dialect(tmp_path):
+    """Changing the columns of a set, or how its files are cleaned, changes the key."""
+    this_set = load_configs(here.joinpath(instrument_set_filename), set='sw-ctd-2018')[0]
+    path = here.joinpath('resources/raw_data/stearns_data-20210720_corrupt.dat')
+    cache = RawDataCache(tmp_path)
+    key = cache.key(this_set, path)
+
+    # swap two columns, so the same ones are kept in a different place
+    columns = list(this_set.data_columns)
+    i, j = columns.index('fluorometer_v'), columns.index('V3')
+    columns[i], columns[j] = columns[j], columns[i]
+    swapped = copy.copy(this_set)
+    swapped.data_columns = columns
+    assert sorted(swapped.usecols) == sorted(this_set.usecols)
+    assert cache.key(swapped, path) != key
+
+    generic = copy.copy(this_set)
+    generic.dialect = None
+    assert cache.key(generic, path) != key
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test finding the days affected by changes to calibration coefficients."""
+
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..utilities import parse_datetime
+from ..sass_runner import load_configs
+from ..recalibrate import changed_rows, affected_days, recalibrate
+
+here = Path(__file__).parent
+instrument_set_filename = '../config/instrument_sets.json'
+
+
+@pytest.fixture
+def np_set():
+    """Create an InstrumentSet from JSON file defined above."""
+    path = here.joinpath(instrument_set_filename)
+    return load_configs(path, set='np-ctd-2016b')[0]
+
+
+@pytest.fixture
+def np_ph_set():
+    """Create an InstrumentSet from JSON file defined above."""
+    path = here.joinpath(instrument_set_filename)
+    return load_configs(path, set='np-ph-2020')[0]
+
+
+@pytest.fixture
+def chlor_history():
+    """A small table of coefficients that change over January 2021, like the ones in the Sheet."""
+    df = pd.DataFrame({'START TIME UTC': ['2021-01-01 00:00:00', '2021-01-05 12:00:00',
+                                          '2021-01-10 00:00:00'],
+                       'Scale Factor': [10.0, 11.0, 12.0],
+                       'Clean Water Offset (CWO)': [0.07, 0.08, 0.09]})
+    df['time'] = pd.to_datetime(df['START TIME UTC'], utc=True)
+    return df
+
+
+def touch_days(incoming, tag, days, base='data-'):
+    """Make empty raw data files for some days in January 2021."""
+    for day in days:
+        path = incoming.joinpath(f'{tag}/2021-01/{base}202101{day:02d}.dat')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+
+def test_changed_rows(chlor_history):
+    """Only the row that was fixed is found."""
+    assert len(changed_rows(chlor_history, chlor_history.copy())) == 0
+
+    new = chlor_history.copy()
+    new.loc[1, 'Scale Factor'] = 11.5
+    changes = changed_rows(chlor_history, new)
+    # the old and the new version of the row
+    assert len(changes) == 2
+    assert set(changes['START TIME UTC']) == {'2021-01-05 12:00:00'}
+
+    # nothing to compare to, so everything changed
+    assert len(changed_rows(None, new)) == 3
+
+
+def test_affected_days_by_time(tmp_path, np_set, chlor_history):
+    """Days from the start of the changed row up to the start of the next."""
+    incoming = tmp_path.joinpath('incoming')
+    touch_days(incoming, 'newport_pier', [3, 5, 6, 8, 9, 10, 11])
+
+    new = chlor_history.copy()
+    new.loc[1, 'Scale Factor'] = 11.5
+    days = affected_days(np_set, 'chlor', chlor_history, new, incoming)
+    assert sorted(d.day for d in days) == [5, 6, 8, 9]
+
+    # moving the start later affects days in both the old and new intervals
+    new = chlor_history.copy()
+    new.loc[1, 'START TIME UTC'] = '2021-01-08 00:00:00'
+    new['time'] = pd.to_datetime(new['START TIME UTC'], utc=True)
+    days = affected_days(np_set, 'chlor', chlor_history, new, incoming)
+    assert sorted(d.day for d in days) == [5, 6, 8, 9]
+
+    # the last row goes on forever
+    new = chlor_history.copy()
+    new.loc[2, 'Scale Factor'] = 1.0
+    days = affected_days(np_set, 'chlor', chlor_history, new, incoming)
+    assert sorted(d.day for d in days) == [10, 11]
+    assert min(days) == parse_datetime("2021-01-10T00:00:00Z")
+
+
+def test_affected_days_by_serial_number(tmp_path, np_ph_set):
+    """The pH coefficients only matter on days when that SeaFET is in the water."""
+    incoming = tmp_path.joinpath('incoming')
+    raw = here.joinpath('resources/raw_data/newport_ph_data-20210110_corrupt.dat')
+    path = incoming.joinpath('newport_pier_ph/2021-01/data-20210110.dat')
+    path.parent.mkdir(parents=True)
+    shutil.copy(raw, path)
+    other = incoming.joinpath('newport_pier_ph/2021-01/data-20210111.dat')
+    other.write_bytes(path.read_bytes().replace(b'SEAFET02145', b'SEAFET01111'))
+
+    old = pd.DataFrame({'SERIAL NUMBER': [2145, 1111], 'Kext0': [-1.4, -1.3],
+                        'Kext2': [-0.001, -0.001]})
+    new = old.copy()
+    new.loc[0, 'Kext0'] = -1.45
+
+    # files that can't be read (or only partly) don't stop the others
+    lines = path.read_text(encoding='ISO-8859-1').splitlines(keepends=True)
+    long_first = incoming.joinpath('newport_pier_ph/2021-01/data-20210112.dat')
+    long_first.write_text(lines[0].replace('\n', ',1,2,3\n') + ''.join(lines[1:]),
+                          encoding='ISO-8859-1')
+    incoming.joinpath('newport_pier_ph/2021-01/data-20210113.dat').touch()
+    long_later = incoming.joinpath('newport_pier_ph/2021-01/data-20210114.dat')
+    long_later.write_text(''.join(lines[:2] + [lines[2].replace('\n', ',1,2,3\n')] + lines[2:]),
+                          encoding='ISO-8859-1')
+
+    days = affected_days(np_ph_set, 'ph', old, new, incoming)
+    assert days == {parse_datetime("2021-01-10T00:00:00Z"), parse_datetime("2021-01-14T00:00:00Z")}
+
+
+def test_builtin_coefficients(tmp_path, monkeypatch):
+    """A set whose coefficients are in the code has nothing to recalibrate."""
+    assert len(changed_rows(pd.DataFrame({}), pd.DataFrame({}))) == 0
+    incoming = tmp_path.joinpath('incoming')
+    touch_days(incoming, 'scripps_pier_scs', [1, 2])
+    incoming.joinpath('cals').mkdir()
+    incoming.joinpath('cals/sio-scs-2022_o2.csv').touch()  # stashed by an earlier run
+
+    def no_run(**kwargs):
+        raise AssertionError('nothing should be redone')
+
+    monkeypatch.setattr(pd, 'read_excel', no_run)
+    assert recalibrate('sio-scs-2022', runner=no_run, config_path=here.joinpath(
+        instrument_set_filename), incoming_dir=incoming) is None
@@ -4,7 +4,9 @@
 """Test bits of sass_runner class and methods."""
 
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
+import pandas as pd
 import pytest
 
 from ..utilities import parse_datetime
@@ -43,3 +45,56 @@ def test_bad_dates():
     end = parse_datetime("2102-07-27T00:00:00Z")
     runner = SassCalibrationRunner()
     assert 1 == runner.run(start=start, end=end, set_id='sio-ctd-2021')
+
+
+def test_runs_share_nothing(tmp_path, np_incoming, np_cals):
+    """A runner with its own directories can do runs at the same time.
+
+    The coefficients passed in are the same afterwards, so they can be used again.
+    """
+    incoming = np_incoming([26, 27, 28])
+    outgoing = tmp_path.joinpath('calibrated')
+    cals = np_cals
+    before = {parameter: df.copy() for parameter, df in cals.items()}
+
+    runner = SassCalibrationRunner(config_path=here.joinpath(instrument_set_filename),
+                                   incoming_dir=incoming, outgoing_dir=outgoing)
+    days = [parse_datetime(f'2021-02-{day}T00:00:00Z') for day in [26, 27, 28]]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(lambda day: runner.run(start=day, end=day, set_id='np-ctd-2016b',
+                                                       cals=cals), days))
+    assert results == [None, None, None]
+    for parameter, df in cals.items():
+        pd.testing.assert_frame_equal(df, before[parameter])
+
+    written = [pd.read_csv(outgoing.joinpath(f'newport_pier/2021-02/data-202102{day}.dat'))
+               for day in [26, 27, 28]]
+    assert written[0]['o2'].notna().any()
+    for other in written[1:]:
+        pd.testing.assert_frame_equal(other, written[0])
+    assert incoming.joinpath('cals/np-ctd-2016b_o2.csv').exists()
+
+
+def test_stash_after_success(tmp_path, np_incoming, np_cals):
+    """The coefficients are only stashed for recalibrate.py once a run has succeeded."""
+    incoming = np_incoming([26])
+    cals = np_cals
+    stash = incoming.joinpath('cals/np-ctd-2016b_chlor.csv')
+    day = parse_datetime('2021-02-26T00:00:00Z')
+
+    class FailingRunner(SassCalibrationRunner):
+        def calibrate_file(self, job, file, data, ctd_data=None):
+            raise RuntimeError('on purpose')
+
+    runner = FailingRunner(config_path=here.joinpath(instrument_set_filename),
+                           incoming_dir=incoming, outgoing_dir=tmp_path.joinpath('calibrated'))
+    with pytest.raises(RuntimeError):
+        runner.run(start=day, end=day, set_id='np-ctd-2016b', cals=cals)
+    assert not stash.exists()
+
+    runner = SassCalibrationRunner(config_path=here.joinpath(instrument_set_filename),
+                                   incoming_dir=incoming,
+                                   outgoing_dir=tmp_path.joinpath('calibrated'))
+    assert runner.run(start=day, end=day, set_id='np-ctd-2016b', cals=cals) is None
+    assert pd.read_csv(stash)['Scale Factor'].tolist() == [10.0]
+    assert not list(incoming.joinpath('cals').glob('*.tmp'))
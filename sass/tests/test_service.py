@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the HTTP calibration service on localhost."""
+
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..api import Calibrator
+from ..service import CalibrationServer
+
+here = Path(__file__).parent
+raw_file = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+
+
+@pytest.fixture
+def server(tmp_path, chlor_sheet):
+    """Run the service on any free port."""
+    cals = tmp_path.joinpath('chlor.csv')
+    chlor_sheet.to_csv(cals, index=False)
+    calibrator = Calibrator(cal_paths={('sio-ctd-2016', 'chlor'): cals})
+    server = CalibrationServer(('127.0.0.1', 0), calibrator)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, data, content_type, accept='application/json'):
+    """POST and return the response."""
+    request = urllib.request.Request(url, data=data, method='POST',
+                                     headers={'Content-Type': content_type, 'Accept': accept})
+    return urllib.request.urlopen(request, timeout=30)
+
+
+def test_csv_and_json(server, chlor_cals):
+    """Raw lines as CSV or JSON give the same calibrated values as the in-memory API."""
+    text = raw_file.read_text(encoding='ISO-8859-1')
+    lines = text.splitlines()
+    expected = Calibrator().calibrate('sio-ctd-2016', text, coefficients={'chlor': chlor_cals})
+
+    with post(f'{server}/calibrate/sio-ctd-2016', text.encode('ISO-8859-1'), 'text/csv',
+              accept='text/csv') as response:
+        assert 'calibrate;dur=' in response.headers['Server-Timing']
+        calibrated = pd.read_csv(io.BytesIO(response.read()))
+    assert list(calibrated['chlor']) == list(expected['chlor'])
+
+    body = json.dumps({'lines': lines}).encode()
+    with post(f'{server}/calibrate/sio-ctd-2016', body, 'application/json') as response:
+        result = json.loads(response.read())
+    assert [row[result['columns'].index('chlor')] for row in result['data']] \
+        == list(expected['chlor'])
+
+    rows = [line.split(',') for line in lines]
+    body = json.dumps({'rows': rows}).encode()
+    with post(f'{server}/calibrate/sio-ctd-2016', body, 'application/json') as response:
+        assert json.loads(response.read()) == result
+
+    with urllib.request.urlopen(f'{server}/metrics', timeout=30) as response:
+        metrics = json.loads(response.read())
+    assert metrics['sio-ctd-2016']['requests'] == 3
+    assert metrics['sio-ctd-2016']['rows'] == 3 * len(expected)
+    assert metrics['sio-ctd-2016']['max_ms'] >= metrics['sio-ctd-2016']['p50_ms'] > 0
+
+
+def test_errors(server):
+    """Unknown sets and unreadable requests get an error, not a crash."""
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(f'{server}/calibrate/foo', b'', 'text/csv')
+    assert error.value.code == 404
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(f'{server}/calibrate/sio-ctd-2016', b'{"lines": [', 'application/json')
+    assert error.value.code == 400
+
+    # JSON, but not an object
+    for body in [b'[1]', b'"x"', b'{"lines": [], "ctd": 1}']:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(f'{server}/calibrate/np-ph-2020', body, 'application/json')
+        assert error.value.code == 400
+        assert 'lines' in json.loads(error.value.read())['error']
+
+    with urllib.request.urlopen(f'{server}/health', timeout=30) as response:
+        assert 'sio-ctd-2016' in json.loads(response.read())['sets']
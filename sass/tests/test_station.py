@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test merging the sets of a station on one time axis."""
+
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .. import sass_runner
+from ..utilities import parse_datetime
+from ..instrument_set import InstrumentSet
+from ..station import merge_nearest, station_file
+from ..aggregates import Aggregates
+
+here = Path(__file__).parent
+
+
+def test_merge_nearest():
+    """Each row gets the closest row of the other set, if it is close enough."""
+    base = pd.DataFrame({'time': pd.to_datetime(['2021-01-10T00:00:00Z', '2021-01-10T00:04:00Z',
+                                                 '2021-01-10T00:08:00Z'], utc=True),
+                         'temperature': [15.0, 15.1, 15.2], 'ip': ['a', 'a', 'a']})
+    other = pd.DataFrame({'time': pd.to_datetime(['2021-01-10T00:03:50Z',
+                                                  '2021-01-10T00:11:00Z'], utc=True),
+                          'temperature': [16.0, 16.1], 'corrected_ph': [8.01, 8.02],
+                          'ip': ['b', 'b']})
+    merged = merge_nearest(base, other, 'ph', tolerance='1min')
+    assert list(merged.columns) == ['time', 'temperature', 'ip', 'temperature_ph', 'corrected_ph']
+    assert list(merged['temperature']) == [15.0, 15.1, 15.2]
+    np.testing.assert_array_equal(merged['corrected_ph'], [np.nan, 8.01, np.nan])
+
+
+def test_station_file():
+    """Merged files go in a directory of the station."""
+    station_set = InstrumentSet(set_id='np-ctd-2016b', raw_data_tag='newport_pier')
+    assert station_file('newport_pier_ph/2021-01/data-20210110.dat', station_set) \
+        == 'stations/newport_pier/2021-01/data-20210110.dat'
+
+
+def test_runner_writes_station(tmp_path, monkeypatch, np_cals, ph_cals):
+    """A pH run also writes the calibrated CTD with the pH of the nearest time.
+
+    And statistics of the pH, when asked for.
+    """
+    package = tmp_path.joinpath('sass')
+    shutil.copytree(here.parent.joinpath('config'), package.joinpath('config'))
+    monkeypatch.setattr(sass_runner, 'here', package)
+    incoming = tmp_path.joinpath('data/incoming')
+    incoming.joinpath('cals').mkdir(parents=True)
+
+    # pH from the test file, and CTD lines 4 seconds later
+    ph_file = here.joinpath('resources/raw_data/newport_ph_data-20210110_corrupt.dat')
+    ph_path = incoming.joinpath('newport_pier_ph/2021-01/data-20210110.dat')
+    ph_path.parent.mkdir(parents=True)
+    shutil.copy(ph_file, ph_path)
+    times = pd.read_csv(ph_file, header=None, encoding="ISO-8859-1")[3]
+    times = pd.to_datetime(times, errors='coerce').dropna() + pd.Timedelta(seconds=4)
+    lines = [f'{t:%Y-%m-%dT%H:%M:%S}Z,166.140.102.113,# 14.6406,  3.36201,    3.112, 0.0000, '
+             f'17.733, 0.762641,  26.9209, {t:%d %b %Y %H:%M:%S},  19.8266, 12.5, 222.3\n'
+             for t in times]
+    ctd_path = incoming.joinpath('newport_pier/2021-01/data-20210110.dat')
+    ctd_path.parent.mkdir(parents=True)
+    ctd_path.write_text(''.join(lines))
+
+    cals = {**np_cals, 'ph': ph_cals}
+    monkeypatch.setattr(InstrumentSet, 'get_cals',
+                        lambda self, parameter, path=None: cals[parameter].copy())
+
+    day = parse_datetime('2021-01-10T00:00:00Z')
+    runner = sass_runner.SassCalibrationRunner(
+        merge_tolerance='1min', aggregates_dir=tmp_path.joinpath('data/aggregates'))
+    assert runner.run(start=day, end=day, set_id='np-ph-2020') is None
+
+    calibrated = tmp_path.joinpath('data/calibrated')
+    ph = pd.read_csv(calibrated.joinpath('newport_pier_ph/2021-01/data-20210110.dat'))
+    station = pd.read_csv(calibrated.joinpath('stations/newport_pier/2021-01/data-20210110.dat'))
+    assert len(station) == len(lines)
+    assert {'chlor', 'o2', 'corrected_ph', 'temperature_ph', 'sensor_time_ph'} \
+        <= set(station.columns)
+    assert station['chlor'].notna().all()
+    assert sorted(station['corrected_ph']) == sorted(ph['corrected_ph'])
+
+    daily = Aggregates(tmp_path.joinpath('data/aggregates')).read('np-ph-2020', 'daily')
+    assert daily['corrected_ph_count'].sum() == len(ph)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test calibrating a stream of raw lines."""
+
+import io
+import sys
+import queue
+import threading
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ..api import Calibrator
+from ..stream import batches, stream
+
+here = Path(__file__).parent
+raw_file = here.joinpath('resources/raw_data/sio_data-20210826.dat')
+
+
+@pytest.fixture
+def chlor_csv(tmp_path, chlor_sheet):
+    """Write chlorophyll coefficients like the ones stashed in data/incoming/cals."""
+    path = tmp_path.joinpath('chlor.csv')
+    chlor_sheet.to_csv(path, index=False)
+    return path
+
+
+def test_batches():
+    """Batches end when full, when the lines stop coming for a while, or at the end."""
+    lines = queue.Queue()
+    for line in 'abcde':
+        lines.put(line)
+    gen = batches(lines, size=2, wait=0.05)
+    assert next(gen) == ['a', 'b']
+    assert next(gen) == ['c', 'd']
+    assert next(gen) == ['e']  # nothing else arrived in time
+    lines.put('f')
+    lines.put(None)
+    assert list(gen) == [['f']]
+
+
+def test_same_as_whole_file(chlor_csv):
+    """Streaming in small batches gives the same rows as calibrating the whole file."""
+    calibrator = Calibrator(cal_paths={('sio-ctd-2016', 'chlor'): chlor_csv})
+    text = raw_file.read_text(encoding='ISO-8859-1')
+    expected = calibrator.calibrate('sio-ctd-2016', text).drop(columns=['time'])
+
+    out = io.StringIO()
+    rows = stream(calibrator, 'sio-ctd-2016', io.StringIO(text), out, size=25)
+    assert rows == len(expected)
+    streamed = pd.read_csv(io.StringIO(out.getvalue()))
+    pd.testing.assert_frame_equal(streamed, pd.read_csv(io.StringIO(expected.to_csv(index=False))))
+
+
+def test_prompt_output(chlor_csv):
+    """Calibrated lines come out before the input ends."""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'sass.stream', '--set', 'sio-ctd-2016', '--ms', '100',
+         '--cals', f'chlor={chlor_csv}'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        cwd=here.parents[1])
+    lines = raw_file.read_bytes().splitlines(keepends=True)[:3]
+    process.stdin.write(b''.join(lines))
+    process.stdin.flush()
+
+    output = []
+    reader = threading.Thread(target=lambda: output.extend(
+        process.stdout.readline() for _ in range(4)))
+    reader.start()
+    reader.join(timeout=30)
+    alive = reader.is_alive()
+    process.stdin.close()
+    process.wait(timeout=30)
+
+    assert not alive
+    assert output[0].startswith(b'server_time,')
+    assert len(output) == 4
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the shared queue of days to calibrate."""
+
+import json
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from ..utilities import parse_datetime
+from ..sass_runner import SassCalibrationRunner, cal_path
+from ..work_queue import Task, WorkQueue, Processor, find_tasks, work
+
+here = Path(__file__).parent
+config_path = here.parent.joinpath('config/instrument_sets.json')
+
+
+def record_run(task):
+    """Stand in for the runner that writes down which worker did what. Fails for the 3rd."""
+    with open(Path(task.worker.split('|')[0]), 'a') as f:
+        f.write(f'{task.set_id} {task.day.date()} {task.worker}\n')
+    time.sleep(0.01)
+    return 1 if task.day.day == 3 else None
+
+
+def node(queue_path, log_path, name):
+    """A worker on another machine."""
+    queue = WorkQueue(queue_path, lease=60, attempts=2)
+    return work(queue, worker=f'{log_path}|{name}', run=record_run)
+
+
+def days(n):
+    """Tasks for the first n days of January 2021."""
+    return [('sio-ctd-2016', parse_datetime(f'2021-01-{d:02d}T00:00:00Z')) for d in range(1, n + 1)]
+
+
+def test_workers_share_queue(tmp_path):
+    """Processes standing in for nodes do each task once, and failures are retried."""
+    queue_path = tmp_path.joinpath('queue.sqlite')
+    log_path = tmp_path.joinpath('log.txt')
+    queue = WorkQueue(queue_path)
+    assert queue.enqueue(days(20)) == 20
+    assert queue.enqueue(days(20)) == 0  # already there
+
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(node, [queue_path] * 3, [log_path] * 3, ['a', 'b', 'c']))
+
+    assert sum(done for done, failed in results) == 19
+    assert sum(failed for done, failed in results) == 2  # the 3rd, twice
+    assert queue.counts() == {'pending': 0, 'running': 0, 'done': 19, 'failed': 1}
+    assert [(s, d) for s, d, error in queue.failures()] == [('sio-ctd-2016', '2021-01-03')]
+    lines = log_path.read_text().splitlines()
+    done = [line.split()[1] for line in lines]
+    assert len(lines) == 21 and len(set(done)) == 20
+
+    assert queue.enqueue(days(3), again=True) == 3
+    assert queue.counts()['pending'] == 3
+
+
+def test_lease_runs_out(tmp_path):
+    """A task whose worker stopped is claimed again, and the first worker can't finish it."""
+    queue = WorkQueue(tmp_path.joinpath('queue.sqlite'), lease=0.2)
+    queue.enqueue(days(1))
+    first = queue.claim('first')
+    assert first.attempts == 1
+    assert queue.claim('second') is None
+    assert queue.renew(first)
+
+    time.sleep(0.3)
+    second = queue.claim('second')
+    assert second.worker == 'second' and second.attempts == 2
+    assert not queue.renew(first)
+    assert not queue.finish(first)
+    assert queue.finish(second)
+    assert queue.counts()['done'] == 1
+
+
+def test_lease_runs_out_on_last_attempt(tmp_path):
+    """A task whose worker stopped on its last attempt is failed rather than claimed again."""
+    queue = WorkQueue(tmp_path.joinpath('queue.sqlite'), lease=0.1, attempts=2)
+    queue.enqueue(days(1))
+    assert queue.claim('first').attempts == 1
+    time.sleep(0.2)
+    assert queue.claim('second').attempts == 2
+    time.sleep(0.2)
+    assert queue.claim('third') is None
+    assert queue.counts() == {'pending': 0, 'running': 0, 'done': 0, 'failed': 1}
+    assert queue.failures() == [('sio-ctd-2016', '2021-01-01', 'the lease ran out')]
+
+
+class CountingRunner(SassCalibrationRunner):
+    """Counts the runs it prepares."""
+
+    prepared = 0
+
+    def prepare(self, **kwargs):
+        """Same as a runner's."""
+        self.prepared += 1
+        return super().prepare(**kwargs)
+
+
+def test_processor(tmp_path, np_incoming, np_cals):
+    """Tasks are found from the raw files and calibrated with a runner prepared once."""
+    incoming = np_incoming([26, 28])
+    tasks = find_tasks(parse_datetime('2021-02-25T00:00:00Z'),
+                       parse_datetime('2021-03-01T00:00:00Z'), set_ids=['np-ctd-2016b'],
+                       config_path=config_path, incoming_dir=incoming)
+    assert [(s, d.day) for s, d in tasks] == [('np-ctd-2016b', 26), ('np-ctd-2016b', 28)]
+
+    queue = WorkQueue(tmp_path.joinpath('queue.sqlite'))
+    queue.enqueue(tasks)
+    outgoing = tmp_path.joinpath('calibrated')
+    runner = CountingRunner(config_path=config_path, incoming_dir=incoming, outgoing_dir=outgoing)
+    processor = Processor(runner)
+    processor.cals['np-ctd-2016b'] = np_cals
+    assert work(queue, worker='here', run=processor) == (2, 0)
+    for day in [26, 28]:
+        calibrated = pd.read_csv(outgoing.joinpath(f'newport_pier/2021-02/data-202102{day}.dat'))
+        assert calibrated['o2'].notna().any()
+    assert runner.prepared == 1
+    assert cal_path('np-ctd-2016b', 'o2', incoming).exists()
+
+    with pytest.raises(ValueError):
+        Processor(SassCalibrationRunner(config_path=config_path, incoming_dir=incoming,
+                                        outgoing_dir=outgoing,
+                                        aggregates_dir=tmp_path.joinpath('aggregates')))
+
+
+def test_first_day(tmp_path, np_incoming, np_cals):
+    """The day a set starts is calibrated even though the set starts during it."""
+    config = json.loads(config_path.read_text())
+    for this_set in config['sets']:
+        if this_set['set_id'] == 'np-ctd-2016b':
+            this_set['start_date'] = '2021-02-26T20:00:00Z'
+    late_start = tmp_path.joinpath('instrument_sets.json')
+    late_start.write_text(json.dumps(config))
+    incoming = np_incoming([26, 28])
+    tasks = find_tasks(parse_datetime('2021-02-25T00:00:00Z'),
+                       parse_datetime('2021-03-01T00:00:00Z'), set_ids=['np-ctd-2016b'],
+                       config_path=late_start, incoming_dir=incoming)
+    assert [d.day for _, d in tasks] == [26, 28]
+
+    queue = WorkQueue(tmp_path.joinpath('queue.sqlite'))
+    queue.enqueue(tasks)
+    outgoing = tmp_path.joinpath('calibrated')
+    runner = SassCalibrationRunner(config_path=late_start, incoming_dir=incoming,
+                                   outgoing_dir=outgoing)
+    processor = Processor(runner)
+    processor.cals['np-ctd-2016b'] = np_cals
+    assert work(queue, worker='here', run=processor) == (2, 0)
+
+    # also when the set was prepared for a later day first
+    processor = Processor(runner)
+    processor.cals['np-ctd-2016b'] = np_cals
+    assert processor(Task('np-ctd-2016b', parse_datetime('2021-02-28T00:00:00Z'))) is None
+    assert processor(Task('np-ctd-2016b', parse_datetime('2021-02-26T00:00:00Z'))) is None
+    assert processor(Task('np-ctd-2016b', parse_datetime('2021-02-25T00:00:00Z'))) == 1
@@ -3,7 +3,11 @@
 
 """Various helpful routines from packrat and other stuff."""
 
+import sys
 import math
+import sqlite3
+import logging
+from contextlib import closing
 
 import requests
 from dateutil import tz, parser
@@ -73,3 +77,51 @@ def proper_rounding(n, ndigits):
     else:
         part = math.floor(part)
     return part / (10 ** ndigits)
+
+
+def log_to_stderr(logger):
+    """Send log messages to stderr instead of stdout, for programs that write data to stdout.
+
+    :param logger: the package logger
+    """
+    for handler in logger.handlers + logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.stderr)
+
+
+def connect_sqlite(path, immediate=False):
+    """A new connection to a SQLite file, to use in a with statement (see Transaction).
+
+    Each call has its own connection, so the file can be shared by threads and processes.
+
+    :param path: Posix path of the SQLite file
+    :param immediate: if True, take the write lock when the transaction starts rather than at
+        its first write, so transactions that read then write (like claims) don't collide
+    :return: Transaction
+    """
+    db = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+    return Transaction(db, immediate)
+
+
+class Transaction:
+    """Runs a SQLite connection's statements in one transaction, then closes it."""
+
+    def __init__(self, db, immediate=False):
+        """Wrap a connection.
+
+        :param db: sqlite3 Connection with isolation_level None
+        :param immediate: if True, take the write lock when the transaction starts
+        """
+        self.db = db
+        self.immediate = immediate
+
+    def __enter__(self):
+        """Start the transaction."""
+        self.db.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        """Commit (or roll back after an error) and close."""
+        with closing(self.db):
+            if self.db.in_transaction:  # executescript commits what came before it
+                self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
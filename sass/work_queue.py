@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A queue of days to calibrate, kept in a SQLite file that workers on several machines share.
+
+When several machines mount the same data/incoming and data/calibrated, put the queue next to
+them and fill it with a task for each (set, day) that has raw data:
+
+sass-queue --queue /mnt/sass/queue.sqlite enqueue -t1 2016-01-01 -t2 2021-12-31
+
+then start workers on any of the machines (as many as they have cores):
+
+sass-queue --queue /mnt/sass/queue.sqlite work
+
+A worker claims a task by taking a lease on it for a while (10 minutes by default), renews the
+lease while it works, and marks the task done or failed at the end. If a worker or its machine
+dies, its lease runs out and another worker claims the task again. A worker whose lease ran out
+can't mark the task any more, so a task is only recorded once. Failed tasks (and tasks whose
+worker died) are tried again up to --attempts times. `sass-queue status` shows the count of
+tasks in each state.
+
+Claims are made inside a SQLite write transaction, so the filesystem must support file locks
+(NFSv4 and most cluster filesystems do; old NFS mounted with nolock does not).
+"""
+
+import os
+import time
+import socket
+import argparse
+import datetime
+import threading
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+
+from sass import logger, utilities
+
+from . import sass_runner
+from .discovery import find_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    set_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    finished TEXT,
+    PRIMARY KEY (set_id, day)
+)
+"""
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+
+class Task:
+    """One instrument set for one day, claimed by a worker."""
+    def __init__(self, set_id, day, worker=None, attempts=0):
+        """Describe a task.
+
+        :param set_id: unique identifier of the instrument set (string)
+        :param day: datetime of the day (UTC)
+        :param worker: name of the worker that claimed it
+        :param attempts: number of times it has been claimed, including this one
+        """
+        self.set_id = set_id
+        self.day = day
+        self.worker = worker
+        self.attempts = attempts
+
+    def __repr__(self):
+        """Returns a printable string."""
+        return str(self)
+
+    def __str__(self):
+        """Returns a summary of the Task."""
+        return f'Task{{{self.set_id}/{self.day.date()},worker={self.worker}}}'
+
+
+class WorkQueue:
+    """Tasks in a SQLite file that any number of processes can share."""
+
+    def __init__(self, path, lease=600, attempts=3):
+        """Open (or create) the queue.
+
+        :param path: Posix path of the SQLite file
+        :param lease: seconds a claim lasts before another worker can take the task
+        :param attempts: number of times a task is tried before it is left as failed
+        """
+        self.path = Path(path)
+        self.lease = lease
+        self.attempts = attempts
+        with self.connect() as db:
+            db.execute(SCHEMA)
+
+    def connect(self):
+        """A new connection. Each call has its own, so the queue can be used after a fork.
+
+        :return: utilities.Transaction that gives a sqlite3 Connection in a with statement,
+            holding the write lock so claims don't collide
+        """
+        return utilities.connect_sqlite(self.path, immediate=True)
+
+    def enqueue(self, tasks, again=False):
+        """Add tasks.
+
+        :param tasks: list of (set_id, datetime of the day)
+        :param again: if True, tasks that are already in the queue are set to pending again
+            (like after a coefficient fix). Otherwise they are left alone.
+        :return: number of tasks added or set to pending
+        """
+        rows = [(set_id, day.strftime('%Y-%m-%d')) for set_id, day in tasks]
+        with self.connect() as db:
+            before = db.total_changes
+            if again:
+                db.executemany("INSERT INTO tasks (set_id, day) VALUES (?, ?) "
+                               "ON CONFLICT (set_id, day) DO UPDATE SET status = 'pending', "
+                               "worker = NULL, lease_until = NULL, attempts = 0, error = NULL",
+                               rows)
+            else:
+                db.executemany('INSERT OR IGNORE INTO tasks (set_id, day) VALUES (?, ?)', rows)
+            return db.total_changes - before
+
+    def claim(self, worker):
+        """Take the next task that is pending, or whose lease ran out with attempts left.
+
+        Tasks whose lease ran out on their last attempt are marked failed.
+
+        :param worker: name of the worker
+        :return: Task, or None if there's nothing to do
+        """
+        now = time.time()
+        with self.connect() as db:
+            # a worker that stopped on the last attempt used it up
+            db.execute("UPDATE tasks SET status = 'failed', worker = NULL, lease_until = NULL, "
+                       "error = 'the lease ran out', finished = ? WHERE status = 'running' "
+                       "AND lease_until < ? AND attempts >= ?",
+                       (datetime.datetime.utcnow().isoformat(), now, self.attempts))
+            row = db.execute(
+                "SELECT set_id, day, attempts FROM tasks WHERE status = 'pending' "
+                "OR (status = 'running' AND lease_until < ? AND attempts < ?) "
+                "ORDER BY day, set_id LIMIT 1", (now, self.attempts)).fetchone()
+            if row is None:
+                return None
+            set_id, day, attempts = row
+            db.execute("UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, "
+                       "attempts = attempts + 1 WHERE set_id = ? AND day = ?",
+                       (worker, now + self.lease, set_id, day))
+        return Task(set_id, utilities.parse_datetime(day + 'T00:00:00Z'), worker, attempts + 1)
+
+    def renew(self, task):
+        """Extend the lease of a task that is still being worked on.
+
+        :param task: Task from claim
+        :return: False if the lease already ran out and someone else has the task
+        """
+        with self.connect() as db:
+            changed = db.execute("UPDATE tasks SET lease_until = ? WHERE set_id = ? AND day = ? "
+                                 "AND status = 'running' AND worker = ?",
+                                 (time.time() + self.lease, task.set_id, self.day(task),
+                                  task.worker)).rowcount
+        return changed == 1
+
+    def finish(self, task, error=None):
+        """Mark a task done, or failed (to be tried again if it has attempts left).
+
+        :param task: Task from claim
+        :param error: optional description of why it failed. If omitted, it's done.
+        :return: False if the worker's lease ran out and someone else has the task
+        """
+        if error is None:
+            status = 'done'
+        else:
+            status = 'pending' if task.attempts < self.attempts else 'failed'
+        with self.connect() as db:
+            changed = db.execute(
+                "UPDATE tasks SET status = ?, worker = NULL, lease_until = NULL, error = ?, "
+                "finished = ? WHERE set_id = ? AND day = ? AND status = 'running' AND worker = ?",
+                (status, error, datetime.datetime.utcnow().isoformat(), task.set_id,
+                 self.day(task), task.worker)).rowcount
+        return changed == 1
+
+    def counts(self):
+        """Number of tasks in each state.
+
+        :return: dictionary by status
+        """
+        counts = dict.fromkeys(STATUSES, 0)
+        with self.connect() as db:
+            for status, count in db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status'):
+                counts[status] = count
+        return counts
+
+    def failures(self):
+        """Tasks that ran out of attempts.
+
+        :return: list of (set_id, day, error)
+        """
+        with self.connect() as db:
+            return db.execute("SELECT set_id, day, error FROM tasks WHERE status = 'failed' "
+                              "ORDER BY day, set_id").fetchall()
+
+    @staticmethod
+    def day(task):
+        """How the day of a task is written in the queue."""
+        return task.day.strftime('%Y-%m-%d')
+
+
+def find_tasks(start, end, set_ids=None, config_path=None, incoming_dir=None):
+    """The (set, day)s with raw data.
+
+    :param start: datetime of earliest date
+    :param end: datetime of latest date
+    :param set_ids: list of set_ids to include. If omitted, all active sets
+    :param config_path: Posix path to JSON configuration file
+    :param incoming_dir: Posix path to the directory where raw data are found
+    :return: list of (set_id, datetime of the day)
+    """
+    config_path = config_path or sass_runner.here.joinpath(sass_runner.instrument_set_filename)
+    incoming_dir = Path(incoming_dir or sass_runner.here.joinpath(sass_runner.incoming))
+
+    tasks = []
+    for this_set in sass_runner.load_configs(config_path):
+        if set_ids and this_set.set_id not in set_ids:
+            continue
+        if not this_set.start_date:
+            continue  # not active yet
+        tasks.extend((this_set.set_id, f.day) for f in find_files(
+            this_set, max(start, this_set.start_date), min(end, this_set.end_date), incoming_dir))
+    return tasks
+
+
+class Processor:
+    """Calibrates tasks with a runner, preparing each set once.
+
+    The set, its coefficients and the salinity set for pH are found for the first task of a set
+    and used for the rest, and the coefficients are stashed after the first day of the set that
+    succeeds (see SassCalibrationRunner.stash_cals).
+    """
+
+    def __init__(self, runner=None):
+        """Set up the processing.
+
+        :param runner: SassCalibrationRunner. If omitted, one with the usual settings. It can't
+            write to an array store or aggregates, since workers on other machines can't take
+            turns updating a month file.
+        """
+        self.runner = runner or sass_runner.SassCalibrationRunner()
+        if self.runner.store or self.runner.aggregates:
+            raise ValueError('Queue workers can not write to an array store or aggregates.')
+        self.cals = {}  # coefficients by set_id, to use instead of downloading them
+        self.jobs = {}  # by set_id
+        self.stashed = set()
+
+    def __call__(self, task):
+        """Calibrate the day of a task.
+
+        :param task: Task
+        :return: None if successful, 1 if not (same as SassCalibrationRunner.run)
+        """
+        # the whole day, since a set can start or end during one
+        end = task.day + relativedelta(days=1, microseconds=-1)
+        job = self.jobs.get(task.set_id)
+        if job is None:
+            job = self.runner.prepare(start=task.day, end=end, set_id=task.set_id,
+                                      cals=self.cals.get(task.set_id))
+            if job is None:
+                return 1
+            self.jobs[task.set_id] = job
+        else:
+            this_set = job.this_set
+            if end < this_set.start_date or task.day > this_set.end_date:
+                logger.error(f'{this_set.set_id} is not active on {task.day.date()}.')
+                return 1
+            files = [f.name for f in find_files(this_set, task.day, end,
+                                                self.runner.incoming_dir,
+                                                index=self.runner.file_index)]
+            if self.runner.file_index:
+                self.runner.file_index.save()
+            job = sass_runner.Job(this_set, files, job.parameters, job.cals, job.salinity_set,
+                                  job.salinity_cals)
+
+        code = self.runner.process(job)
+        if code is None and task.set_id not in self.stashed:
+            self.runner.stash_cals(job)
+            self.stashed.add(task.set_id)
+        return code
+
+
+def work(queue, worker=None, run=None, max_tasks=None):
+    """Claim and do tasks until the queue has nothing left.
+
+    :param queue: WorkQueue
+    :param worker: name of this worker. If omitted, the host name and process id.
+    :param run: function that processes a Task and returns None if successful. If omitted,
+        a Processor with the usual runner.
+    :param max_tasks: optional number of tasks to do before stopping
+    :return: (number of tasks done, number that failed)
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    run = run or Processor()
+    done = failed = 0
+    while max_tasks is None or done + failed < max_tasks:
+        task = queue.claim(worker)
+        if task is None:
+            break
+        logger.info(f'{worker} claimed {task}')
+
+        # keep the lease while working
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(queue.lease / 3):
+                if not queue.renew(task):
+                    logger.warning(f'{worker} lost the lease of {task}')
+                    return
+
+        renewing = threading.Thread(target=heartbeat, daemon=True)
+        renewing.start()
+        try:
+            code = run(task)
+            error = f'returned {code}' if code else None
+        except Exception as e:
+            logger.exception(f'{task} failed')
+            error = repr(e)
+        finally:
+            stop.set()
+            renewing.join()
+
+        if not queue.finish(task, error):
+            logger.warning(f'{worker} lost the lease of {task}. Another worker has it.')
+        if error:
+            failed += 1
+        else:
+            done += 1
+    logger.info(f'{worker} did {done} tasks, {failed} failed')
+    return done, failed
+
+
+def main():
+    """Organizes the input arguments to fill, work on or check a queue."""
+    parser = argparse.ArgumentParser(description='Spread the calibration of SASS data over '
+                                                 'machines that share the data directories.')
+    parser.add_argument('-q', '--queue', dest='queue', required=True, type=str,
+                        help='SQLite file of the queue, on the shared filesystem.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Add a task for each set and day '
+                                                           'with raw data.')
+    enqueue_parser.add_argument('-t1', '--start', dest='start', required=True, type=str,
+                                help='Start date as yyyy-mm-dd.')
+    enqueue_parser.add_argument('-t2', '--end', dest='end', required=True, type=str,
+                                help='End date as yyyy-mm-dd.')
+    enqueue_parser.add_argument('-s', '--set', dest='set_ids', action='append',
+                                help='Id of a set of instruments to include. Can be repeated. '
+                                     'If omitted, all active instrument sets.')
+    enqueue_parser.add_argument('--again', dest='again', action='store_true',
+                                help='Do tasks that are already in the queue again.')
+
+    work_parser = subparsers.add_parser('work', help='Do tasks until there are none left.')
+    work_parser.add_argument('--lease', dest='lease', default=600, type=float,
+                             help='Seconds before the task of a worker that stopped is given '
+                                  'to another.')
+    work_parser.add_argument('--attempts', dest='attempts', default=3, type=int,
+                             help='Times a failing task is tried.')
+    work_parser.add_argument('--worker', dest='worker', type=str,
+                             help='Name of this worker. If omitted, the host name and pid.')
+
+    subparsers.add_parser('status', help='Count the tasks in each state.')
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        queue = WorkQueue(args.queue, lease=args.lease, attempts=args.attempts)
+        done, failed = work(queue, worker=args.worker)
+        if failed:
+            exit(1)
+    elif args.command == 'enqueue':
+        start = utilities.parse_datetime(args.start + "T00:00:00Z")
+        end = utilities.parse_datetime(args.end + "T00:00:00Z")
+        added = WorkQueue(args.queue).enqueue(find_tasks(start, end, set_ids=args.set_ids),
+                                              again=args.again)
+        logger.info(f'Queued {added} tasks')
+    else:
+        queue = WorkQueue(args.queue)
+        logger.info(', '.join(f'{count} {status}' for status, count in queue.counts().items()))
+        for set_id, day, error in queue.failures():
+            logger.info(f'{set_id} {day} failed: {error}')
+
+
+if __name__ == '__main__':
+    main()
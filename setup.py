@@ -31,6 +31,14 @@ setup(
     test_requires    = pip_requirements('dev-requirements.txt'),
     entry_points     = {
         'console_scripts': [
+            'sass-backfill = sass.backfill:main',
+            'sass-calibrate = sass.stream:main',
+            'sass-coverage = sass.coverage:main',
+            'sass-equivalence = sass.equivalence:main',
+            'sass-query = sass.query:main',
+            'sass-queue = sass.work_queue:main',
+            'sass-recalibrate = sass.recalibrate:main',
+            'sass-serve = sass.service:main',
         ],
     },
 )
\ No newline at end of file